@@ -1,20 +1,19 @@
 #!/usr/bin/env python
-import itertools
+import datetime
 import os
 import shutil
 import logging
 import sys
 import click
-import multiprocessing
-from multiprocessing.pool import ThreadPool
 
 from ruv_dl.runtime import settings
-from ruv_dl.programs import ProgramFetcher
-from ruv_dl.mover import Mover
-from ruv_dl.crawler import Crawler
-from ruv_dl.downloader import Downloader
-from ruv_dl.migrations import MIGRATIONS
-from ruv_dl.constants import DEFAULT_VIDEO_DESTINATION, CACHE_LOCATION
+from ruv_dl.date_utils import parse_time_of_day
+from ruv_dl.constants import (
+    DEFAULT_VIDEO_DESTINATION,
+    CACHE_LOCATION,
+    DEFAULT_BITRATE,
+    MATCH_RULES,
+)
 
 
 logger = logging.getLogger('ruv_dl')
@@ -26,6 +25,43 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(logging.WARN)
 
+# Commands import what they need when they run. Keep module level imports
+# light, `ruv-dl mv` is run in loops from scripts and startup time adds up.
+
+
+def validate_bitrate(ctx, param, value):
+    from ruv_dl.bitrate import BitratePolicy
+
+    try:
+        return BitratePolicy(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def validate_bandwidth(ctx, param, value):
+    from ruv_dl.bandwidth import parse_schedule
+
+    try:
+        windows, default = parse_schedule(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    if default == 0 and all(window.rate == 0 for window in windows):
+        # Nothing would ever lift the pause and downloads would wait forever
+        raise click.BadParameter(
+            'Downloads would never resume, give the pause a time window, '
+            'e.g. 08:00-18:00=0'
+        )
+    return tuple(value)
+
+
+bitrate_option = click.option(
+    '--bitrate',
+    default=str(DEFAULT_BITRATE),
+    callback=validate_bitrate,
+    help='Rendition to download: a bitrate in kbps, "highest", "lowest" '
+    'or "max:<kbps>" for the highest bitrate within a budget.',
+)
+
 
 @click.group()
 @click.option('--dryrun/--no-dryrun', default=False)
@@ -38,30 +74,124 @@ logger.setLevel(logging.WARN)
     type=click.Path(),
     help='Top level destination directory.',
 )
+@click.option(
+    '--probe-rate',
+    type=click.FLOAT,
+    default=settings.probe_rate,
+    help='Maximum requests per second when looking for episodes, 0 for '
+    'unlimited.',
+)
+@click.option(
+    '--max-probes',
+    type=click.INT,
+    default=settings.max_probes,
+    help='Maximum parallel requests when looking for episodes. Lowered '
+    'automatically when the server is throttling us.',
+)
+@click.option(
+    '--api-cache-ttl',
+    type=click.INT,
+    default=settings.api_cache_ttl // 60,
+    help='Minutes to use cached program data before asking the API if it '
+    'changed.',
+)
+@click.option(
+    '--api-cache-size',
+    type=click.INT,
+    default=settings.api_cache_size,
+    help='Maximum size of cached program data in MB.',
+)
+@click.option(
+    '--disk-headroom',
+    type=click.INT,
+    default=settings.disk_headroom,
+    help='MB to keep free on the destination volume. Downloads that would '
+    'use it are deferred.',
+)
+@click.option(
+    '--bandwidth',
+    multiple=True,
+    callback=validate_bandwidth,
+    metavar='[HH:MM-HH:MM=]RATE',
+    help='Cap download bandwidth, e.g. 20Mbit, 500kbit or 2MB per second. '
+    'With a time window the cap only applies then, e.g. '
+    '08:00-18:00=20Mbit. Can be specified multiple times, downloads are '
+    'unlimited outside the windows unless a rate without a window is '
+    'given. Use 0 to pause downloads during a window.',
+)
+@click.option(
+    '--profile',
+    default=False,
+    is_flag=True,
+    help='Report time spent fetching, crawling, organizing and '
+    'downloading, per program.',
+)
+@click.option(
+    '--profile-dir',
+    default=None,
+    type=click.Path(file_okay=False),
+    help='Also dump cProfile stats for each phase to this directory. '
+    'Implies --profile.',
+)
 @click.pass_context
-def cli(ctx, dryrun, verbosity, empty_cache, destination):
+def cli(
+    ctx,
+    dryrun,
+    verbosity,
+    empty_cache,
+    destination,
+    probe_rate,
+    max_probes,
+    api_cache_ttl,
+    api_cache_size,
+    disk_headroom,
+    bandwidth,
+    profile,
+    profile_dir,
+):
     with settings:
         settings.dryrun = dryrun
+        settings.probe_rate = probe_rate
+        settings.max_probes = max_probes
+        settings.api_cache_ttl = api_cache_ttl * 60
+        settings.api_cache_size = api_cache_size
+        settings.disk_headroom = disk_headroom
+        settings.bandwidth = bandwidth
+        settings.profile = profile or bool(profile_dir)
+        settings.profile_dir = profile_dir or ''
     ctx.obj['dryrun'] = dryrun
     ctx.obj['destination'] = destination
     if verbosity is not None:
-        multiprocessing_logger = multiprocessing.get_logger()
-        if verbosity > 2:
-            multiprocessing_logger.addHandler(handler)
-            multiprocessing_logger.setLevel(logging.DEBUG)
         if verbosity > 1:
-            logger.setLevel(logging.DEBUG)
+            import multiprocessing
+
+            multiprocessing_logger = multiprocessing.get_logger()
             multiprocessing_logger.addHandler(handler)
-            multiprocessing_logger.setLevel(logging.INFO)
+            multiprocessing_logger.setLevel(
+                logging.DEBUG if verbosity > 2 else logging.INFO
+            )
+            logger.setLevel(logging.DEBUG)
         elif verbosity > 0:
             logger.setLevel(logging.INFO)
 
+    if settings.profile:
+        ctx.call_on_close(report_profile)
+
     if empty_cache:
         if os.path.exists(CACHE_LOCATION):
             shutil.rmtree(CACHE_LOCATION)
     os.makedirs(CACHE_LOCATION, exist_ok=True)
 
 
+def report_profile():
+    from ruv_dl.profiling import get_profiler
+
+    profiler = get_profiler()
+    click.echo(profiler.report(), err=True)
+    for fn in profiler.dump_stats():
+        click.echo(f'Wrote {fn}', err=True)
+
+
 @cli.command()
 @click.argument(
     'query', nargs=-1, type=click.STRING,
@@ -92,9 +222,50 @@ def cli(ctx, dryrun, verbosity, empty_cache, destination):
     is_flag=True,
     help='Do not run threaded, only download one file at a time.',
 )
+@click.option(
+    '--shard',
+    default=None,
+    metavar='I/N',
+    help='Only update shard I of N (e.g. 0/3) of the synced programs. '
+    'Programs are locked with lease files so several machines can update '
+    'the same destination.',
+)
+@click.option(
+    '--lease-ttl',
+    type=click.INT,
+    default=60,
+    help='Minutes until a lease from a crashed run can be taken over.',
+)
+@click.option(
+    '--match',
+    type=click.Choice(MATCH_RULES),
+    default=MATCH_RULES[0],
+    help='How to pick a program when a query matches several: ask, the '
+    'exact title only, the closest title, or fail unless there is exactly '
+    'one candidate. Queries are resolved in parallel unless interactive.',
+)
+@click.option(
+    '--plan',
+    'plan_fn',
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help='Write what would be downloaded, with file sizes, to this file '
+    'instead of downloading. Run it later with `execute-plan`.',
+)
+@bitrate_option
 @click.pass_context
 def download(
-    ctx, query, update, days_between_episodes, iteration_count, sequential,
+    ctx,
+    query,
+    update,
+    days_between_episodes,
+    iteration_count,
+    sequential,
+    shard,
+    lease_ttl,
+    match,
+    plan_fn,
+    bitrate,
 ):
     '''
         Download ruv programs by searching for query (can specify multiple)
@@ -107,86 +278,239 @@ def download(
             'Query terms and update are mutually exclusive and either must '
             'be included'
         )
+    from ruv_dl.programs import ProgramFetcher
+    from ruv_dl.runner import Runner
+    from ruv_dl.sharding import parse_shard
+
+    if shard is not None:
+        if not update:
+            raise click.UsageError('--shard can only be used with --update')
+        try:
+            shard = parse_shard(shard)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--shard')
+
     os.makedirs(destination, exist_ok=True)
-    fetcher = ProgramFetcher(query, update, destination)
-    with ThreadPool(8) as pool:
-        programs = {}
-        for program in fetcher.get_programs():
-            logger.info(f'------ {program["title"]} [{program["id"]}] ------')
-            crawler = Crawler(
-                days_between_episodes=days_between_episodes,
-                iteration_count=iteration_count,
-                program=program,
-            )
-            programs[program['id']] = {
-                'program': program,
-                'episodes': pool.apply_async(crawler.search_for_episodes),
-            }
-
-        downloaders = []
-        for program_id, data in programs.items():
-            downloader = Downloader(
-                destination=destination,
-                program=data['program'],
-                episode_entries=data['episodes'].get(),
-                threaded=not sequential,
-            )
-            entries = downloader.organize()
-            downloaders.append((downloader, entries))
+    fetcher = ProgramFetcher(
+        query, update, destination, shard=shard, match=match
+    )
+    Runner(
+        destination,
+        days_between_episodes=days_between_episodes,
+        iteration_count=iteration_count,
+        sequential=sequential,
+        lease_ttl=lease_ttl * 60 if shard else None,
+        bitrate_policy=bitrate,
+        plan_fn=plan_fn,
+    ).run(fetcher.get_programs())
 
-    total_entries_to_download = sum(len(entries) for _, entries in downloaders)
-    if not total_entries_to_download:
-        logger.info('No entries to download, bye')
-    else:
-        logger.warning(f'Downloading {total_entries_to_download} files...')
-        if ctx.obj['dryrun']:
-            for downloader, entries in downloaders:
-                logger.info(
-                    '%s - %s',
-                    downloader.program['title'],
-                    downloader.program['id'],
-                )
-                for entry in entries:
-                    logger.info('%s: %d', entry, entry.episode.number)
-            logger.warning('Dryrun, not downloading anything, bye')
-            return
-        if sequential:
-            results = [
-                [downloader.download_file(entry) for entry in entries]
-                for downloader, entries in downloaders
-            ]
-        else:
-            with ThreadPool(8) as pool:
-                pool.__exit__
-                async_results = [
-                    pool.map_async(downloader.download_file, entries)
-                    for downloader, entries in downloaders
-                ]
-                results = [result.get() for result in async_results]
-        logger.warning(
-            f'{len([r for r in itertools.chain(*results) if r])} '
-            'files downloaded'
-        )
+
+@cli.command('execute-plan')
+@click.argument('plan_fn', type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    '--sequential',
+    default=False,
+    is_flag=True,
+    help='Do not run threaded, only download one file at a time.',
+)
+def execute_plan(plan_fn, sequential):
+    '''
+        Download the files in a plan written by `download --plan`.
+    '''
+    from ruv_dl.plan import read_plan
+    from ruv_dl.runner import Runner
+
+    try:
+        plan = read_plan(plan_fn)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='PLAN_FN')
+    Runner(plan['destination'], sequential=sequential).execute_plan(plan)
+
+
+@cli.command()
+@click.option(
+    '--interval',
+    type=click.IntRange(min=1),
+    default=None,
+    help='Minutes between update passes. Defaults to 60 unless --at is '
+    'given.',
+)
+@click.option(
+    '--at',
+    'times',
+    multiple=True,
+    type=parse_time_of_day,
+    metavar='HH:MM',
+    help='Time of day (HH:MM) to run an update pass, e.g. shortly after a '
+    'program airs. Can be specified multiple times.',
+)
+@click.option(
+    '--days-between-episodes',
+    type=click.INT,
+    default=7,
+    help='Rate of episode release',
+)
+@click.option(
+    '--iteration-count',
+    type=click.INT,
+    default=5,
+    help='Maximum passes to allow for no shows found.',
+)
+@click.option(
+    '--sequential',
+    default=False,
+    is_flag=True,
+    help='Do not run threaded, only download one file at a time.',
+)
+@bitrate_option
+@click.pass_context
+def serve(
+    ctx,
+    interval,
+    times,
+    days_between_episodes,
+    iteration_count,
+    sequential,
+    bitrate,
+):
+    '''
+        Keep running and update synced programs on a schedule. Program
+        infos and caches are kept in memory between update passes.
+    '''
+    from ruv_dl.daemon import Daemon
+
+    if interval is None and not times:
+        interval = 60
+    destination = ctx.obj['destination']
+    os.makedirs(destination, exist_ok=True)
+    Daemon(
+        destination,
+        interval=interval and datetime.timedelta(minutes=interval),
+        times=times,
+        days_between_episodes=days_between_episodes,
+        iteration_count=iteration_count,
+        sequential=sequential,
+        bitrate_policy=bitrate,
+    ).serve()
 
 
 @cli.command()
 @click.argument('migration', type=click.INT)
+@click.option(
+    '-j',
+    '--jobs',
+    type=click.INT,
+    default=4,
+    help='Number of programs to migrate in parallel.',
+)
 @click.pass_context
-def migrate(ctx, migration):
+def migrate(ctx, migration, jobs):
+    from ruv_dl.migrations import MIGRATIONS
+
     for entry in MIGRATIONS[migration]:
-        entry(dryrun=ctx.obj['dryrun'], destination=ctx.obj['destination'])
+        entry(
+            dryrun=ctx.obj['dryrun'],
+            destination=ctx.obj['destination'],
+            jobs=jobs,
+        )
 
 
 @cli.command()
-@click.argument('src', type=click.Path(resolve_path=True, exists=True))
-@click.argument('dst', type=click.Path(resolve_path=True))
+@click.argument('paths', nargs=-1, type=click.Path(resolve_path=True))
+@click.option(
+    '-f',
+    '--from-file',
+    type=click.File('r'),
+    help='Read tab separated source and destination pairs, one per line. '
+    'Use - for stdin.',
+)
 @click.pass_context
-def mv(ctx, src, dst):
+def mv(ctx, paths, from_file):
     '''
         Move season or episode to a new destination. Only supports moving
         episodes within a season and seasons within programs.
+
+        Many moves can be done at once by passing SRC DST pairs, e.g.
+        `ruv-dl mv SRC1 DST1 SRC2 DST2`, or with --from-file.
     '''
-    Mover(src, dst).move()
+    from ruv_dl.mover import BatchMover, Mover
+
+    if len(paths) % 2:
+        raise click.UsageError('Paths must be given in SRC DST pairs')
+    pairs = list(zip(paths[::2], paths[1::2]))
+    if from_file:
+        for line in from_file:
+            if not line.strip():
+                continue
+            try:
+                src, dst = line.rstrip('\n').split('\t')
+            except ValueError:
+                raise click.UsageError(f'Expected SRC<tab>DST, got {line}')
+            pairs.append((os.path.abspath(src), os.path.abspath(dst)))
+    if not pairs:
+        raise click.UsageError('Nothing to move')
+    for src, _ in pairs:
+        if not os.path.exists(src):
+            raise click.BadParameter(f'Path "{src}" does not exist.')
+    if len(pairs) == 1:
+        Mover(*pairs[0]).move()
+    else:
+        BatchMover(pairs).move()
+
+
+@cli.command()
+@click.option(
+    '-j',
+    '--jobs',
+    type=click.INT,
+    default=4,
+    help='Number of files to hash in parallel.',
+)
+@click.option(
+    '--processes',
+    default=False,
+    is_flag=True,
+    help='Hash in a process pool instead of a thread pool.',
+)
+@click.pass_context
+def verify(ctx, jobs, processes):
+    '''
+        Re-hash downloaded episodes and report missing, truncated or
+        corrupt files.
+    '''
+    from ruv_dl.verifier import Verifier
+
+    problems = Verifier(
+        ctx.obj['destination'], jobs=jobs, processes=processes
+    ).verify()
+    if problems:
+        ctx.exit(1)
+
+
+@cli.group()
+def cache():
+    '''
+        Manage the cache of episodes found when crawling.
+    '''
+
+
+@cache.command()
+@click.pass_context
+def compact(ctx):
+    '''
+        Rewrite the cache without replaced entries and missing episodes that
+        will be looked for again, migrating caches from older versions.
+    '''
+    from ruv_dl.cache import compact_all
+
+    if ctx.obj['dryrun']:
+        raise click.UsageError('compact does not support --dryrun')
+    total_before = total_after = 0
+    for program_id, before, after in compact_all():
+        logger.info('%s: %d -> %d entries', program_id, before, after)
+        total_before += before
+        total_after += after
+    click.echo(f'Compacted {total_before} cache entries to {total_after}')
 
 
 def main():
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+'''
+    asyncio API for embedding ruv-dl in other programs.
+
+    The API runs the same code as the CLI in a shared, bounded thread pool,
+    so many programs and libraries can be handled concurrently from one
+    event loop:
+
+        import asyncio
+        from ruv_dl import aio
+
+        async def sync(destination, query):
+            program = await aio.fetch_program(query, destination)
+            entries = [
+                entry async for entry in aio.crawl_program(program)
+            ]
+            downloader, missing = await aio.organize(
+                destination, program, entries
+            )
+            for entry in missing:
+                await aio.download_entry(
+                    downloader, entry, progress=lambda done, total: ...
+                )
+
+        asyncio.run(sync('/media/TV', 'Hvolpasveitin'))
+'''
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ruv_dl.crawler import Crawler
+from ruv_dl.downloader import Downloader
+from ruv_dl.programs import ProgramFetcher
+from ruv_dl.title_index import EXACT
+
+# Blocking calls made by the API share this many threads
+MAX_WORKERS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+_done = object()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                MAX_WORKERS, thread_name_prefix='ruv-dl'
+            )
+        return _executor
+
+
+async def run(fn, *args, **kwargs):
+    return await asyncio.get_event_loop().run_in_executor(
+        get_executor(), functools.partial(fn, *args, **kwargs)
+    )
+
+
+def _fetch_program(query, destination, match):
+    fetcher = ProgramFetcher(destination=destination, match=match)
+    if query.isdigit():
+        return fetcher.get_program_by_id(query)
+    fetcher.title_index = fetcher.load_title_index()
+    try:
+        return fetcher.get_program_by_id(fetcher.get_program_id(query))
+    finally:
+        fetcher.title_index.write()
+
+
+async def fetch_program(query, destination, match=EXACT):
+    '''
+        The program with id `query`, or the one whose title matches `query`
+        according to `match` (exact, fuzzy or fail). Raises LookupError if
+        no program matches and returns None if the API has no such id.
+    '''
+    return await run(_fetch_program, str(query), destination, match)
+
+
+async def crawl_program(
+    program,
+    days_between_episodes=7,
+    iteration_count=5,
+    bitrate_policy=None,
+    cache=None,
+):
+    '''
+        Async iterator of the entries found for `program`, as they are found.
+    '''
+    crawler = await run(
+        Crawler,
+        program,
+        iteration_count,
+        days_between_episodes,
+        cache=cache,
+        bitrate_policy=bitrate_policy,
+    )
+    entries = crawler.iter_episodes()
+    try:
+        while True:
+            entry = await run(next, entries, _done)
+            if entry is _done:
+                return
+            yield entry
+    finally:
+        await run(entries.close)
+
+
+async def organize(destination, program, entries, program_info=None):
+    '''
+        Sort `entries` into seasons in the program info of `program`.
+        Returns (downloader, entries that are not on disk yet).
+    '''
+    downloader = Downloader(
+        destination, program, entries, program_info=program_info
+    )
+    return downloader, await run(downloader.organize)
+
+
+async def download_entry(downloader, entry, progress=None):
+    '''
+        Download `entry`, returns whether it was downloaded. `progress` is
+        called in the event loop with the bytes downloaded so far and the
+        total. Raises ruv_dl.diskspace.NoSpace if it doesn't fit on disk.
+    '''
+    if progress is not None:
+        loop = asyncio.get_event_loop()
+        callback = progress
+
+        def progress(done, total):
+            loop.call_soon_threadsafe(callback, done, total)
+
+    return await run(downloader.download_file, entry, progress=progress)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+import atexit
+import hashlib
+import json
+import os
+import logging
+import threading
+import time
+
+from ruv_dl import network
+from ruv_dl.constants import API_CACHE_LOCATION
+from ruv_dl.runtime import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_FN = 'index.json'
+
+
+class CachedResponse:
+    '''
+        The parts of requests.Response we use, for responses from the cache
+    '''
+
+    status_code = 200
+    ok = True
+
+    def __init__(self, content):
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    def raise_for_status(self):
+        pass
+
+
+class HTTPCache:
+    '''
+        On disk cache for API responses. Responses younger than `ttl`
+        seconds are served without a request, older ones are revalidated
+        with If-None-Match/If-Modified-Since. When the cache grows beyond
+        `max_size` bytes the least recently used responses are evicted.
+    '''
+
+    def __init__(self, location=API_CACHE_LOCATION, ttl=3600, max_size=None):
+        self.location = location
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # Cache hits only update access times, they are written by `flush`
+        self.dirty = False
+        os.makedirs(location, exist_ok=True)
+        try:
+            with open(os.path.join(location, INDEX_FN), 'r') as f:
+                self._index = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            self._index = {}
+
+    def _body_fn(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.location, f'{name}.json')
+
+    def _read_body(self, url):
+        try:
+            with open(self._body_fn(url), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_index(self):
+        index_fn = os.path.join(self.location, INDEX_FN)
+        tmp_fn = f'{index_fn}.{os.getpid()}.tmp'
+        with open(tmp_fn, 'w') as f:
+            f.write(json.dumps(self._index))
+        os.replace(tmp_fn, index_fn)
+        self.dirty = False
+
+    def flush(self):
+        with self._lock:
+            if self.dirty:
+                self._write_index()
+
+    def _evict(self):
+        if self.max_size is None:
+            return
+        total = sum(entry['size'] for entry in self._index.values())
+        for url, entry in sorted(
+            self._index.items(), key=lambda item: item[1]['accessed_at']
+        ):
+            if total <= self.max_size:
+                break
+            logger.debug('Evicting %s from API cache', url)
+            try:
+                os.remove(self._body_fn(url))
+            except FileNotFoundError:
+                pass
+            total -= entry['size']
+            del self._index[url]
+
+    def _store(self, url, r):
+        content = r.content
+        with open(self._body_fn(url), 'wb') as f:
+            f.write(content)
+        now = time.time()
+        self._index[url] = {
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'fetched_at': now,
+            'accessed_at': now,
+            'size': len(content),
+        }
+        self._evict()
+        self._write_index()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._index.get(url)
+            content = entry and self._read_body(url)
+        if content is None:
+            entry = None
+        now = time.time()
+        if entry and now - entry['fetched_at'] < self.ttl:
+            logger.debug('API cache hit for %s', url)
+            with self._lock:
+                entry['accessed_at'] = now
+                self.dirty = True
+            return CachedResponse(content)
+
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        r = network.get(url, headers=headers)
+        with self._lock:
+            if r.status_code == 304 and entry:
+                logger.debug('%s not modified', url)
+                entry['fetched_at'] = entry['accessed_at'] = time.time()
+                self._write_index()
+                return CachedResponse(content)
+            if r.ok:
+                self._store(url, r)
+        return r
+
+
+_api_cache = None
+_api_cache_lock = threading.Lock()
+
+
+def get_api_cache():
+    global _api_cache
+    with _api_cache_lock:
+        if _api_cache is None:
+            _api_cache = HTTPCache(
+                ttl=settings.api_cache_ttl,
+                max_size=settings.api_cache_size * 1024 ** 2,
+            )
+            atexit.register(_api_cache.flush)
+        return _api_cache
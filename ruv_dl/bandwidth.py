@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+import datetime
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from ruv_dl.constants import THROUGHPUT_LOCATION
+from ruv_dl.date_utils import parse_time_of_day
+from ruv_dl.runtime import settings
+from ruv_dl.throttle import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+UNITS = {
+    'bit': 1 / 8,
+    'kbit': 1000 / 8,
+    'mbit': 1000 ** 2 / 8,
+    'gbit': 1000 ** 3 / 8,
+    'b': 1,
+    'kb': 1024,
+    'mb': 1024 ** 2,
+    'gb': 1024 ** 3,
+}
+UNLIMITED = ('unlimited', 'none')
+PAUSED = ('paused', '0')
+RATE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([a-z]+)(?:/s)?$')
+
+# Rates are re-checked at least this often so a download that is throttled
+# to a crawl notices when its window ends.
+MAX_WAIT = 60
+# Weight of the latest second in the measured throughput
+SMOOTHING = 0.2
+
+
+def parse_rate(s):
+    '''
+        Bytes per second for a rate like 20Mbit, 500kbit or 2MB, None for
+        unlimited and 0 for paused.
+    '''
+    s = s.strip().lower()
+    if s in UNLIMITED:
+        return None
+    if s in PAUSED:
+        return 0
+    match = RATE_RE.match(s)
+    if not match or match.group(2) not in UNITS:
+        raise ValueError(
+            f'Invalid rate {s}, expected e.g. 20Mbit, 500kbit, 2MB, '
+            'unlimited or paused'
+        )
+    return int(float(match.group(1)) * UNITS[match.group(2)])
+
+
+class Window:
+    '''
+        A daily time window, from `start` up to `end`, with a bandwidth cap.
+        Windows where `end` is before `start` run over midnight.
+    '''
+
+    def __init__(self, start, end, rate):
+        self.start = start
+        self.end = end
+        self.rate = rate
+
+    @classmethod
+    def parse(cls, s):
+        '''
+            HH:MM-HH:MM=RATE, e.g. 08:00-18:00=20Mbit.
+        '''
+        try:
+            times, rate = s.split('=')
+            start, end = times.split('-')
+            return cls(
+                parse_time_of_day(start.strip()),
+                parse_time_of_day(end.strip()),
+                parse_rate(rate),
+            )
+        except ValueError as e:
+            raise ValueError(f'Invalid window {s}: {e}')
+
+    def contains(self, time):
+        if self.start <= self.end:
+            return self.start <= time < self.end
+        return time >= self.start or time < self.end
+
+    def __repr__(self):
+        return f'<Window {self.start}-{self.end} {self.rate}>'
+
+
+def parse_schedule(values):
+    '''
+        (windows, default rate) from a list of windows (HH:MM-HH:MM=RATE)
+        and optionally a plain rate to use outside them.
+    '''
+    windows = []
+    default = None
+    for value in values:
+        if '=' in value:
+            windows.append(Window.parse(value))
+        else:
+            default = parse_rate(value)
+    return windows, default
+
+
+class BandwidthLimiter:
+    '''
+        A token bucket of bytes per second shared by all downloads. The rate
+        follows the schedule windows, the first matching window wins and
+        `default` is used outside of them. Downloads in progress slow down
+        or pause when a window with a lower cap starts, they are never
+        aborted. With `location` the measured throughput is kept there for
+        the next run.
+    '''
+
+    def __init__(self, windows=(), default=None, location=None):
+        self.windows = list(windows)
+        self.default = default
+        self.location = location
+        self.bucket = TokenBucket(self.rate_at(datetime.datetime.now()))
+        self._lock = threading.Lock()
+        # Bytes per second downloaded while downloading, smoothed
+        self.measured = None
+        self._second = None
+        self._second_bytes = 0
+        # What was measured in an earlier run, until we measure ourselves
+        self.recorded = None
+        if location is not None:
+            try:
+                with open(location, 'r') as f:
+                    self.recorded = json.loads(f.read())['measured']
+            except (FileNotFoundError, ValueError, KeyError, TypeError):
+                pass
+
+    def rate_at(self, now):
+        for window in self.windows:
+            if window.contains(now.time()):
+                return window.rate
+        return self.default
+
+    def seconds_until_change(self, now):
+        '''
+            Seconds until the next window starts or ends, None if the rate
+            never changes.
+        '''
+        if not self.windows:
+            return None
+        seconds = []
+        for window in self.windows:
+            for time in (window.start, window.end):
+                at = datetime.datetime.combine(now.date(), time)
+                if at <= now:
+                    at += datetime.timedelta(days=1)
+                seconds.append((at - now).total_seconds())
+        return min(seconds)
+
+    def update(self, now=None):
+        now = now or datetime.datetime.now()
+        rate = self.rate_at(now)
+        with self._lock:
+            if rate != self.bucket.rate:
+                logger.info(
+                    'Download bandwidth %s',
+                    'unlimited' if rate is None else f'{rate * 8 // 1000}kbit',
+                )
+                # The bucket holds a second worth of bytes so bursts stay
+                # close to the cap.
+                self.bucket.set_rate(rate)
+        return now
+
+    def consume(self, size):
+        '''
+            Wait until `size` bytes may be downloaded.
+        '''
+        while True:
+            now = self.update()
+            if not self.windows:
+                self.bucket.consume(size)
+                break
+            timeout = min(self.seconds_until_change(now), MAX_WAIT)
+            if self.bucket.consume(size, timeout=timeout):
+                break
+        self._measure(size, time.monotonic())
+
+    def _measure(self, size, now):
+        second = int(now)
+        with self._lock:
+            if second != self._second:
+                # Seconds without downloads don't count
+                if self._second is not None and second == self._second + 1:
+                    self.measured = (
+                        self._second_bytes
+                        if self.measured is None
+                        else (1 - SMOOTHING) * self.measured
+                        + SMOOTHING * self._second_bytes
+                    )
+                self._second = second
+                self._second_bytes = 0
+            self._second_bytes += size
+
+    def throughput(self, now=None):
+        '''
+            Expected bytes per second for all downloads together, the
+            measured throughput, or the one recorded in an earlier run, within
+            the current cap. None if unknown or paused.
+        '''
+        rate = self.rate_at(now or datetime.datetime.now())
+        if rate == 0:
+            return None
+        measured = self.measured
+        if measured is None:
+            measured = self.recorded
+        if measured is None or rate is not None and rate < measured:
+            return rate
+        return measured
+
+    def write(self):
+        '''
+            Keep the measured throughput for the next run.
+        '''
+        with self._lock:
+            if self.location is None or self.measured is None:
+                return
+            os.makedirs(os.path.dirname(self.location), exist_ok=True)
+            tmp_location = f'{self.location}.{os.getpid()}.tmp'
+            with open(tmp_location, 'w') as f:
+                f.write(json.dumps({'measured': self.measured}))
+            os.replace(tmp_location, self.location)
+
+
+_bandwidth_limiter = None
+_bandwidth_limiter_lock = threading.Lock()
+
+
+def get_bandwidth_limiter():
+    global _bandwidth_limiter
+    with _bandwidth_limiter_lock:
+        if _bandwidth_limiter is None:
+            _bandwidth_limiter = BandwidthLimiter(
+                *parse_schedule(settings.bandwidth),
+                location=THROUGHPUT_LOCATION,
+            )
+        return _bandwidth_limiter
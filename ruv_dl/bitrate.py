@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import re
+from urllib.parse import parse_qs, urlparse
+
+from ruv_dl.constants import DEFAULT_BITRATE
+
+# Renditions we have seen on the CDN, used when the manifest doesn't list any
+KNOWN_BITRATES = (500, 800, 1200, 2400, 3600)
+BITRATE_RE = re.compile(r'(\d+)kbps')
+
+HIGHEST = 'highest'
+LOWEST = 'lowest'
+BUDGET_PREFIX = 'max:'
+
+
+def manifest_bitrates(manifest_url):
+    '''
+        Bitrates of the streams listed in an episode manifest url.
+    '''
+    query = parse_qs(urlparse(manifest_url).query)
+    bitrates = set()
+    for stream in query.get('streams', [''])[0].split(','):
+        result = BITRATE_RE.search(stream)
+        if result:
+            bitrates.add(int(result.group(1)))
+    return sorted(bitrates)
+
+
+class BitratePolicy:
+    '''
+        Which rendition to download, one of:
+            2400        - a fixed bitrate in kbps
+            highest     - the highest available bitrate
+            lowest      - the lowest available bitrate
+            max:1200    - the highest available bitrate within a budget
+    '''
+
+    def __init__(self, policy=str(DEFAULT_BITRATE)):
+        self.policy = policy
+        self.fixed = None
+        self.budget = None
+        if policy.isdigit():
+            self.fixed = int(policy)
+        elif policy.startswith(BUDGET_PREFIX):
+            budget = policy[len(BUDGET_PREFIX) :]
+            if not budget.isdigit():
+                raise ValueError(f'Invalid bitrate budget in {policy}')
+            self.budget = int(budget)
+        elif policy not in (HIGHEST, LOWEST):
+            raise ValueError(
+                f'Bitrate must be a number, {HIGHEST}, {LOWEST} or '
+                f'{BUDGET_PREFIX}<kbps>, got {policy}'
+            )
+
+    def choose(self, available):
+        if self.fixed is not None:
+            return self.fixed
+        available = sorted(available)
+        if not available:
+            return None
+        if self.policy == LOWEST:
+            return available[0]
+        if self.budget is not None:
+            within_budget = [b for b in available if b <= self.budget]
+            if not within_budget:
+                # Nothing fits, take the cheapest one
+                return available[0]
+            return within_budget[-1]
+        return available[-1]
+
+    def __str__(self):
+        return self.policy
@@ -1,48 +1,415 @@
 #!/usr/bin/env python
+import atexit
+import datetime
+import glob
 import json
 import os
 import logging
+import struct
+import threading
+import time
 
-from ruv_dl.constants import CACHE_LOCATION, CACHE_VERSION, CACHE_VERSION_KEY
+from ruv_dl.constants import (
+    CACHE_LOCATION,
+    CACHE_VERSION,
+    CACHE_VERSION_KEY,
+    DATE_FORMAT,
+    DATETIME_FORMAT,
+)
+from ruv_dl.date_utils import parse_datetime
+from ruv_dl.gaps import GapIndex
+from ruv_dl.singleflight import SingleFlight
+from ruv_dl.variants import VariantMemory, variant_of
 
 logger = logging.getLogger(__name__)
 
+CACHE_EXTENSION = '.cache'
+GAPS_EXTENSION = '.gaps'
+HEADER = b'RUVC' + CACHE_VERSION.encode('ascii')
+# Air date (ordinal, 0 if the key has no date), checked at (epoch seconds),
+# status code and the lengths of the key (without the date), etag and url
+# that follow the record.
+RECORD = struct.Struct('<IIHHHH')
+SUCCESS = 200
+REMOVED = 0
+
 
 class CacheVersionException(Exception):
     pass
 
 
+def should_recheck(date, checked_at, now=None):
+    '''
+        Whether an episode at `date` that was missing at `checked_at` should
+        be looked for again.
+    '''
+    now = now or datetime.datetime.now()
+    return (
+        # Don't remove unless we last checked before the show was aired
+        checked_at <= (date + datetime.timedelta(1))
+        and
+        # And we haven't checked this link for over 1 hours
+        abs((checked_at - now).total_seconds() / 3600) > 1
+        and
+        # And the show should have been aired
+        date <= (now + datetime.timedelta(1))
+    )
+
+
+def split_key(key):
+    '''
+        Cache keys start with the air date, store it as an integer.
+    '''
+    try:
+        date = datetime.datetime.strptime(key[:10], DATE_FORMAT)
+    except ValueError:
+        return 0, key
+    return date.toordinal(), key[11:]
+
+
 class DiskCache:
-    def __init__(self, program_id):
-        self.location = os.path.join(CACHE_LOCATION, f'{program_id}.json')
+    '''
+        Results of probing for episodes of a program. The cache is an append
+        only file of fixed size records, later records replace earlier ones
+        for the same key. Run `compact` to drop replaced records and misses
+        that will be checked again anyway.
+    '''
+
+    def __init__(self, program_id, location=CACHE_LOCATION):
+        self.location = os.path.join(
+            location, f'{program_id}{CACHE_EXTENSION}'
+        )
+        self._data = {}
+        self._pending = {}
+        self._dates = {}
+        self._lock = threading.RLock()
+        # Probes for keys in this cache, shared by all its crawlers
+        self.flights = SingleFlight()
+        self.gaps = GapIndex(
+            os.path.join(location, f'{program_id}{GAPS_EXTENSION}'),
+            should_recheck,
+        )
+        # Where episodes were found, learned from cached urls
+        self.variants = VariantMemory()
+        self.records = 0
+        self._rewrite = False
+        self._migrated_from = None
         try:
-            with open(self.location, 'r') as f:
-                self._data = json.loads(f.read())
-            SAVED_CACHE_VERSION = self._data.get(CACHE_VERSION_KEY)
-            if SAVED_CACHE_VERSION != CACHE_VERSION:
-                logger.info(
-                    f'Have cache version "{SAVED_CACHE_VERSION}" but '
-                    f'want {CACHE_VERSION}. Starting with empty cache.'
-                )
-                raise CacheVersionException()
+            self._read()
             logger.debug('Cache version OK.')
-        except (FileNotFoundError, CacheVersionException):
-            self._data = {
-                CACHE_VERSION_KEY: CACHE_VERSION,
-            }
+        except FileNotFoundError:
+            self._rewrite = True
+            self._migrate(os.path.join(location, f'{program_id}.json'))
+        except CacheVersionException:
+            self._rewrite = True
+
+    @property
+    def dirty(self):
+        return bool(self._pending) or self._rewrite and bool(self._data)
+
+    def _format_date(self, ordinal):
+        if ordinal not in self._dates:
+            self._dates[ordinal] = datetime.date.fromordinal(ordinal).strftime(
+                DATE_FORMAT
+            )
+        return self._dates[ordinal]
+
+    def _read(self):
+        with open(self.location, 'rb') as f:
+            data = f.read()
+        if not data.startswith(HEADER):
+            logger.info(
+                f'Have cache header {data[:len(HEADER)]} but want {HEADER}. '
+                'Starting with empty cache.'
+            )
+            raise CacheVersionException()
+        offset = len(HEADER)
+        while offset < len(data):
+            try:
+                offset = self._read_record(data, offset)
+            except (struct.error, UnicodeDecodeError, ValueError) as e:
+                # Appending after a broken record would make everything
+                # after it unreadable, write the good records out again.
+                logger.warning(
+                    'Ignoring corrupt or truncated record in %s: %s',
+                    self.location,
+                    e,
+                )
+                self._rewrite = True
+                break
+
+    def _read_record(self, data, offset):
+        (
+            date,
+            checked_at,
+            status_code,
+            key_len,
+            etag_len,
+            url_len,
+        ) = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        end = offset + key_len + etag_len + url_len
+        if end > len(data):
+            raise ValueError('record is truncated')
+        key = data[offset : offset + key_len].decode('utf-8')
+        offset += key_len
+        etag = data[offset : offset + etag_len].decode('utf-8')
+        url = data[offset + etag_len : end].decode('utf-8')
+        if date:
+            key = f'{self._format_date(date)}-{key}'
+        self.records += 1
+        if status_code == REMOVED:
+            self._data.pop(key, None)
+        else:
+            self._data[key] = (date, checked_at, status_code, etag, url)
+            if status_code == SUCCESS and date:
+                self.variants.add(
+                    datetime.date.fromordinal(date), variant_of(url)
+                )
+        return end
+
+    def _migrate(self, json_location):
+        try:
+            with open(json_location, 'r') as f:
+                data = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get(CACHE_VERSION_KEY) != '1':
+            return
+        logger.info(f'Migrating {json_location} to {self.location}')
+        del data[CACHE_VERSION_KEY]
+        for key, value in data.items():
+            self.set(key, value)
+        self.records = len(self._data)
+        self._migrated_from = json_location
 
     def get(self, key):
-        return self._data[key]
+        '''
+            The cached result for `key`, None if there is none.
+        '''
+        with self._lock:
+            record = self._data.get(key)
+        if record is None:
+            return None
+        _, checked_at, status_code, etag, url = record
+        checked_at = datetime.datetime.fromtimestamp(checked_at).strftime(
+            DATETIME_FORMAT
+        )
+        if status_code == SUCCESS:
+            return {
+                'success': True,
+                'url': url,
+                'etag': etag,
+                'checked_at': checked_at,
+            }
+        return {
+            'success': False,
+            'status_code': status_code,
+            'checked_at': checked_at,
+        }
 
     def set(self, key, data):
-        self._data[key] = data
+        date, _ = split_key(key)
+        checked_at = int(parse_datetime(data['checked_at']).timestamp())
+        if data['success']:
+            record = (date, checked_at, SUCCESS, data['etag'], data['url'])
+            if date:
+                self.variants.add(
+                    datetime.date.fromordinal(date), variant_of(data['url'])
+                )
+        else:
+            record = (date, checked_at, data['status_code'], '', '')
+        with self._lock:
+            self._data[key] = record
+            self._pending[key] = record
 
     def has(self, key):
         return key in self._data
 
+    def __len__(self):
+        return len(self._data)
+
     def remove(self, key):
-        del self._data[key]
+        date, _ = split_key(key)
+        with self._lock:
+            self._data.pop(key, None)
+            self._pending[key] = (date, 0, REMOVED, '', '')
+
+    def _pack(self, key, record):
+        date, checked_at, status_code, etag, url = record
+        if date:
+            key = key[11:]
+        key, etag, url = (s.encode('utf-8') for s in (key, etag, url))
+        return (
+            RECORD.pack(
+                date, checked_at, status_code, len(key), len(etag), len(url)
+            )
+            + key
+            + etag
+            + url
+        )
 
     def write(self):
-        with open(self.location, 'w') as f:
-            f.write(json.dumps(self._data))
+        with self._lock:
+            self._write()
+        self.gaps.write()
+
+    def _write(self):
+        if not self.dirty:
+            logger.debug('Cache %s unchanged, not writing', self.location)
+            return
+        # Rewrite when most of the file is replaced records
+        if self._rewrite or self.records > 2 * len(self._data) + 100:
+            self._write_all()
+            return
+        with open(self.location, 'ab') as f:
+            f.write(
+                b''.join(
+                    self._pack(key, record)
+                    for key, record in self._pending.items()
+                )
+            )
+        self.records += len(self._pending)
+        self._pending = {}
+
+    def _write_all(self):
+        # Replace atomically, other processes may be reading the cache
+        tmp_location = f'{self.location}.{os.getpid()}.tmp'
+        with open(tmp_location, 'wb') as f:
+            f.write(
+                HEADER
+                + b''.join(
+                    self._pack(key, record)
+                    for key, record in self._data.items()
+                )
+            )
+        os.replace(tmp_location, self.location)
+        self.records = len(self._data)
+        self._pending = {}
+        self._rewrite = False
+        if self._migrated_from:
+            os.remove(self._migrated_from)
+            self._migrated_from = None
+
+    def compact(self, now=None):
+        '''
+            Drop replaced records and misses that would be checked again,
+            returns the number of records before and after.
+        '''
+        with self._lock:
+            before = self.records
+            for key, (date, checked_at, status_code, _, _) in list(
+                self._data.items()
+            ):
+                if (
+                    status_code != SUCCESS
+                    and date
+                    and should_recheck(
+                        datetime.datetime.fromordinal(date),
+                        datetime.datetime.fromtimestamp(checked_at),
+                        now=now,
+                    )
+                ):
+                    del self._data[key]
+            self._write_all()
+        self.gaps.compact(now=now)
+        self.gaps.write()
+        return before, self.records
+
+
+class CacheManager:
+    '''
+        One DiskCache per program for the whole process. A cache is loaded
+        once however many crawlers ask for it at the same time, and a
+        background writer flushes the caches crawlers are done with in
+        batches every `interval` seconds. Call `flush` to write everything
+        now.
+    '''
+
+    def __init__(self, location=CACHE_LOCATION, interval=5):
+        self.location = location
+        self.interval = interval
+        self._caches = {}
+        self._loads = SingleFlight()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = set()
+        self._wake = threading.Event()
+        self._writer = None
+
+    def get(self, program_id):
+        with self._lock:
+            cache = self._caches.get(program_id)
+        if cache is None:
+            cache = self._loads.do(program_id, self._load, program_id)
+        return cache
+
+    def _load(self, program_id):
+        with self._lock:
+            if program_id in self._caches:
+                return self._caches[program_id]
+        cache = DiskCache(program_id, location=self.location)
+        with self._lock:
+            self._caches[program_id] = cache
+        return cache
+
+    def schedule_write(self, cache):
+        with self._lock:
+            self._dirty.add(cache)
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, name='cache-writer', daemon=True
+                )
+                self._writer.start()
+        self._wake.set()
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait()
+            # Give other crawlers a moment to finish, to write in batches
+            time.sleep(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        # Hold the flush lock so a flush waits for the writer to finish
+        with self._flush_lock:
+            with self._lock:
+                batch, self._dirty = self._dirty, set()
+            for cache in batch:
+                try:
+                    cache.write()
+                except OSError as e:
+                    logger.error('Could not write %s: %s', cache.location, e)
+            return len(batch)
+
+
+_cache_manager = None
+_cache_manager_lock = threading.Lock()
+
+
+def get_cache_manager():
+    global _cache_manager
+    with _cache_manager_lock:
+        if _cache_manager is None:
+            _cache_manager = CacheManager()
+            atexit.register(_cache_manager.flush)
+        return _cache_manager
+
+
+def compact_all(location=CACHE_LOCATION):
+    '''
+        Compact all program caches in `location`, migrating old ones.
+        Yields (program_id, records before, records after).
+    '''
+    program_ids = set()
+    for fn in glob.glob(os.path.join(location, f'*{CACHE_EXTENSION}')):
+        program_ids.add(os.path.basename(fn)[: -len(CACHE_EXTENSION)])
+    for fn in glob.glob(os.path.join(location, '*.json')):
+        program_ids.add(os.path.basename(fn)[: -len('.json')])
+    for program_id in sorted(program_ids):
+        cache = DiskCache(program_id, location=location)
+        if not cache.records and not len(cache):
+            # Not a program cache (or an unknown version)
+            continue
+        yield (program_id,) + cache.compact()
@@ -6,8 +6,11 @@ DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 DATETIME_FORMATS = (DATETIME_FORMAT, '%Y-%m-%dT%H:%M:%S')
 DATE_PART_LENGTH = 4 + 1 + 2 + 1 + 2
 URL_TEMPLATE = (
-    'http://smooth.ruv.cache.is/{openclose}/{date}/2400kbps/{fn}.mp4'
+    'http://smooth.ruv.cache.is/{openclose}/{date}/{bitrate}kbps/{fn}.mp4'
 )
+DEFAULT_BITRATE = 2400
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+CHECKSUM_ALGORITHM = 'sha256'
 
 
 PROGRAM_INFO_FN = 'program_info.json'
@@ -17,6 +20,11 @@ CACHE_LOCATION = os.path.join(os.path.expanduser('~'), '.ruvdlcache')
 # In case we change the cache setup, change the cache version value and we
 # will invalidate all old cache.
 CACHE_VERSION_KEY = '__cache_version__'
-CACHE_VERSION = '1'
+CACHE_VERSION = '2'
+API_CACHE_LOCATION = os.path.join(CACHE_LOCATION, 'http')
+TITLE_INDEX_LOCATION = os.path.join(CACHE_LOCATION, 'titles.json')
+THROUGHPUT_LOCATION = os.path.join(CACHE_LOCATION, 'throughput.json')
+# How to pick a program when a query matches several
+MATCH_RULES = ('interactive', 'exact', 'fuzzy', 'fail')
 
 DEFAULT_VIDEO_DESTINATION = os.path.join(os.path.expanduser('~'), 'Videos/ruv')
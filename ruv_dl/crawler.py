@@ -1,104 +1,288 @@
 #!/usr/bin/env python
 import datetime
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.pool import ThreadPool
 
 from urllib.parse import parse_qs, urlparse
-import requests
 
-from ruv_dl.cache import DiskCache
+from ruv_dl import network
+from ruv_dl.bitrate import BitratePolicy, KNOWN_BITRATES, manifest_bitrates
+from ruv_dl.cache import get_cache_manager, should_recheck
 from ruv_dl.data import Entry
+from ruv_dl.profiling import get_profiler
 from ruv_dl.date_utils import parse_datetime, parse_date
+from ruv_dl.runtime import settings
+from ruv_dl.throttle import get_probe_throttle, is_throttled
+from ruv_dl.variants import OPEN, VARIANTS, variant_of
 from ruv_dl.constants import (
     DATETIME_FORMAT,
     DATE_FORMAT,
     URL_TEMPLATE,
     DATE_PART_LENGTH,
+    DEFAULT_BITRATE,
 )
 
 logger = logging.getLogger(__name__)
+PROBE_RETRIES = 3
+
+
+def parse_manifest_url(manifest_url):
+    '''
+        The date and filename of the stream in an episode's manifest url.
+    '''
+    parts = urlparse(manifest_url)
+    query = parse_qs(parts.query)
+    wanted_stream = query['streams'][0].split(',')[0]
+    # Dates are the first part, '%Y/%m/%d'
+    datestr = wanted_stream[:DATE_PART_LENGTH]
+    try:
+        date = parse_date(datestr)
+    except ValueError:
+        raise ValueError(
+            f'Could not parse date {datestr} from {wanted_stream}'
+        )
+    return date, wanted_stream.split('/')[-1].split('.')[0]
+
+
+_variant_executor = None
+_variant_executor_lock = threading.Lock()
+
+
+def get_variant_executor():
+    '''
+        Threads for probing the other variant of an episode while the
+        crawler probes one. Shared by all crawlers, the probe throttle
+        limits how many probes run at once anyway.
+    '''
+    global _variant_executor
+    with _variant_executor_lock:
+        if _variant_executor is None:
+            _variant_executor = ThreadPoolExecutor(
+                settings.max_probes, thread_name_prefix='ruv-dl-variant'
+            )
+        return _variant_executor
 
 
 class Crawler:
-    def __init__(self, program, iteration_count, days_between_episodes):
+    def __init__(
+        self,
+        program,
+        iteration_count,
+        days_between_episodes,
+        cache=None,
+        bitrate_policy=None,
+    ):
         self.program = program
         self.itercount = iteration_count
         self.days_between_episodes = days_between_episodes
-        self.prefer_open = True
-        self.cache = DiskCache(program['id'])
+        self.bitrate_policy = bitrate_policy or BitratePolicy()
+        self.bitrate = self.bitrate_policy.fixed
+        self.cache_manager = None
+        if cache is None:
+            self.cache_manager = get_cache_manager()
+            cache = self.cache_manager.get(program['id'])
+        self.cache = cache
+        # Seed episodes crawl overlapping ranges, probe each key once and
+        # don't crawl onwards from the same episode twice
+        self.flights = cache.flights
+        self._crawled = set()
+        self._crawled_lock = threading.Lock()
         logger.debug(
             '\n'.join(
                 [
                     'Initializing crawler with:',
                     f'Iteration count: {self.itercount}',
                     f'Days between episodes: {self.days_between_episodes}',
+                    f'Bitrate: {self.bitrate_policy}',
                 ]
             )
         )
 
-    def get_entry(self, date, fn, episode=None):
+    def probe(self, url):
+        '''
+            HEAD `url`, backing off while the CDN is throttling us. Returns
+            None if we are still throttled after retrying.
+        '''
+        throttle = get_probe_throttle()
+        for attempt in range(PROBE_RETRIES + 1):
+            with throttle.probe() as probe:
+                # Throttling is handled here, the network layer only
+                # retries connection and read errors.
+                r = network.head(url, retry_statuses=())
+                probe.status_code = r.status_code
+            if not is_throttled(r.status_code):
+                return r
+            wait = network.retry_after(r, attempt)
+            logger.warning(
+                'Got %d for %s, retrying in %.1fs', r.status_code, url, wait
+            )
+            time.sleep(wait)
+        return None
+
+    def get_url(self, date, fn, bitrate, variant=OPEN):
+        return URL_TEMPLATE.format(
+            date=date.strftime(DATE_FORMAT),
+            fn=fn,
+            openclose=variant,
+            bitrate=bitrate,
+        )
+
+    def get_cache_key(self, date, fn):
         cache_key = f'{date.strftime(DATE_FORMAT)}-{fn}'
-        if not self.cache.has(cache_key):
+        # Keep keys from before bitrates were selectable valid
+        if self.bitrate != DEFAULT_BITRATE:
+            cache_key = f'{cache_key}-{self.bitrate}'
+        return cache_key
+
+    def select_bitrate(self, date, fn, manifest_url):
+        '''
+            Probe the renditions of the episode at `date`/`fn` in parallel
+            and pick one according to our bitrate policy.
+        '''
+        candidates = manifest_bitrates(manifest_url) or KNOWN_BITRATES
+        variant = variant_of(manifest_url) or OPEN
+
+        def is_available(bitrate):
             try:
-                r = requests.head(
-                    URL_TEMPLATE.format(
-                        date=date.strftime(DATE_FORMAT),
-                        fn=fn,
-                        openclose='opid' if self.prefer_open else 'lokad',
-                    )
-                )
+                r = self.probe(self.get_url(date, fn, bitrate, variant))
             except Exception as e:
-                logger.error('Error getting entry: %s', e)
-                return None
-            logger.info(
-                'Checking %s - %s - %s (is_open: %s)'
-                % (date.strftime(DATE_FORMAT), fn, r.ok, self.prefer_open,)
-            )
-            if r.ok:
-                self.cache.set(
-                    cache_key,
-                    {
-                        'success': True,
-                        'url': r.url,
-                        'etag': r.headers['ETag'],
-                        'checked_at': datetime.datetime.now().strftime(
-                            DATETIME_FORMAT,
-                        ),
-                    },
-                )
-            else:
-                self.cache.set(
-                    cache_key,
-                    {
-                        'success': False,
-                        'status_code': r.status_code,
-                        'checked_at': datetime.datetime.now().strftime(
-                            DATETIME_FORMAT,
-                        ),
-                    },
+                logger.error('Error probing bitrate %d: %s', bitrate, e)
+                return False
+            return r is not None and r.ok
+
+        with ThreadPool(len(candidates)) as pool:
+            available = [
+                bitrate
+                for bitrate, ok in zip(
+                    candidates, pool.map(is_available, candidates)
                 )
+                if ok
+            ]
+        logger.info(
+            'Available bitrates for %s: %s', self.program['title'], available
+        )
+        if not available:
+            # Probably expired, go by what the manifest says
+            logger.info('No rendition of %s found, guessing', fn)
+            available = candidates
+        return self.bitrate_policy.choose(available)
+
+    def check(self, date, fn, cache_key):
+        '''
+            Probe for the episode and cache the result. Returns False if we
+            couldn't tell whether it exists.
+        '''
+        if self.cache.has(cache_key):
+            return True
+        variant = self.cache.variants.get(date)
+        r = self.probe_variants(
+            date, fn, VARIANTS if variant is None else (variant,)
+        )
+        if r is None:
+            # Don't cache throttled responses as missing episodes
+            logger.error('Throttled, giving up on %s', cache_key)
+            return False
+        logger.info(
+            'Checking %s - %s - %s (variant: %s)'
+            % (
+                date.strftime(DATE_FORMAT),
+                fn,
+                r.ok,
+                variant_of(r.url) if r.ok else variant or 'both',
+            )
+        )
+        if r.ok:
+            self.cache.set(
+                cache_key,
+                {
+                    'success': True,
+                    'url': r.url,
+                    'etag': r.headers['ETag'],
+                    'checked_at': datetime.datetime.now().strftime(
+                        DATETIME_FORMAT,
+                    ),
+                },
+            )
+        else:
+            self.cache.set(
+                cache_key,
+                {
+                    'success': False,
+                    'status_code': r.status_code,
+                    'checked_at': datetime.datetime.now().strftime(
+                        DATETIME_FORMAT,
+                    ),
+                },
+            )
+        return True
+
+    def probe_variant(self, date, fn, variant):
+        try:
+            return self.probe(self.get_url(date, fn, self.bitrate, variant))
+        except Exception as e:
+            logger.error('Error getting entry: %s', e)
+            return None
+
+    def probe_variants(self, date, fn, variants):
+        '''
+            Probe for the episode in each of `variants` in parallel. Returns
+            the response where it was found, else a miss, or None if we
+            couldn't tell for some variant.
+        '''
+        first, *others = variants
+        futures = [
+            get_variant_executor().submit(
+                self.probe_variant, date, fn, variant
+            )
+            for variant in others
+        ]
+        responses = [self.probe_variant(date, fn, first)] + [
+            future.result() for future in futures
+        ]
+        for r in responses:
+            if r is not None and r.ok:
+                return r
+        if any(r is None for r in responses):
+            return None
+        return responses[0]
+
+    def is_stale(self, date, info):
+        return not info['success'] and should_recheck(
+            date, parse_datetime(info['checked_at'])
+        )
+
+    def lookup(self, date, fn, cache_key):
+        '''
+            The cached result for the episode, probing for it if it isn't
+            cached or is a miss that should be looked for again. None if we
+            couldn't tell whether it exists.
+        '''
+        info = self.cache.get(cache_key)
+        if info is not None and self.is_stale(date, info):
+            self.cache.remove(cache_key)
+        if not self.check(date, fn, cache_key):
+            return None
+        return self.cache.get(cache_key)
+
+    def get_entry(self, date, fn, episode=None):
+        cache_key = self.get_cache_key(date, fn)
         info = self.cache.get(cache_key)
-        checked_at = parse_datetime(info['checked_at'])
-        if info['success']:
+        if info is None or self.is_stale(date, info):
+            # Crawlers of the same program share the cache, only one of
+            # them probes for a key or rechecks a stale miss
+            info = self.flights.do(cache_key, self.lookup, date, fn, cache_key)
+        if info is not None and info['success']:
             return Entry(
                 fn=fn,
                 url=info['url'],
                 date=date,
                 etag=info['etag'],
                 episode=episode,
+                bitrate=self.bitrate,
             )
-        elif (
-            # Don't remove unless we last checked before the show was aired
-            checked_at <= (date + datetime.timedelta(1))
-            and
-            # And we haven't checked this link for over 1 hours
-            abs((checked_at - datetime.datetime.now()).total_seconds() / 3600)
-            > 1
-            and
-            # And the show should have been aired
-            date <= (datetime.datetime.now() + datetime.timedelta(1))
-        ):
-            self.cache.remove(cache_key)
-            return self.get_entry(date, fn)
 
     def get_new_fn(self, fn, direction):
         known_delimeters = 'ATSU'
@@ -117,42 +301,105 @@ class Crawler:
             )
 
     def crawl(self, date, fn, direction=1):
+        with self._crawled_lock:
+            if (date, fn, direction) in self._crawled:
+                logger.debug('Already crawled from %s, stopping', fn)
+                return
+            self._crawled.add((date, fn, direction))
         new_fn = self.get_new_fn(fn, direction)
-        for i in range(self.itercount):
+        dates = [
             # Search for maximum 2 weeks back in time
-            date_to_check = date + datetime.timedelta(
+            date
+            + datetime.timedelta(
                 days=i * direction * self.days_between_episodes
             )
+            for i in range(self.itercount)
+        ]
+        step = self.days_between_episodes
+        gaps = self.cache.gaps if dates and step > 0 else None
+        gap_key = self.get_gap_key(new_fn)
+        if gaps is not None and gaps.covers(gap_key, dates, step):
+            logger.debug(
+                '%s known to be missing from %s to %s, not probing',
+                new_fn,
+                min(dates).strftime(DATE_FORMAT),
+                max(dates).strftime(DATE_FORMAT),
+            )
+            return
+        for date_to_check in dates:
             entry = self.get_entry(date_to_check, new_fn,)
             if entry:
                 yield entry
                 yield from self.crawl(date_to_check, new_fn, direction)
-                break
+                return
+        if gaps is not None:
+            self.record_gap(gaps, gap_key, new_fn, dates, step)
+
+    def get_gap_key(self, fn):
+        if self.bitrate != DEFAULT_BITRATE:
+            return f'{fn}-{self.bitrate}'
+        return fn
+
+    def record_gap(self, gaps, gap_key, fn, dates, step):
+        '''
+            Add `fn` to the gap index if it is cached as missing on all of
+            `dates`. Probes that failed or were throttled prove nothing.
+        '''
+        checked_at = []
+        for date in dates:
+            info = self.cache.get(self.get_cache_key(date, fn))
+            if info is None or info['success']:
+                return
+            checked_at.append(parse_datetime(info['checked_at']))
+        gaps.add(gap_key, dates, step, min(checked_at))
 
     def search_for_episodes(self):
-        files = set()
+        return set(self.iter_episodes())
+
+    def iter_episodes(self):
+        '''
+            Yield entries as they are found. An entry is only yielded again
+            for the same etag if it has episode data the first one lacked.
+        '''
+        seen = {}
+        entries = get_profiler().iterate(
+            'crawl', self._iter_episodes(), program=self.program['title']
+        )
+        try:
+            for entry in entries:
+                if entry.etag in seen and (
+                    seen[entry.etag] or not entry.episode.id
+                ):
+                    continue
+                seen[entry.etag] = bool(entry.episode.id)
+                yield entry
+        finally:
+            if self.cache_manager is None:
+                self.cache.write()
+            else:
+                self.cache_manager.schedule_write(self.cache)
+
+    def _iter_episodes(self):
         episodes = self.program['episodes']
         if not episodes:
             logger.info('No episodes found for %s', self.program['title'])
         for episode in episodes:
-            self.prefer_open = 'opid' in episode['file']
             manifest_url = episode['file']
-            parts = urlparse(manifest_url)
-            query = parse_qs(parts.query)
-            wanted_stream = query['streams'][0].split(',')[0]
-            # Dates are the first part, '%Y/%m/%d'
-            datestr = wanted_stream[:DATE_PART_LENGTH]
             try:
-                date = parse_date(datestr)
-            except ValueError:
+                date, fn = parse_manifest_url(manifest_url)
+            except ValueError as e:
+                logger.info(str(e))
+                continue
+            if self.bitrate is None:
+                self.bitrate = self.select_bitrate(date, fn, manifest_url)
                 logger.info(
-                    f'Could not parse date {datestr} from {wanted_stream}'
+                    'Using bitrate %d for %s',
+                    self.bitrate,
+                    self.program['title'],
                 )
-                continue
-            fn = wanted_stream.split('/')[-1].split('.')[0]
             first_entry = self.get_entry(date, fn, episode=episode)
             if first_entry:
-                files.add(first_entry)
+                yield first_entry
             else:
                 expire_date = parse_date(episode['file_expires']).date()
                 if expire_date <= datetime.date.today():
@@ -164,10 +411,6 @@ class Crawler:
                         self.program['title'],
                     )
             logger.debug('Searching backwards in time...')
-            for entry in self.crawl(date, fn, direction=-1):
-                files.add(entry)
+            yield from self.crawl(date, fn, direction=-1)
             logger.debug('Searching forward in time...')
-            for entry in self.crawl(date, fn, direction=1):
-                files.add(entry)
-        self.cache.write()
-        return files
+            yield from self.crawl(date, fn, direction=1)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+import datetime
+import logging
+import time
+
+from ruv_dl.programs import LibraryIndex, ProgramFetcher
+from ruv_dl.runner import Runner
+
+logger = logging.getLogger(__name__)
+
+
+def next_run(now, interval=None, times=()):
+    '''
+        Find the next time to run given an interval (a timedelta) and/or
+        times of day (datetime.time) to align runs to, e.g. airing times.
+    '''
+    candidates = []
+    if interval:
+        candidates.append(now + interval)
+    for time_of_day in times:
+        candidate = datetime.datetime.combine(now.date(), time_of_day)
+        if candidate <= now:
+            candidate += datetime.timedelta(days=1)
+        candidates.append(candidate)
+    if not candidates:
+        raise ValueError('Either interval or times must be given')
+    return min(candidates)
+
+
+class Daemon:
+    '''
+        Runs update passes on a schedule, keeping the library index (and
+        the process wide probe caches) in memory between passes.
+    '''
+
+    def __init__(
+        self,
+        destination,
+        interval=None,
+        times=(),
+        days_between_episodes=7,
+        iteration_count=5,
+        sequential=False,
+        bitrate_policy=None,
+    ):
+        self.interval = interval
+        self.times = times
+        self.library = LibraryIndex(destination)
+        self.fetcher = ProgramFetcher(
+            update=True, destination=destination, library=self.library
+        )
+        self.runner = Runner(
+            destination,
+            days_between_episodes=days_between_episodes,
+            iteration_count=iteration_count,
+            sequential=sequential,
+            library=self.library,
+            bitrate_policy=bitrate_policy,
+        )
+
+    def run_once(self):
+        start = time.time()
+        try:
+            self.runner.run(self.fetcher.get_programs())
+        except Exception:
+            logger.exception('Update pass failed')
+        logger.warning('Update pass done in %ds', time.time() - start)
+
+    def serve(self, max_runs=None):
+        runs = 0
+        while True:
+            self.run_once()
+            runs += 1
+            if max_runs is not None and runs >= max_runs:
+                return
+            run_at = next_run(
+                datetime.datetime.now(), self.interval, self.times
+            )
+            logger.warning('Next update pass at %s', run_at)
+            time.sleep(
+                max((run_at - datetime.datetime.now()).total_seconds(), 0)
+            )
@@ -26,22 +26,42 @@ class Episode:
 
 
 class Entry:
-    def __init__(self, fn, url, date, etag, episode=None):
+    def __init__(
+        self,
+        fn,
+        url,
+        date,
+        etag,
+        episode=None,
+        checksum=None,
+        size=None,
+        bitrate=None,
+    ):
         self.fn = fn
         self.url = url
         self.date = date
         self.etag = etag
         self.episode = Episode(episode)
+        self.checksum = checksum
+        self.size = size
+        self.bitrate = bitrate
         self.target_path = None
 
     def to_dict(self):
-        return {
+        data = {
             'fn': self.fn,
             'url': self.url,
             'date': self.date.strftime(DATE_FORMAT),
             'etag': self.etag,
             'episode': self.episode.to_dict(),
         }
+        if self.bitrate is not None:
+            data['bitrate'] = self.bitrate
+        # Only known after the file has been downloaded
+        if self.checksum is not None:
+            data['checksum'] = self.checksum
+            data['size'] = self.size
+        return data
 
     @classmethod
     def from_dict(cls, data):
@@ -51,6 +71,9 @@ class Entry:
             date=parse_date(data['date']),
             etag=data['etag'],
             episode=data.get('episode'),
+            checksum=data.get('checksum'),
+            size=data.get('size'),
+            bitrate=data.get('bitrate'),
         )
 
     def get_target_basename(self, program, season):
@@ -89,6 +112,7 @@ class EntrySet(set):
                 # If we have the same item twice, we want the one with a full
                 # episode entry, if available, chosen.
                 item = self._choose_best_item(item, member)
+                self._keep_file_info(item, member)
                 self.remove(member)
                 break
         super().add(item)
@@ -135,5 +159,12 @@ class EntrySet(set):
             return member
         return item
 
+    def _keep_file_info(self, item, member):
+        # Don't lose the checksum of a downloaded file when a crawled entry
+        # replaces the one we read from program info.
+        if item.checksum is None and member.checksum is not None:
+            item.checksum = member.checksum
+            item.size = member.size
+
     def __getitem__(self, i):
         return self.sorted()[i]
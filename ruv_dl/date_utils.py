@@ -14,3 +14,7 @@ def parse_datetime(s, f=DATETIME_FORMATS):
 
 def parse_date(s):
     return parse_datetime(s, DATE_FORMATS)
+
+
+def parse_time_of_day(s):
+    return datetime.datetime.strptime(s, '%H:%M').time()
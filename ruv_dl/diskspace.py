@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+import logging
+import os
+import threading
+
+from ruv_dl.runtime import settings
+
+logger = logging.getLogger(__name__)
+
+
+class NoSpace(Exception):
+    pass
+
+
+def free_space(path):
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+class Reservation:
+    def __init__(self, space, size):
+        self.space = space
+        self.size = size
+        self.written = 0
+
+    @property
+    def outstanding(self):
+        return max(self.size - self.written, 0)
+
+    def release(self):
+        self.space.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class DiskSpace:
+    '''
+        Admission control for downloads to `path`. Each download reserves
+        its size up front and is only admitted if it fits in the free space,
+        less `headroom` bytes and what running downloads have yet to write.
+    '''
+
+    def __init__(self, path, headroom=0):
+        self.path = path
+        self.headroom = headroom
+        self._lock = threading.Lock()
+        self._reservations = set()
+
+    def available(self):
+        with self._lock:
+            return self._available()
+
+    def _available(self):
+        outstanding = sum(r.outstanding for r in self._reservations)
+        return free_space(self.path) - self.headroom - outstanding
+
+    def reserve(self, size):
+        '''
+            Reserve `size` bytes, raises NoSpace if they don't fit.
+
+            Usage:
+                with space.reserve(size) as reservation:
+                    for chunk in chunks:
+                        f.write(chunk)
+                        reservation.written += len(chunk)
+        '''
+        with self._lock:
+            available = self._available()
+            if size > available:
+                raise NoSpace(
+                    f'{size} bytes needed but only {max(available, 0)} '
+                    f'available in {self.path}'
+                )
+            reservation = Reservation(self, size)
+            self._reservations.add(reservation)
+            return reservation
+
+    def release(self, reservation):
+        with self._lock:
+            self._reservations.discard(reservation)
+
+
+def order_for_space(jobs, sizes, available, keep_order=False):
+    '''
+        Order `jobs` so as many as possible fit in `available` bytes,
+        smallest first. Returns (ordered, deferred) where deferred are the
+        jobs that won't fit even so. Jobs of unknown size (None) go last.
+        With `keep_order` jobs are taken in the order given instead and
+        those of unknown size keep their place.
+    '''
+    ordered = []
+    deferred = []
+    if keep_order:
+        for job in jobs:
+            size = sizes.get(job)
+            if size is None:
+                ordered.append(job)
+            elif size <= available:
+                available -= size
+                ordered.append(job)
+            else:
+                deferred.append(job)
+        return ordered, deferred
+    known = sorted(
+        (job for job in jobs if sizes.get(job) is not None),
+        key=lambda job: sizes[job],
+    )
+    for job in known:
+        if sizes[job] <= available:
+            available -= sizes[job]
+            ordered.append(job)
+        else:
+            deferred.append(job)
+    unknown = [job for job in jobs if sizes.get(job) is None]
+    return ordered + unknown, deferred
+
+
+_disk_spaces = {}
+_disk_spaces_lock = threading.Lock()
+
+
+def get_disk_space(path):
+    with _disk_spaces_lock:
+        if path not in _disk_spaces:
+            _disk_spaces[path] = DiskSpace(
+                path, headroom=settings.disk_headroom * 1024 ** 2
+            )
+        return _disk_spaces[path]
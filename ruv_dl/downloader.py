@@ -1,13 +1,24 @@
+import hashlib
 import itertools
 import os
 import logging
+import threading
 import time
 
 import requests
 
+from ruv_dl import network
+from ruv_dl.bandwidth import get_bandwidth_limiter
 from ruv_dl.data import Entry, EntrySet
+from ruv_dl.diskspace import NoSpace, get_disk_space
+from ruv_dl.profiling import get_profiler
 from ruv_dl.programs import ProgramInfo
-from ruv_dl.constants import PROGRAM_INFO_FN
+from ruv_dl.snapshot import FolderSnapshot
+from ruv_dl.constants import (
+    PROGRAM_INFO_FN,
+    CHECKSUM_ALGORITHM,
+    DOWNLOAD_CHUNK_SIZE,
+)
 from ruv_dl.migrations import MIGRATIONS
 from ruv_dl.runtime import settings
 
@@ -16,73 +27,121 @@ PROGRAM_INFO_VERSION = max(MIGRATIONS.keys())
 
 
 class Downloader:
-    def __init__(self, destination, program, episode_entries, threaded=True):
+    def __init__(
+        self,
+        destination,
+        program,
+        episode_entries,
+        threaded=True,
+        program_info=None,
+    ):
         self.destination = destination
         self.program = program
         self.episode_entries = episode_entries
         self.threaded = threaded
+        self.program_info = program_info
+        self.seasons = None
+        # What is already on disk, read once per folder
+        self.snapshot = FolderSnapshot()
+        self._info_lock = threading.Lock()
 
     def organize(self):
+        with get_profiler().span('organize', self.program['title']):
+            return self._organize()
+
+    def _organize(self):
         # TODO: Use ProgramInfo class
         logger.info(f'Organizing {self.program["title"]}')
-        info_fn = os.path.join(self.destination, self.program['title'],)
-        os.makedirs(info_fn, exist_ok=True)
-        try:
-            program_info = ProgramInfo(info_fn)
-        except FileNotFoundError:
-            program_info = ProgramInfo(info_fn, initialize_empty=True)
+        program_folder = os.path.join(self.destination, self.program['title'])
+        info_fn = os.path.join(program_folder, PROGRAM_INFO_FN)
+        program_info = self.program_info
+        if program_info is None:
+            try:
+                if not self.snapshot.exists(info_fn):
+                    raise FileNotFoundError(info_fn)
+                program_info = ProgramInfo(info_fn)
+            except FileNotFoundError:
+                program_info = ProgramInfo(info_fn, initialize_empty=True)
         seasons = program_info.seasons
-        program_info.program = self.program
         # seasons = {
         #     1: EntrySet({entry, entry, entry}),
         #     2: EntrySet({entry, entry, entry}),
         # }
-        # Sort episodes into seasons
+        # The library may have refreshed the program in place already
+        program_info.program = self.program
+        changed = program_info.dirty or not self.snapshot.exists(info_fn)
+        # Make sure we don't have the same etag multiple times, prefer the
+        # first season it is in.
+        known = {}
+        # Other renditions of an episode have other etags, e.g. after
+        # changing --bitrate, keep the one we have.
+        renditions = {}
+        for season, entries in seasons.items():
+            for entry in list(entries):
+                if entry.etag in known:
+                    entries.remove(entry)
+                    changed = True
+                else:
+                    known[entry.etag] = season
+                    renditions[(entry.date, entry.fn)] = entry
+        # Sort new episodes into seasons, most update runs find none or one
+        touched = set()
+        other_renditions = 0
         for entry in sorted(
             self.episode_entries, key=lambda entry: entry.date
         ):
-            for season in seasons.keys():
-                if any(
-                    abs((e.date - entry.date).days) < 10
-                    for e in seasons[season]
-                ):
-                    seasons[season].add(entry)
-                    break
+            if entry.etag in known:
+                season = known[entry.etag]
+                if not self._is_better(entry, seasons[season]):
+                    continue
+                seasons[season].add(entry)
+            elif (entry.date, entry.fn) in renditions:
+                other_renditions += 1
+                continue
             else:
-                int_season_numbers = [
-                    int(season)
-                    for season in seasons
-                    if isinstance(season, int) or season.isdigit()
-                ]
-                season = max(int_season_numbers or [0]) + 1
-                seasons[season] = EntrySet([entry])
-        # Calculate target paths for entries
+                season = self._find_season(seasons, entry)
+                seasons.setdefault(season, EntrySet()).add(entry)
+                known[entry.etag] = season
+                renditions[(entry.date, entry.fn)] = entry
+            touched.add(season)
+        if other_renditions:
+            logger.warning(
+                f'Found {other_renditions} episodes of '
+                f'{self.program["title"]} we already have at another '
+                'bitrate, keeping the ones we have'
+            )
+        # Calculate target paths for entries, only touched seasons need
+        # episode numbers assigned.
         for season, entries in seasons.items():
             season_folder = Entry.get_season_folder(
                 self.destination, self.program, season
             )
-            os.makedirs(season_folder, exist_ok=True)
-            for i, entry in enumerate(entries.sorted()):
+            sorted_entries = entries.sorted()
+            for i, entry in enumerate(sorted_entries):
                 if not entry.episode.number:
+                    if season not in touched:
+                        logger.info(
+                            'Numbering season %s of %s again',
+                            season,
+                            self.program['title'],
+                        )
+                        touched.add(season)
                     entry.episode.number = EntrySet.find_target_number(
-                        entries, i
+                        sorted_entries, i
                     )
                 basename = entry.get_target_basename(self.program, season,)
                 target_path = os.path.join(season_folder, basename,)
                 entry.set_target_path(target_path)
-        # Finally, make sure we don't have the same etag multiple times,
-        # prefer the first one in chronological order
-        found_etags = []
-        for season, entries in seasons.items():
-            for entry in [
-                entry for entry in entries if entry.etag in found_etags
-            ]:
-                entries.remove(entry)
-            found_etags += [entry.etag for entry in entries]
 
-        program_info.seasons = seasons
-        if not settings.dryrun:
-            program_info.write()
+        if touched or changed:
+            program_info.seasons = seasons
+            if not settings.dryrun:
+                self.snapshot.makedirs(program_folder)
+                program_info.write()
+        else:
+            logger.info(f'Nothing new for {self.program["title"]}')
+        self.program_info = program_info
+        self.seasons = seasons
 
         missing_migrations = range(program_info.version, PROGRAM_INFO_VERSION,)
         for migration_entry in missing_migrations:
@@ -98,11 +157,45 @@ class Downloader:
         return [
             entry
             for entry in itertools.chain(*seasons.values())
-            if not entry.exists_on_disk()
+            if not self.snapshot.exists(entry.target_path)
+        ]
+
+    @staticmethod
+    def _is_better(entry, entries):
+        '''
+            Whether a crawled `entry` has an episode that the one already in
+            `entries` is missing.
+        '''
+        if not entry.episode.id:
+            return False
+        member = next(member for member in entries if member == entry)
+        return member.episode.id != entry.episode.id
+
+    @staticmethod
+    def _find_season(seasons, entry):
+        for season in seasons.keys():
+            if any(
+                abs((e.date - entry.date).days) < 10 for e in seasons[season]
+            ):
+                return season
+        int_season_numbers = [
+            int(season)
+            for season in seasons
+            if isinstance(season, int) or season.isdigit()
         ]
+        return max(int_season_numbers or [0]) + 1
 
-    def download_file(self, entry):
-        if os.path.exists(entry.target_path):
+    def download_file(self, entry, progress=None):
+        '''
+            Download `entry`, raises NoSpace if it doesn't fit on disk.
+            `progress` is called with the bytes downloaded so far and the
+            total after each chunk.
+        '''
+        with get_profiler().span('download', self.program['title']):
+            return self._download_file(entry, progress)
+
+    def _download_file(self, entry, progress=None):
+        if self.snapshot.exists(entry.target_path):
             logger.info(
                 f'Skipping {entry.target_path} - {entry.url} because '
                 'it already exists.'
@@ -111,31 +204,121 @@ class Downloader:
         else:
             logger.warning(f'Downloading {entry.url} to {entry.target_path}')
 
-        r = requests.get(entry.url, stream=True)
+        try:
+            r = network.get(entry.url, stream=True)
+        except requests.exceptions.RequestException as e:
+            logger.error(f'Could not download {entry.url}: {e}')
+            return False
 
         if r.ok:
             start = time.time()
             total_length = int(r.headers.get('content-length'))
+            try:
+                reservation = get_disk_space(self.destination).reserve(
+                    total_length
+                )
+            except NoSpace:
+                r.close()
+                raise
             dl = 0
             perc_done = 0
-            with open(entry.target_path, 'wb') as f:
-                for chunk in r:
-                    dl += len(chunk)
-                    current = int(dl * 10 / total_length)
-                    if current > perc_done:
-                        perc_done = current
-                        logger.info(
-                            f'{os.path.basename(entry.target_path)} '
-                            f'{perc_done * 10}% '
-                            f'({int(dl//(time.time() - start)/1024)}kbps)'
-                        )
-                    f.write(chunk)
+            checksum = hashlib.new(CHECKSUM_ALGORITHM)
+            bandwidth = get_bandwidth_limiter()
+            # Season folders are created when the first episode is written
+            self.snapshot.makedirs(os.path.dirname(entry.target_path))
+            try:
+                with reservation, open(entry.target_path, 'wb') as f:
+                    for chunk in self.iter_chunks(entry.url, r):
+                        bandwidth.consume(len(chunk))
+                        dl += len(chunk)
+                        reservation.written = dl
+                        if progress is not None:
+                            progress(dl, total_length)
+                        checksum.update(chunk)
+                        current = int(dl * 10 / total_length)
+                        if current > perc_done:
+                            perc_done = current
+                            logger.info(
+                                f'{os.path.basename(entry.target_path)} '
+                                f'{perc_done * 10}% '
+                                f'({int(dl//(time.time() - start)/1024)}kbps)'
+                            )
+                        f.write(chunk)
+            except BaseException:
+                # A partial file would pass for a download on later runs
+                logger.error(f'Removing partial download {entry.target_path}')
+                try:
+                    os.remove(entry.target_path)
+                except FileNotFoundError:
+                    pass
+                raise
 
-            size = int(os.path.getsize(entry.target_path) / 1024 ** 2)
             logger.warning(
-                f'{entry.target_path} ({size}MB) '
+                f'{entry.target_path} ({int(dl / 1024 ** 2)}MB) '
                 f'downloaded in {int(time.time() - start)}s!'
             )
+            if dl != total_length:
+                logger.error(
+                    f'{entry.target_path} is truncated, got {dl} bytes but '
+                    f'expected {total_length}. Removing it.'
+                )
+                os.remove(entry.target_path)
+                return False
+            self.snapshot.add(entry.target_path, dl)
+            self.record_file_info(entry, checksum.hexdigest(), dl)
             return True
         logger.warning(f'Error {r.status_code} for {entry.url}')
         return False
+
+    def iter_chunks(self, url, r):
+        '''
+            Yield chunks from `r`, resuming with a range request if reading
+            fails part way through.
+        '''
+        dl = 0
+        resumes = 0
+        while True:
+            try:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    dl += len(chunk)
+                    yield chunk
+                return
+            except (
+                network.READ_ERRORS + (requests.exceptions.ConnectionError,)
+            ) as e:
+                if resumes == network.RETRIES:
+                    logger.error(f'Giving up on {url} after {dl} bytes: {e}')
+                    return
+                resumes += 1
+                logger.warning(
+                    f'Error downloading {url} ({e}), resuming from {dl} bytes'
+                )
+                r = self.resume(url, dl)
+                if r is None:
+                    return
+
+    def resume(self, url, offset):
+        try:
+            r = network.get(
+                url, stream=True, headers={'Range': f'bytes={offset}-'}
+            )
+        except requests.exceptions.RequestException as e:
+            logger.error(f'Could not resume {url}: {e}')
+            return None
+        if r.status_code != 206:
+            logger.error(
+                f'Could not resume {url}, got status code {r.status_code}'
+            )
+            r.close()
+            return None
+        return r
+
+    def record_file_info(self, entry, checksum, size):
+        entry.checksum = checksum
+        entry.size = size
+        if self.program_info is None:
+            return
+        # Downloads run in parallel, make sure we write one at a time
+        with self._info_lock:
+            self.program_info.seasons = self.seasons
+            self.program_info.write()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+import datetime
+import logging
+
+from ruv_dl.crawler import parse_manifest_url
+from ruv_dl.date_utils import parse_date
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_expiry(episode):
+    try:
+        return parse_date(episode['file_expires'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def get_expiries(program):
+    '''
+        When the files of the episodes the API lists for `program` expire,
+        by episode id and by date.
+    '''
+    by_id = {}
+    by_date = {}
+    for episode in program.get('episodes') or []:
+        expires = _parse_expiry(episode)
+        if expires is None:
+            continue
+        if episode.get('id') is not None:
+            by_id[episode['id']] = expires
+        try:
+            date, _ = parse_manifest_url(episode['file'])
+        except (KeyError, ValueError):
+            continue
+        by_date[date] = expires
+    return by_id, by_date
+
+
+def get_expiry(entry, expiries):
+    '''
+        When the file of `entry` expires, None if the API doesn't say.
+        Episodes found by crawling are matched to the API by date.
+    '''
+    expires = _parse_expiry(entry.episode.data)
+    if expires is not None:
+        return expires
+    by_id, by_date = expiries
+    if entry.episode.id in by_id:
+        return by_id[entry.episode.id]
+    return by_date.get(entry.date)
+
+
+def priorities(jobs, expiries, sizes):
+    '''
+        Sort keys for (downloader, entry) `jobs`, see `prioritize`. Keys of
+        jobs of different programs can be compared, so programs organized
+        later can join the queue.
+    '''
+    never = datetime.datetime.max
+
+    def size(job):
+        return sizes.get(job) or float('inf')
+
+    groups = {}
+    for job in jobs:
+        key = (job[0].program['id'], expiries.get(job))
+        groups.setdefault(key, []).append(job)
+    keys = {}
+    for group in groups.values():
+        for turn, job in enumerate(sorted(group, key=size)):
+            keys[job] = (expiries.get(job) or never, turn, size(job))
+    return keys
+
+
+def prioritize(jobs, expiries, sizes):
+    '''
+        Order (downloader, entry) `jobs` by expiry, soonest first. Programs
+        take turns among files expiring on the same day and among files
+        whose expiry is unknown, which go last, then smaller files go first.
+    '''
+    keys = priorities(jobs, expiries, sizes)
+    return sorted(jobs, key=keys.__getitem__)
+
+
+def predict_misses(jobs, sizes, expiries, throughput, now=None):
+    '''
+        Jobs expected to expire before they are downloaded when `jobs` are
+        downloaded in order at `throughput` bytes per second, as
+        (job, expected finish) pairs.
+    '''
+    now = now or datetime.datetime.now()
+    misses = []
+    downloaded = 0
+    for job in jobs:
+        downloaded += sizes.get(job) or 0
+        finish = now + datetime.timedelta(seconds=downloaded / throughput)
+        expires = expiries.get(job)
+        if expires is not None and finish > expires:
+            misses.append((job, finish))
+    return misses
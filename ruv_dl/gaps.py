@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+import datetime
+import logging
+import os
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+HEADER = b'RUVG1'
+# First and last date (ordinals), checked at (epoch seconds), days between
+# the dates checked and the length of the filename that follows.
+RECORD = struct.Struct('<IIIHH')
+
+
+class Gap:
+    __slots__ = ('start', 'end', 'step', 'checked_at')
+
+    def __init__(self, start, end, step, checked_at):
+        self.start = start
+        self.end = end
+        self.step = step
+        self.checked_at = checked_at
+
+    def aligned(self, ordinal, step):
+        return step == self.step and (ordinal - self.start) % step == 0
+
+    def covers(self, start, end, step):
+        return (
+            self.aligned(start, step)
+            and self.start <= start
+            and end <= self.end
+        )
+
+    def touches(self, gap):
+        return (
+            self.aligned(gap.start, gap.step)
+            and gap.start <= self.end + self.step
+            and self.start <= gap.end + self.step
+        )
+
+    def expired(self, should_recheck, now=None):
+        # Any date in the gap that would be looked for again, e.g. one that
+        # hadn't aired when the gap was checked, expires all of it
+        checked_at = datetime.datetime.fromtimestamp(self.checked_at)
+        return any(
+            should_recheck(
+                datetime.datetime.fromordinal(ordinal), checked_at, now=now
+            )
+            for ordinal in range(self.start, self.end + 1, self.step)
+        )
+
+
+class GapIndex:
+    '''
+        Filenames known to be missing on every `step`th day from `start` to
+        `end`, so crawls through those dates don't have to probe. Gaps
+        expire by the same rules as missing entries in the cache, see
+        `should_recheck`.
+    '''
+
+    def __init__(self, location, should_recheck):
+        self.location = location
+        self.should_recheck = should_recheck
+        self._gaps = {}
+        self._lock = threading.Lock()
+        self.dirty = False
+        try:
+            with open(location, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        if not data.startswith(HEADER):
+            logger.info('Ignoring gap index %s of another version', location)
+            return
+        offset = len(HEADER)
+        while offset + RECORD.size <= len(data):
+            start, end, checked_at, step, fn_len = RECORD.unpack_from(
+                data, offset
+            )
+            offset += RECORD.size
+            fn = data[offset : offset + fn_len].decode('utf-8')
+            offset += fn_len
+            self._gaps.setdefault(fn, []).append(
+                Gap(start, end, step, checked_at)
+            )
+
+    def __len__(self):
+        return sum(len(gaps) for gaps in self._gaps.values())
+
+    def covers(self, fn, dates, step):
+        '''
+            Whether `fn` is known to be missing on all of `dates`, which
+            are `step` days apart.
+        '''
+        start = min(dates).toordinal()
+        end = max(dates).toordinal()
+        with self._lock:
+            gaps = list(self._gaps.get(fn, ()))
+        return any(
+            gap.covers(start, end, step)
+            and not gap.expired(self.should_recheck)
+            for gap in gaps
+        )
+
+    def add(self, fn, dates, step, checked_at):
+        '''
+            Record that `fn` was missing on all of `dates` (`step` days
+            apart), the earliest of those checks was at `checked_at`.
+        '''
+        gap = Gap(
+            min(dates).toordinal(),
+            max(dates).toordinal(),
+            step,
+            int(checked_at.timestamp()),
+        )
+        with self._lock:
+            gaps = self._gaps.setdefault(fn, [])
+            for other in [other for other in gaps if other.touches(gap)]:
+                gaps.remove(other)
+                gap.start = min(gap.start, other.start)
+                gap.end = max(gap.end, other.end)
+                # Merged gaps expire when the oldest check would
+                gap.checked_at = min(gap.checked_at, other.checked_at)
+            gaps.append(gap)
+            self.dirty = True
+
+    def compact(self, now=None):
+        with self._lock:
+            for fn, gaps in list(self._gaps.items()):
+                gaps[:] = [
+                    gap
+                    for gap in gaps
+                    if not gap.expired(self.should_recheck, now=now)
+                ]
+                if not gaps:
+                    del self._gaps[fn]
+            self.dirty = True
+
+    def write(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            records = []
+            for fn, gaps in self._gaps.items():
+                encoded = fn.encode('utf-8')
+                for gap in gaps:
+                    records.append(
+                        RECORD.pack(
+                            gap.start,
+                            gap.end,
+                            gap.checked_at,
+                            gap.step,
+                            len(encoded),
+                        )
+                        + encoded
+                    )
+            tmp_location = f'{self.location}.{os.getpid()}.tmp'
+            with open(tmp_location, 'wb') as f:
+                f.write(HEADER + b''.join(records))
+            os.replace(tmp_location, self.location)
+            self.dirty = False
@@ -1,11 +1,11 @@
 import logging
-import tempfile
 import os
 import copy
-import shutil
+from multiprocessing.pool import ThreadPool
 
 from ruv_dl.programs import ProgramFetcher
 from ruv_dl.data import Entry, Episode
+from ruv_dl.migrations.planner import plan_renames
 
 logger = logging.getLogger(__name__)
 
@@ -16,67 +16,99 @@ logger = logging.getLogger(__name__)
 '''
 
 
-def move_old_locations(destination, dryrun=False):
+def get_old_locations(destination, program_info):
+    program = program_info.program
+    moves = {}
+    for season, entries in program_info.seasons.items():
+        season_folder = Entry.get_season_folder(destination, program, season)
+        for i, target_entry in enumerate(entries.sorted()):
+            if target_entry.episode.number is None:
+                raise RuntimeError(
+                    'You need to attempt sync for this program once '
+                    'before running this migration.'
+                )
+            src_entry = copy.deepcopy(target_entry)
+            src_entry.episode = Episode(None)
+            src_entry.episode.number = i + 1
+
+            src_dest = os.path.join(
+                season_folder, src_entry.get_target_basename(program, season),
+            )
+
+            target_dest = os.path.join(
+                season_folder,
+                target_entry.get_target_basename(program, season),
+            )
+
+            if src_dest != target_dest and os.path.isfile(src_dest):
+                moves[src_dest] = target_dest
+    return moves
+
+
+def move_program_old_locations(destination, program_info, dryrun=False):
+    program = program_info.program
+    logger.info('Targeting %s', program['title'])
+    moves = get_old_locations(destination, program_info)
+    occupied = [
+        dst
+        for dst in moves.values()
+        if dst not in moves and os.path.exists(dst)
+    ]
+    planned, blocked = plan_renames(moves, occupied)
+    for src_dest, target_dest in blocked:
+        logger.error(
+            'Not moving %s, %s exists and is not being moved',
+            src_dest,
+            target_dest,
+        )
+    if dryrun:
+        for src_dest, target_dest in planned:
+            logger.warning('Would move %s to %s', src_dest, target_dest)
+        return len(planned)
+    for i, (src_dest, target_dest) in enumerate(planned, start=1):
+        logger.debug('Moving %s to %s', src_dest, target_dest)
+        os.makedirs(os.path.dirname(target_dest), exist_ok=True)
+        os.rename(src_dest, target_dest)
+        if i % 100 == 0:
+            logger.info('%s: %d/%d moved', program['title'], i, len(planned))
+    if blocked:
+        # Keep the old version so `ruv-dl migrate 1` retries the blocked
+        # renames once the conflicts are cleared.
+        logger.error(
+            '%s: %d files could not be moved, clear the conflicts and run '
+            'the migration again',
+            program['title'],
+            len(blocked),
+        )
+        return len(planned)
+    program_info.version = 1
+    program_info.write()
+    return len(planned)
+
+
+def move_old_locations(destination, dryrun=False, jobs=4):
     fetcher = ProgramFetcher(None, None, destination)
+    program_infos = []
     for program_info in fetcher.get_all_program_infos():
         if program_info.version >= 1:
             logger.info('Skipping %s', program_info)
             continue
-        program = program_info.program
-        logger.info('Targeting %s', program['title'])
-        seasons = program_info.seasons
-        files_to_move = []
-        for season, entries in seasons.items():
-            season_folder = Entry.get_season_folder(
-                destination, program, season
-            )
-            for i, target_entry in enumerate(entries.sorted()):
-                if target_entry.episode.number is None:
-                    raise RuntimeError(
-                        'You need to attempt sync for this program once '
-                        'before running this migration.'
-                    )
-                src_entry = copy.deepcopy(target_entry)
-                src_entry.episode = Episode(None)
-                src_entry.episode.number = i + 1
-
-                src_dest = os.path.join(
-                    season_folder,
-                    src_entry.get_target_basename(program, season),
-                )
+        program_infos.append(program_info)
 
-                target_dest = os.path.join(
-                    season_folder,
-                    target_entry.get_target_basename(program, season),
-                )
+    def migrate(program_info):
+        return move_program_old_locations(destination, program_info, dryrun)
 
-                if src_dest != target_dest and os.path.isfile(src_dest):
-                    files_to_move.append((src_dest, target_dest))
-        while files_to_move:
-            i = 0
-            src_dest, target_dest = files_to_move.pop(0)
-            if dryrun:
-                logger.info('Would move %s to %s', src_dest, target_dest)
-            elif os.path.isfile(target_dest):
-                temp_path = next(tempfile._get_candidate_names())
-                temp_path = os.path.join(
-                    os.path.dirname(target_dest), temp_path,
-                )
-                logger.info(
-                    '%s exists. Moving temporarily to %s and postponing',
-                    target_dest,
-                    temp_path,
-                )
-                shutil.move(src_dest, temp_path)
-                files_to_move.append((temp_path, target_dest))
-            else:
-                os.makedirs(os.path.dirname(target_dest), exist_ok=True)
-                logger.info('Moving %s to %s', src_dest, target_dest)
-                shutil.move(src_dest, target_dest)
-
-        if not dryrun:
-            program_info.version = 1
-            program_info.write()
+    with ThreadPool(jobs) as pool:
+        for i, moved in enumerate(
+            pool.imap_unordered(migrate, program_infos), start=1
+        ):
+            logger.warning(
+                '%d/%d programs %s (%d moves)',
+                i,
+                len(program_infos),
+                'planned' if dryrun else 'migrated',
+                moved,
+            )
 
 
 MIGRATIONS = {1: (move_old_locations,)}
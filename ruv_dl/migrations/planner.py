@@ -0,0 +1,74 @@
+import os
+import tempfile
+
+
+def get_temp_path(path):
+    return os.path.join(
+        os.path.dirname(path), f'.{next(tempfile._get_candidate_names())}'
+    )
+
+
+def plan_renames(moves, occupied=(), temp_path=get_temp_path):
+    '''
+        Order renames in `moves` ({src: dst}) so that no file is
+        overwritten.
+
+        Renames form chains (a -> b -> c where c is free) and cycles
+        (a -> b -> a). Chains are renamed back to front and each cycle is
+        broken with a single move through a temporary path, which is the
+        minimum number of extra moves.
+
+        `occupied` are destinations that exist on disk and are not being
+        moved away. Renames into those (and every rename waiting on them)
+        are returned as blocked instead of planned.
+
+        Returns (planned, blocked), both lists of (src, dst).
+    '''
+    moves = {src: dst for src, dst in moves.items() if src != dst}
+    dst_to_src = {}
+    for src, dst in moves.items():
+        if dst in dst_to_src:
+            raise ValueError(
+                f'{dst_to_src[dst]} and {src} both want to move to {dst}'
+            )
+        dst_to_src[dst] = src
+
+    occupied = set(occupied)
+    planned = []
+    blocked = []
+    done = set()
+
+    def chain_back(src, target):
+        # Emit renames into `src` now that it has been vacated
+        while src in dst_to_src:
+            prev = dst_to_src[src]
+            if prev in done:
+                break
+            target.append((prev, src))
+            done.add(prev)
+            src = prev
+
+    # Chains end in a destination that is not a source
+    for src in sorted(moves):
+        dst = moves[src]
+        if dst in moves:
+            continue
+        target = blocked if dst in occupied else planned
+        target.append((src, dst))
+        done.add(src)
+        chain_back(src, target)
+
+    # Whatever is left are cycles
+    for src in sorted(moves):
+        if src in done:
+            continue
+        temp = temp_path(src)
+        planned.append((src, temp))
+        done.add(src)
+        cycle = []
+        chain_back(src, cycle)
+        planned.extend(cycle)
+        # The last rename in the cycle vacated the first destination
+        planned.append((temp, moves[src]))
+
+    return planned, blocked
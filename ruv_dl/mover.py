@@ -1,8 +1,9 @@
 #!/usr/bin/env python
+import functools
+import json
 import os
 import re
 import logging
-import shutil
 
 from ruv_dl.programs import ProgramInfo
 from ruv_dl.runtime import settings
@@ -10,11 +11,119 @@ from ruv_dl.exceptions import NamingSchemaError, ProgramInfoError
 
 
 SEASON_RE = re.compile(f'^Season (\\d+)$')
+JOURNAL_FN = '.ruv-dl-journal'
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def get_episode_re(title):
+    return re.compile(f'Season (\\d+){os.sep}{title} - S(\\d+)E(\\d+).mp4$')
+
+
+class MoveJournal:
+    '''
+        Records planned renames in the program folder before touching any
+        files. The first line is the plan, every following line is the index
+        of a rename that has been completed. If we crash, `recover` rolls
+        the remaining renames forward and writes the planned program info.
+    '''
+
+    def __init__(self, program_dir):
+        self.location = os.path.join(program_dir, JOURNAL_FN)
+
+    def exists(self):
+        return os.path.exists(self.location)
+
+    def run(self, renames, program_info):
+        with open(self.location, 'w') as f:
+            f.write(
+                json.dumps(
+                    {
+                        'renames': renames,
+                        'program_info_fn': program_info.fn,
+                        'program_info': program_info.to_dict(),
+                    }
+                )
+            )
+            f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+            for i, (src, dst) in enumerate(renames):
+                logger.info('Moving %s to %s', src, dst)
+                os.rename(src, dst)
+                f.write(f'{i}\n')
+                f.flush()
+        program_info.write()
+        os.remove(self.location)
+
+    def recover(self):
+        with open(self.location, 'r') as f:
+            lines = f.read().splitlines()
+        try:
+            plan = json.loads(lines[0])
+        except (IndexError, ValueError):
+            # We crashed while writing the plan, nothing was moved.
+            if settings.dryrun:
+                logger.warning(
+                    f'Dryrun. Would remove incomplete journal {self.location}.'
+                )
+                return
+            logger.warning('Removing incomplete journal %s', self.location)
+            os.remove(self.location)
+            return
+        done = {int(line) for line in lines[1:] if line.isdigit()}
+        if settings.dryrun:
+            for i, (src, dst) in enumerate(plan['renames']):
+                if i not in done:
+                    logger.warning(
+                        f'Dryrun. Would finish interrupted move of {src} to '
+                        f'{dst}.'
+                    )
+            return
+        logger.warning('Rolling forward interrupted move in %s', self.location)
+        for i, (src, dst) in enumerate(plan['renames']):
+            if i in done:
+                continue
+            if os.path.exists(src):
+                logger.info('Moving %s to %s', src, dst)
+                os.rename(src, dst)
+            elif not os.path.exists(dst):
+                logger.error(
+                    'Neither %s nor %s exist, skipping rename', src, dst
+                )
+        ProgramInfo.from_dict(
+            plan['program_info_fn'], plan['program_info']
+        ).write()
+        os.remove(self.location)
+
+
+class MovePlan:
+    '''
+        Collects renames and program info changes for one program so they
+        can be executed and written in one go.
+    '''
+
+    def __init__(self, program_info):
+        self.program_info = program_info
+        self.seasons = program_info.seasons
+        self.renames = []
+
+    def add(self, src, dst):
+        self.renames.append((src, dst))
+
+    def execute(self):
+        if settings.dryrun:
+            for src, dst in self.renames:
+                logger.warning(f'Dryrun. Would move {src} to {dst}.')
+            return
+        self.program_info.seasons = self.seasons
+        MoveJournal(os.path.dirname(self.program_info.fn)).run(
+            self.renames, self.program_info
+        )
+
+
 class Mover:
-    def __init__(self, src, dst):
+    def __init__(self, src, dst, program_infos=None):
         for path in (src, dst):
             if not os.path.isabs(path):
                 raise OSError(
@@ -22,27 +131,41 @@ class Mover:
                 )
         if os.path.exists(dst):
             raise FileExistsError(f'{dst} exists')
+        if program_infos is None:
+            program_infos = {}
+        self.program_info = self._find_program_info(src, program_infos)
+        self.src = src
+        self.dst = dst
+
+    def _find_program_info(self, src, program_infos):
         dirname = os.path.dirname(src)
         while dirname != os.path.dirname(dirname):
+            if dirname in program_infos:
+                return program_infos[dirname]
+            journal = MoveJournal(dirname)
+            if journal.exists():
+                journal.recover()
             try:
-                self.program_info = ProgramInfo(dirname)
-                break
+                program_infos[dirname] = ProgramInfo(dirname)
+                return program_infos[dirname]
             except FileNotFoundError:
                 dirname = os.path.dirname(dirname)
-        else:
-            raise FileNotFoundError(
-                f'Could not find program info related to {src}'
-            )
-        self.src = src
-        self.dst = dst
+        raise FileNotFoundError(
+            f'Could not find program info related to {src}'
+        )
 
     def move(self):
+        plan = MovePlan(self.program_info)
+        self.plan(plan)
+        plan.execute()
+
+    def plan(self, plan):
         if os.path.isdir(self.src):
-            self.move_season()
+            self.plan_season(plan)
         else:
-            self.move_episode()
+            self.plan_episode(plan)
 
-    def move_episode(self):
+    def plan_episode(self, plan):
         src_season, src_episode = self._get_episode_season_and_number(
             self.program_info.program, self.src
         )
@@ -54,8 +177,7 @@ class Mover:
                 'Moving episodes between seasons is not supported'
             )
         season_number = self._get_season_number(os.path.dirname(self.src))
-        seasons = self.program_info.seasons
-        season = seasons[season_number]
+        season = plan.seasons[season_number]
         src_entry = None
         for entry in season:
             if entry.episode.number == src_episode:
@@ -72,16 +194,11 @@ class Mover:
             raise ProgramInfoError(
                 'Source episode not found in program info file'
             )
-        if settings.dryrun:
-            logger.warning(f'Dryrun. Would move {self.src} to {self.dst}.')
-        else:
-            shutil.move(self.src, self.dst)
-            src_entry.episode.number = dst_episode
-            self.program_info.seasons = seasons
-            self.program_info.write()
+        plan.add(self.src, self.dst)
+        src_entry.episode.number = dst_episode
 
-    def move_season(self):
-        seasons = self.program_info.seasons
+    def plan_season(self, plan):
+        seasons = plan.seasons
         src_season_no = self._get_season_number(self.src)
         dst_season_no = self._get_season_number(self.dst)
         if src_season_no not in seasons:
@@ -89,9 +206,8 @@ class Mover:
                 f'Source season number {src_season_no} not found in info file '
                 f'{self.program_info.fn}'
             )
-        files_in_src = os.listdir(self.src)
-        filenames_to_move = []
-        for fn in files_in_src:
+        renames = []
+        for fn in os.listdir(self.src):
             src = os.path.join(self.src, fn)
             season, episode = self._get_episode_season_and_number(
                 self.program_info.program, src
@@ -99,21 +215,12 @@ class Mover:
             part_change = f'S{str(season).zfill(2)}'
             assert part_change in src
             dst = src.replace(part_change, f'S{str(dst_season_no).zfill(2)}')
-            filenames_to_move.append((src, dst))
-        if settings.dryrun:
-            logger.warning(f'Dryrun. Would move {self.src} to {self.dst}.')
-            for src, dst in filenames_to_move:
-                logger.warning(
-                    f'Would also move {src} to {dst} prior to moving season'
-                )
-        else:
-            for src, dst in filenames_to_move:
-                shutil.move(src, dst)
-            shutil.move(self.src, self.dst)
-            seasons[dst_season_no] = seasons[src_season_no]
-            del seasons[src_season_no]
-            self.program_info.seasons = seasons
-            self.program_info.write()
+            renames.append((src, dst))
+        # Rename the files inside the season before moving the season itself
+        for src, dst in renames:
+            plan.add(src, dst)
+        plan.add(self.src, self.dst)
+        seasons[dst_season_no] = seasons.pop(src_season_no)
 
     def _get_season_number(self, path):
         name = os.path.basename(path)
@@ -125,9 +232,7 @@ class Mover:
         return int(result.group(1))
 
     def _get_episode_re(self, program):
-        return re.compile(
-            f'Season (\\d+){os.sep}{program["title"]} - S(\\d+)E(\\d+).mp4$'
-        )
+        return get_episode_re(program['title'])
 
     def _get_episode_season_and_number(self, program, path):
         result = self._get_episode_re(program).search(path)
@@ -141,3 +246,30 @@ class Mover:
         raise NamingSchemaError(
             f'Episode/season number not determined from {path}'
         )
+
+
+class BatchMover:
+    '''
+        Move many seasons or episodes at once. Each program info is loaded
+        once, all renames for a program are planned before anything is
+        moved and the program info is written once at the end.
+    '''
+
+    def __init__(self, pairs):
+        program_infos = {}
+        self.movers = [
+            Mover(src, dst, program_infos=program_infos) for src, dst in pairs
+        ]
+        dsts = [mover.dst for mover in self.movers]
+        if len(set(dsts)) != len(dsts):
+            raise FileExistsError('Same destination given more than once')
+
+    def move(self):
+        plans = {}
+        for mover in self.movers:
+            fn = mover.program_info.fn
+            if fn not in plans:
+                plans[fn] = MovePlan(mover.program_info)
+            mover.plan(plans[fn])
+        for plan in plans.values():
+            plan.execute()
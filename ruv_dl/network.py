@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+import datetime
+import email.utils
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+RETRIES = 4
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+BACKOFF_BASE = 1
+BACKOFF_CAP = 60
+# Read errors mean the server is up but slow, give it more time
+READ_BACKOFF_BASE = 4
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Errors that happen while reading a response body
+READ_ERRORS = (
+    requests.exceptions.ReadTimeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+
+
+def backoff(attempt, base=BACKOFF_BASE):
+    '''
+        Exponential backoff with full jitter
+    '''
+    return random.uniform(0, min(BACKOFF_CAP, base * 2 ** attempt))
+
+
+def retry_after(r, attempt):
+    '''
+        Seconds to wait before retrying a throttled response, from its
+        Retry-After header (seconds or an HTTP date) or exponential backoff,
+        at most BACKOFF_CAP.
+    '''
+    value = r.headers.get('Retry-After', '').strip()
+    try:
+        wait = float(value)
+    except ValueError:
+        try:
+            at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            at = None
+        if at is None:
+            wait = 2 ** attempt
+        else:
+            if at.tzinfo is None:
+                at = at.replace(tzinfo=datetime.timezone.utc)
+            wait = (
+                at - datetime.datetime.now(datetime.timezone.utc)
+            ).total_seconds()
+    return max(0, min(BACKOFF_CAP, wait))
+
+
+class CircuitBreaker:
+    '''
+        Opens after `threshold` consecutive connection failures or server
+        errors. While open every caller waits for `reset_timeout` seconds,
+        then a single caller is let through to test the waters. If that
+        fails the breaker opens again, otherwise everyone continues.
+    '''
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, threshold=5, reset_timeout=30):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._condition = threading.Condition()
+
+    def wait(self):
+        with self._condition:
+            while True:
+                if self.state == self.CLOSED:
+                    return
+                if self.state == self.OPEN:
+                    remaining = (
+                        self.opened_at + self.reset_timeout - time.monotonic()
+                    )
+                    if remaining <= 0:
+                        logger.warning('Retrying %s', self.name)
+                        self.state = self.HALF_OPEN
+                        self.opened_at = time.monotonic()
+                        return
+                    self._condition.wait(remaining)
+                else:
+                    # Someone else is testing if the host is back. If they
+                    # never report back, test it ourselves.
+                    remaining = (
+                        self.opened_at + self.reset_timeout - time.monotonic()
+                    )
+                    if remaining <= 0:
+                        logger.warning('Retrying %s again', self.name)
+                        self.opened_at = time.monotonic()
+                        return
+                    self._condition.wait(remaining)
+
+    def record_success(self):
+        with self._condition:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                logger.warning('%s is back', self.name)
+                self.state = self.CLOSED
+                self._condition.notify_all()
+
+    def record_failure(self):
+        with self._condition:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    logger.error(
+                        '%s is failing, pausing requests for %ds',
+                        self.name,
+                        self.reset_timeout,
+                    )
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._condition.notify_all()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    host = urlparse(url).netloc
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+
+def request(method, url, retries=RETRIES, retry_statuses=RETRY_STATUSES, **kw):
+    '''
+        requests.request with retries and a circuit breaker per host.
+
+        Connection errors (DNS, refused, connect timeouts) count towards
+        the host's circuit breaker and are retried with jittered
+        exponential backoff. Read errors are retried with a longer backoff
+        but don't open the breaker, the host is reachable. Responses with a
+        status in `retry_statuses` are retried, server errors count as
+        failures. Other responses are returned as is.
+    '''
+    breaker = get_breaker(url)
+    kw.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    for attempt in range(retries + 1):
+        breaker.wait()
+        try:
+            r = requests.request(method, url, **kw)
+        except requests.exceptions.ConnectionError as e:
+            breaker.record_failure()
+            if attempt == retries:
+                raise
+            delay = backoff(attempt)
+            logger.warning(
+                'Could not connect to %s (%s), retrying in %.1fs',
+                url,
+                e,
+                delay,
+            )
+        except READ_ERRORS as e:
+            # We got through to the host
+            breaker.record_success()
+            if attempt == retries:
+                raise
+            delay = backoff(attempt, READ_BACKOFF_BASE)
+            logger.warning(
+                'Error reading %s (%s), retrying in %.1fs', url, e, delay
+            )
+        except BaseException:
+            # Don't leave others waiting for a half open breaker
+            breaker.record_failure()
+            raise
+        else:
+            if r.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if r.status_code not in retry_statuses or attempt == retries:
+                return r
+            r.close()
+            delay = backoff(attempt)
+            logger.warning(
+                'Got %d for %s, retrying in %.1fs', r.status_code, url, delay
+            )
+        time.sleep(delay)
+
+
+def get(url, **kw):
+    return request('GET', url, **kw)
+
+
+def head(url, **kw):
+    return request('HEAD', url, **kw)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+import datetime
+import itertools
+import json
+import logging
+import os
+from multiprocessing.pool import ThreadPool
+
+import requests
+
+from ruv_dl import network
+from ruv_dl.data import Entry
+from ruv_dl.downloader import Downloader
+from ruv_dl.programs import ProgramInfo
+from ruv_dl.throttle import get_probe_throttle
+from ruv_dl.constants import DATETIME_FORMAT
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+
+
+def get_size(entry):
+    '''
+        Size of `entry` in bytes according to the CDN, None if unknown.
+    '''
+    try:
+        with get_probe_throttle().probe() as probe:
+            r = network.head(entry.url)
+            probe.status_code = r.status_code
+    except requests.exceptions.RequestException as e:
+        logger.error('Could not get size of %s: %s', entry.url, e)
+        return None
+    if not r.ok or 'content-length' not in r.headers:
+        logger.warning('No size for %s (%d)', entry.url, r.status_code)
+        return None
+    return int(r.headers['content-length'])
+
+
+def build_plan(destination, downloaders):
+    '''
+        The downloads for `downloaders` (pairs of organized downloaders and
+        the entries they would download) as a dict that can be written to
+        disk and executed later.
+    '''
+    entries = list(itertools.chain(*(entries for _, entries in downloaders)))
+    with ThreadPool(8) as pool:
+        sizes = dict(zip(map(id, entries), pool.map(get_size, entries)))
+    programs = []
+    for downloader, entries in downloaders:
+        if not entries:
+            continue
+        files = []
+        for entry in sorted(entries, key=lambda entry: entry.date):
+            data = entry.to_dict()
+            data['target_path'] = entry.target_path
+            data['size'] = sizes[id(entry)]
+            files.append(data)
+        programs.append(
+            {
+                'program': downloader.program,
+                'files': files,
+                'size': sum(f['size'] or 0 for f in files),
+            }
+        )
+    return {
+        'version': PLAN_VERSION,
+        'created_at': datetime.datetime.now().strftime(DATETIME_FORMAT),
+        'destination': destination,
+        'programs': programs,
+        'files': sum(len(p['files']) for p in programs),
+        'size': sum(p['size'] for p in programs),
+        'unknown_sizes': len([s for s in sizes.values() if s is None]),
+    }
+
+
+def write_plan(fn, plan):
+    with open(fn, 'w') as f:
+        f.write(json.dumps(plan, indent=4))
+
+
+def read_plan(fn):
+    with open(fn, 'r') as f:
+        plan = json.loads(f.read())
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(
+            f'Unsupported plan version {plan.get("version")} in {fn}'
+        )
+    return plan
+
+
+def load_downloaders(plan, threaded=True):
+    '''
+        Downloaders and entries for the files in `plan`. Entries are taken
+        from the program infos when possible so checksums of downloaded
+        files are recorded there.
+    '''
+    downloaders = []
+    for program_plan in plan['programs']:
+        program = program_plan['program']
+        program_dir = os.path.join(plan['destination'], program['title'])
+        try:
+            program_info = ProgramInfo(program_dir)
+        except FileNotFoundError:
+            program_info = None
+        if program_info is not None and not program_info.is_valid():
+            program_info = None
+        downloader = Downloader(
+            destination=plan['destination'],
+            program=program,
+            episode_entries=[],
+            threaded=threaded,
+            program_info=program_info,
+        )
+        known = {}
+        if program_info is not None:
+            downloader.seasons = program_info.seasons
+            known = {
+                entry.etag: entry
+                for entry in itertools.chain(*downloader.seasons.values())
+            }
+        entries = []
+        for data in program_plan['files']:
+            entry = known.get(data['etag'])
+            if entry is None:
+                entry = Entry.from_dict(data)
+                # The plan size is from the CDN, not a downloaded file
+                entry.size = None
+            entry.set_target_path(data['target_path'])
+            entries.append(entry)
+        downloaders.append((downloader, entries))
+    return downloaders
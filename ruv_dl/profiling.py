@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+import collections
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from ruv_dl.runtime import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    def __init__(self, name, program=None):
+        self.name = name
+        self.program = program
+        self.start = time.time()
+        self.thread = threading.current_thread().name
+        self.duration = 0.0
+        # Time spent in spans started while this one was active
+        self.child_time = 0.0
+
+    @property
+    def self_time(self):
+        return self.duration - self.child_time
+
+    def __repr__(self):
+        return f'<Span {self.name} {self.program} {self.duration:.3f}s>'
+
+
+class Profiler:
+    '''
+        Times phases of a run (spans) per program. With `profile_dir` each
+        phase is also run under cProfile and dumped to
+        `profile_dir/<phase>.pstats`.
+
+        Functions added with `add_hook` are called with each span when it
+        ends, e.g. to forward them to a tracing backend. Spans are only
+        recorded when enabled or when there are hooks.
+    '''
+
+    def __init__(self, enabled=False, profile_dir=None):
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.spans = []
+        self.hooks = []
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def active(self):
+        return self.enabled or bool(self.hooks)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _finish(self, span):
+        if self.enabled:
+            with self._lock:
+                self.spans.append(span)
+        for hook in self.hooks:
+            try:
+                hook(span)
+            except Exception:
+                logger.exception('Span hook %s failed', hook)
+
+    def _start_profile(self):
+        # cProfile can't nest, only profile the outermost span in a thread
+        if not self.profile_dir or getattr(self._local, 'profile', None):
+            return None
+        import cProfile
+
+        profile = self._local.profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def _stop_profile(self, name, profile):
+        import pstats
+
+        profile.disable()
+        self._local.profile = None
+        with self._lock:
+            if name in self._stats:
+                self._stats[name].add(profile)
+            else:
+                self._stats[name] = pstats.Stats(profile)
+
+    @contextlib.contextmanager
+    def span(self, name, program=None):
+        if not self.active:
+            yield None
+            return
+        span = Span(name, program)
+        stack = self._stack()
+        profile = self._start_profile()
+        stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - start
+            stack.pop()
+            if profile is not None:
+                self._stop_profile(name, profile)
+            if stack:
+                stack[-1].child_time += span.duration
+            self._finish(span)
+
+    def iterate(self, name, iterable, program=None):
+        '''
+            Yield from `iterable`, timing only the time spent producing
+            items. `program` is the program name or a function getting it
+            from each item, in which case each item gets its own span.
+        '''
+        if not self.active:
+            yield from iterable
+            return
+        per_item = callable(program)
+        span = None
+        iterator = iter(iterable)
+        try:
+            while True:
+                if span is None:
+                    span = Span(name, None if per_item else program)
+                stack = self._stack()
+                stack.append(span)
+                profile = self._start_profile()
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed = time.perf_counter() - start
+                    span.duration += elapsed
+                    stack.pop()
+                    if profile is not None:
+                        self._stop_profile(name, profile)
+                    if stack:
+                        stack[-1].child_time += elapsed
+                if per_item:
+                    span.program = program(item)
+                    self._finish(span)
+                    span = None
+                yield item
+        finally:
+            if span is not None and not per_item:
+                self._finish(span)
+
+    def dump_stats(self):
+        if not self.profile_dir:
+            return []
+        os.makedirs(self.profile_dir, exist_ok=True)
+        fns = []
+        with self._lock:
+            for name, stats in self._stats.items():
+                fn = os.path.join(self.profile_dir, f'{name}.pstats')
+                stats.dump_stats(fn)
+                fns.append(fn)
+        return fns
+
+    def report(self):
+        '''
+            Time spent in each phase, in total and per program.
+        '''
+        with self._lock:
+            spans = list(self.spans)
+        totals = collections.OrderedDict()
+        programs = collections.OrderedDict()
+        for span in spans:
+            count, total = totals.get(span.name, (0, 0.0))
+            totals[span.name] = (count + 1, total + span.self_time)
+            if span.program is not None:
+                phases = programs.setdefault(span.program, {})
+                phases[span.name] = phases.get(span.name, 0) + span.self_time
+        lines = [f'{"phase":<12}{"count":>8}{"seconds":>12}']
+        for name, (count, total) in totals.items():
+            lines.append(f'{name:<12}{count:>8}{total:>12.2f}')
+        if programs:
+            lines.append('')
+        for program, phases in programs.items():
+            lines.append(
+                f'{program}: '
+                + ', '.join(
+                    f'{name} {seconds:.2f}s'
+                    for name, seconds in phases.items()
+                )
+            )
+        return '\n'.join(lines)
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler(
+                enabled=settings.profile,
+                profile_dir=settings.profile_dir or None,
+            )
+        return _profiler
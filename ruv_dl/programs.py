@@ -5,10 +5,11 @@ import datetime
 import logging
 import glob
 
-import requests
-
 from ruv_dl.data import Entry, EntrySet
 from ruv_dl.date_utils import parse_datetime
+from ruv_dl.profiling import get_profiler
+from ruv_dl.sharding import in_shard
+from ruv_dl.title_index import INTERACTIVE, TitleIndex, choose_program
 from ruv_dl.constants import PROGRAM_INFO_FN, NON_SEASON_FIELDS
 
 logger = logging.getLogger(__name__)
@@ -19,10 +20,14 @@ class ProgramInfo:
         if os.path.exists(fn) and os.path.isdir(fn):
             fn = os.path.join(fn, PROGRAM_INFO_FN)
         self.fn = fn
+        self.mtime_ns = None
+        # Whether the program was changed since it was read or written
+        self.dirty = False
         if initialize_empty:
             self._data = {'__version__': 1}
         else:
             with open(fn, 'r') as f:
+                self.mtime_ns = os.fstat(f.fileno()).st_mtime_ns
                 try:
                     data = json.loads(f.read())
                 except ValueError:
@@ -39,6 +44,15 @@ class ProgramInfo:
                     else:
                         logger.info('Could not get program from %s', data)
 
+    @classmethod
+    def from_dict(cls, fn, data):
+        program_info = cls(fn, initialize_empty=True)
+        program_info._data = data
+        return program_info
+
+    def to_dict(self):
+        return self._data
+
     def __str__(self):
         return f'[{self.fn}: Version {self.version}]'
 
@@ -48,6 +62,8 @@ class ProgramInfo:
 
     @program.setter
     def program(self, program):
+        if program != self._data.get('program'):
+            self.dirty = True
         self._data['program'] = program
 
     @property
@@ -59,8 +75,14 @@ class ProgramInfo:
         self._data['__version__'] = version
 
     def write(self):
-        with open(self.fn, 'w') as f:
+        # Write to a temporary file first so a crash never leaves a half
+        # written program info behind.
+        tmp_fn = f'{self.fn}.tmp'
+        with open(tmp_fn, 'w') as f:
             f.write(json.dumps(self._data, indent=4))
+        os.replace(tmp_fn, self.fn)
+        self.mtime_ns = os.stat(self.fn).st_mtime_ns
+        self.dirty = False
 
     def is_valid(self):
         return hasattr(self, '_data')
@@ -84,35 +106,124 @@ class ProgramInfo:
             self._data[key] = [entry.to_dict() for entry in entries.sorted()]
 
 
+class LibraryIndex:
+    '''
+        Keeps the program infos in `destination` in memory between update
+        passes and only reloads the ones that changed on disk.
+    '''
+
+    def __init__(self, destination):
+        self.destination = destination
+        self._infos = {}
+
+    def program_infos(self):
+        infos = {}
+        for fn in glob.glob(
+            os.path.join(self.destination, '*', PROGRAM_INFO_FN)
+        ):
+            try:
+                mtime_ns = os.stat(fn).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            program_info = self._infos.get(fn)
+            if program_info is None or program_info.mtime_ns != mtime_ns:
+                logger.debug('Loading %s', fn)
+                program_info = ProgramInfo(fn)
+            infos[fn] = program_info
+        self._infos = infos
+        return [
+            program_info
+            for program_info in infos.values()
+            if program_info.is_valid()
+        ]
+
+    def get(self, program_id):
+        for program_info in self._infos.values():
+            if (
+                program_info.is_valid()
+                and program_info.program['id'] == program_id
+            ):
+                return program_info
+
+
 class ProgramFetcher:
     pool = None
 
-    def __init__(self, query=None, update=None, destination=None):
+    def __init__(
+        self,
+        query=None,
+        update=None,
+        destination=None,
+        library=None,
+        shard=None,
+        match=INTERACTIVE,
+        title_index=None,
+    ):
         if not destination:
             raise RuntimeError('Missing required destination parameter')
         self.query = query
         self.update = update
         self.destination = destination
+        self.library = library
+        self.shard = shard
+        self.match = match
+        self.title_index = title_index
 
     def get_programs(self):
         if self.query:
-            return self.get_programs_by_query(self.query)
-        return self.get_programs_to_update()
+            programs = self.get_programs_by_query(self.query)
+        else:
+            programs = self.get_programs_to_update()
+        return get_profiler().iterate(
+            'fetch', programs, program=lambda program: program['title']
+        )
 
     def get_programs_by_query(self, queries):
-        for query in queries:
+        if self.title_index is None:
+            self.title_index = self.load_title_index()
+        try:
+            if self.match == INTERACTIVE:
+                programs = map(self.get_program_for_query, queries)
+            else:
+                from multiprocessing.pool import ThreadPool
+
+                with ThreadPool(8) as pool:
+                    programs = pool.map(self.get_program_for_query, queries)
+            for query, program in zip(queries, programs):
+                if program:
+                    yield program
+                else:
+                    logger.warning('Got not program for query %s', query)
+        finally:
+            self.title_index.write()
+
+    def load_title_index(self):
+        title_index = TitleIndex()
+        # Programs we already sync resolve without asking the API
+        title_index.add_programs(
+            program_info.program
+            for program_info in self.get_all_program_infos()
+        )
+        return title_index
+
+    def get_program_for_query(self, query):
+        try:
             if query.isdigit():
                 program_id = query
             else:
                 program_id = self.get_program_id(query)
-            program = self.get_program_by_id(program_id)
-            if program:
-                yield program
-            else:
-                logger.warning('Got not program for query %s', query)
+            return self.get_program_by_id(program_id)
+        except Exception as e:
+            if self.match == INTERACTIVE:
+                raise
+            logger.error('Could not resolve %s: %s', query, e)
+            return None
 
     def get_program_by_id(self, program_id):
-        r = requests.get(
+        # Imported here so local commands using ProgramInfo start quickly
+        from ruv_dl.api_cache import get_api_cache
+
+        r = get_api_cache().get(
             f'https://api.ruv.is/api/programs/program/{program_id}/all'
         )
         if r.ok:
@@ -123,10 +234,41 @@ class ProgramFetcher:
                 f'failed with status code {r.status_code}.'
             )
 
-    def get_program_id(self, query):
-        r = requests.get(f'https://api.ruv.is/api/programs/search/tv/{query}')
-        r.raise_for_status()
+    def search(self, query):
+        '''
+            Programs matching `query`, from the title index while its
+            results are fresh or when the API can't be reached.
+        '''
+        from requests.exceptions import RequestException
+        from ruv_dl.api_cache import get_api_cache
+
+        if self.title_index and self.title_index.has_search(query):
+            return self.title_index.search(query)
+        try:
+            r = get_api_cache().get(
+                f'https://api.ruv.is/api/programs/search/tv/{query}'
+            )
+            r.raise_for_status()
+        except RequestException as e:
+            if self.title_index and self.title_index.has_search(
+                query, fresh=False
+            ):
+                logger.warning('Using indexed results for %s: %s', query, e)
+                return self.title_index.search(query)
+            raise
         programs = r.json()['programs']
+        if self.title_index:
+            self.title_index.add_search(query, programs)
+        return programs
+
+    def get_program_id(self, query):
+        if self.title_index and self.match != INTERACTIVE:
+            program_id = self.title_index.get_id(query)
+            if program_id:
+                return program_id
+        programs = self.search(query)
+        if self.match != INTERACTIVE:
+            return choose_program(query, programs, self.match)['id']
         if not programs:
             raise RuntimeError(f'No programs found matching {query}')
         while True:
@@ -139,6 +281,9 @@ class ProgramFetcher:
                     return programs[selection - 1]['id']
 
     def get_all_program_infos(self):
+        if self.library is not None:
+            yield from self.library.program_infos()
+            return
         for fn in glob.glob(
             os.path.join(self.destination, '*', PROGRAM_INFO_FN)
         ):
@@ -149,6 +294,9 @@ class ProgramFetcher:
     def get_programs_to_update(self):
         for program_info in self.get_all_program_infos():
             program = program_info.program
+            if not in_shard(program['id'], self.shard):
+                logger.debug('%s not in shard, skipping', program['title'])
+                continue
             last_updated = parse_datetime(program['last_updated'])
             if (datetime.datetime.now() - last_updated).days > 15:
                 logger.warning(
@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+import heapq
+import itertools
+import logging
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from ruv_dl.bandwidth import get_bandwidth_limiter
+from ruv_dl.cache import get_cache_manager
+from ruv_dl.crawler import Crawler
+from ruv_dl.diskspace import NoSpace, get_disk_space, order_for_space
+from ruv_dl.downloader import Downloader
+from ruv_dl.expiry import (
+    get_expiries,
+    get_expiry,
+    predict_misses,
+    priorities,
+    prioritize,
+)
+from ruv_dl.runtime import settings
+from ruv_dl.sharding import Lease
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadQueue:
+    '''
+        Downloads waiting for a thread, most urgent first. Programs join
+        the queue as they are organized, a file that expires soon goes ahead
+        of those of programs that were organized before it.
+    '''
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        # Bytes waiting to be downloaded
+        self.size = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def put(self, job, priority, size):
+        with self._lock:
+            heapq.heappush(
+                self._heap, (priority, next(self._counter), job, size)
+            )
+            self.size += size or 0
+
+    def get(self):
+        with self._lock:
+            _, _, job, size = heapq.heappop(self._heap)
+            self.size -= size or 0
+            return job
+
+    def jobs(self):
+        with self._lock:
+            return [job for _, _, job, _ in sorted(self._heap)]
+
+
+class Runner:
+    '''
+        Crawls, organizes and downloads programs. Pass in `library` (a
+        LibraryIndex) to keep program infos in memory between runs. With
+        `lease_ttl` a lease is taken on each program folder so several
+        nodes can share a destination. With `plan_fn` the downloads are
+        written to a plan instead of being downloaded. Each program is
+        downloaded as soon as it is organized, while the others are still
+        being crawled. Downloads that don't fit on disk are deferred until
+        the others are done.
+    '''
+
+    def __init__(
+        self,
+        destination,
+        days_between_episodes=7,
+        iteration_count=5,
+        sequential=False,
+        library=None,
+        lease_ttl=None,
+        bitrate_policy=None,
+        plan_fn=None,
+    ):
+        self.destination = destination
+        self.days_between_episodes = days_between_episodes
+        self.iteration_count = iteration_count
+        self.sequential = sequential
+        self.library = library
+        self.lease_ttl = lease_ttl
+        self.bitrate_policy = bitrate_policy
+        self.plan_fn = plan_fn
+        self.leases = {}
+        self.deferred = []
+        self._deferred_lock = threading.Lock()
+
+    def get_program_info(self, program_id):
+        if self.library is None:
+            return None
+        return self.library.get(program_id)
+
+    def acquire_lease(self, program):
+        if self.lease_ttl is None:
+            return True
+        program_dir = os.path.join(self.destination, program['title'])
+        os.makedirs(program_dir, exist_ok=True)
+        lease = Lease(program_dir, ttl=self.lease_ttl)
+        if not lease.acquire():
+            logger.warning(
+                'Skipping %s, another node is working on it', program['title'],
+            )
+            return False
+        self.leases[program['id']] = lease
+        return True
+
+    def renew_lease(self, program_id):
+        '''
+            Whether we still hold the lease on the program, if we have one.
+        '''
+        lease = self.leases.get(program_id)
+        if lease is None:
+            return True
+        return lease.held and lease.renew()
+
+    def skip_lost(self, downloader, entry):
+        if self.renew_lease(downloader.program['id']):
+            return False
+        logger.error(
+            f'Not downloading {entry}, lost the lease on '
+            f'{downloader.program["title"]} to another node'
+        )
+        return True
+
+    def release_leases(self):
+        for lease in self.leases.values():
+            lease.release()
+        self.leases = {}
+
+    def run(self, programs):
+        try:
+            return self._run(programs)
+        finally:
+            self.release_leases()
+
+    def _run(self, programs):
+        for program in programs:
+            logger.info(f'------ {program["title"]} [{program["id"]}] ------')
+        with ThreadPool(8) as pool:
+            # Programs another node is working on are skipped
+            if self.plan_fn or settings.dryrun:
+                # Plans and dryruns list every program at once
+                downloaders = [
+                    result
+                    for result in pool.map(self.crawl_and_organize, programs)
+                    if result
+                ]
+            else:
+                # Programs are downloaded as soon as they are organized,
+                # while the others are still being crawled.
+                downloaders = (
+                    result
+                    for result in pool.imap_unordered(
+                        self.crawl_and_organize, programs
+                    )
+                    if result
+                )
+            try:
+                return self.download(downloaders)
+            finally:
+                get_cache_manager().flush()
+
+    def crawl_and_organize(self, program):
+        '''
+            Organize the episodes of `program` as the crawler finds them.
+            None if another node is working on it.
+        '''
+        # Only take the lease once the program's turn comes, so it can't
+        # expire while it waits for a thread
+        if not self.acquire_lease(program):
+            return None
+        crawler = Crawler(
+            days_between_episodes=self.days_between_episodes,
+            iteration_count=self.iteration_count,
+            program=program,
+            bitrate_policy=self.bitrate_policy,
+        )
+        downloader = Downloader(
+            destination=self.destination,
+            program=program,
+            episode_entries=crawler.iter_episodes(),
+            threaded=not self.sequential,
+            program_info=self.get_program_info(program['id']),
+        )
+        entries = downloader.organize()
+        if not self.renew_lease(program['id']):
+            logger.error(
+                'Lost the lease on %s to another node, not downloading it',
+                program['title'],
+            )
+            return downloader, []
+        return downloader, entries
+
+    def write_plan(self, downloaders):
+        from ruv_dl.plan import build_plan, write_plan
+
+        plan = build_plan(self.destination, downloaders)
+        write_plan(self.plan_fn, plan)
+        size = plan['size'] / 1024 ** 2
+        logger.warning(
+            f'Planned {plan["files"]} files, {size:.0f}MB '
+            f'({plan["unknown_sizes"]} of unknown size) in {self.plan_fn}'
+        )
+        return 0
+
+    def execute_plan(self, plan):
+        from ruv_dl.plan import load_downloaders
+
+        downloaders = load_downloaders(plan, threaded=not self.sequential)
+        sizes = {}
+        for (downloader, entries), program_plan in zip(
+            downloaders, plan['programs']
+        ):
+            for entry, data in zip(entries, program_plan['files']):
+                sizes[(downloader, entry)] = data['size']
+        return self.download(downloaders, sizes=sizes)
+
+    def get_sizes(self, jobs):
+        from ruv_dl.plan import get_size
+
+        with ThreadPool(8) as pool:
+            return dict(
+                zip(jobs, pool.map(get_size, [entry for _, entry in jobs]))
+            )
+
+    def get_expiries(self, jobs):
+        program_expiries = {}
+        expiries = {}
+        for downloader, entry in jobs:
+            program = downloader.program
+            if program['id'] not in program_expiries:
+                program_expiries[program['id']] = get_expiries(program)
+            expiries[(downloader, entry)] = get_expiry(
+                entry, program_expiries[program['id']]
+            )
+        return expiries
+
+    def report_misses(self, jobs, sizes, expiries, only=None):
+        '''
+            Warn about files that will probably expire before they are
+            downloaded at the current throughput, of those in `only` if
+            given.
+        '''
+        throughput = get_bandwidth_limiter().throughput()
+        if throughput is None:
+            return []
+        misses = predict_misses(jobs, sizes, expiries, throughput)
+        if only is not None:
+            only = set(only)
+            misses = [miss for miss in misses if miss[0] in only]
+        for (downloader, entry), finish in misses:
+            logger.warning(
+                f'{downloader.program["title"]} - {entry} expires at '
+                f'{expiries[(downloader, entry)]:%Y-%m-%d} but will probably '
+                f'not be downloaded before {finish:%Y-%m-%d %H:%M} at '
+                f'{int(throughput * 8 / 1000)}kbit/s'
+            )
+        return misses
+
+    def dryrun(self, downloaders):
+        total_entries_to_download = sum(
+            len(entries) for _, entries in downloaders
+        )
+        if not total_entries_to_download:
+            logger.info('No entries to download, bye')
+            return 0
+        logger.warning(f'Downloading {total_entries_to_download} files...')
+        for downloader, entries in downloaders:
+            logger.info(
+                '%s - %s',
+                downloader.program['title'],
+                downloader.program['id'],
+            )
+            for entry in entries:
+                logger.info('%s: %d', entry, entry.episode.number)
+        logger.warning('Dryrun, not downloading anything, bye')
+        return 0
+
+    def download(self, downloaders, sizes=None):
+        '''
+            Download the entries of each (downloader, entries) pair in
+            `downloaders` as soon as it is available. Files that expire
+            soonest go first, those that don't fit on disk are retried when
+            the others are done. Sizes are looked up unless given.
+        '''
+        if self.plan_fn:
+            return self.write_plan(downloaders)
+        if settings.dryrun:
+            return self.dryrun(downloaders)
+        if sizes is None:
+            sizes = {}
+            lookup = True
+        else:
+            lookup = False
+        expiries = {}
+        self.deferred = []
+        queue = DownloadQueue()
+        if self.sequential:
+            results = self.queue_downloads(
+                downloaders, queue, sizes, expiries, lookup
+            )
+        else:
+            with ThreadPool(8) as pool:
+                results = self.queue_downloads(
+                    downloaders, queue, sizes, expiries, lookup, pool=pool
+                )
+        if not results and not self.deferred:
+            logger.info('No entries to download, bye')
+            return 0
+        results += self.download_deferred(sizes, expiries)
+        get_bandwidth_limiter().write()
+        downloaded = len([r for r in results if r])
+        logger.warning(f'{downloaded} files downloaded')
+        return downloaded
+
+    def queue_downloads(
+        self, downloaders, queue, sizes, expiries, lookup, pool=None
+    ):
+        '''
+            Queue the files of each program as it comes in. Download threads
+            take the most urgent file from `queue`, without `pool` the queue
+            is downloaded before the next program is taken.
+        '''
+        results = []
+        for downloader, entries in downloaders:
+            jobs = [(downloader, entry) for entry in entries]
+            if not jobs:
+                continue
+            logger.warning(
+                f'Downloading {len(jobs)} files of '
+                f'{downloader.program["title"]}...'
+            )
+            if lookup:
+                sizes.update(self.get_sizes(jobs))
+            expiries.update(self.get_expiries(jobs))
+            # What is waiting in the queue will use disk space too
+            jobs, deferred = order_for_space(
+                prioritize(jobs, expiries, sizes),
+                sizes,
+                get_disk_space(self.destination).available() - queue.size,
+                keep_order=True,
+            )
+            for _, entry in deferred:
+                logger.warning(f'Not enough disk space for {entry}, deferring')
+            with self._deferred_lock:
+                self.deferred += deferred
+            keys = priorities(jobs, expiries, sizes)
+            for job in jobs:
+                queue.put(job, keys[job], sizes.get(job))
+            self.report_misses(queue.jobs(), sizes, expiries, only=jobs)
+            if pool is None:
+                while len(queue):
+                    results.append(self.download_next(queue))
+            else:
+                results += [
+                    pool.apply_async(self.download_next, (queue,))
+                    for _ in jobs
+                ]
+        if pool is None:
+            return results
+        return [result.get() for result in results]
+
+    def download_next(self, queue):
+        return self.download_file(*queue.get())
+
+    def download_file(self, downloader, entry):
+        if self.skip_lost(downloader, entry):
+            return False
+        try:
+            result = downloader.download_file(entry)
+        except NoSpace as e:
+            logger.warning(f'Deferring {entry}: {e}')
+            with self._deferred_lock:
+                self.deferred.append((downloader, entry))
+            result = False
+        return result
+
+    def download_deferred(self, sizes, expiries):
+        '''
+            Retry deferred downloads one at a time, soonest expiry first, now
+            that nothing else is being written.
+        '''
+        results = []
+        for downloader, entry in prioritize(self.deferred, expiries, sizes):
+            if self.skip_lost(downloader, entry):
+                continue
+            try:
+                results.append(downloader.download_file(entry))
+            except NoSpace as e:
+                logger.error(f'Skipping {entry}: {e}')
+        self.deferred = []
+        return results
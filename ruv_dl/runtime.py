@@ -2,6 +2,20 @@ class SettingsContainer:
     __writable__ = False
 
     dryrun = False
+    # Maximum HEAD requests per second and in parallel when crawling
+    probe_rate = 20.0
+    max_probes = 8
+    # Seconds to trust cached API responses and maximum cache size in MB
+    api_cache_ttl = 3600
+    api_cache_size = 100
+    # MB to keep free on the destination volume when downloading
+    disk_headroom = 500
+    # Download bandwidth schedule, windows (HH:MM-HH:MM=RATE) and a rate to
+    # use outside of them, see ruv_dl.bandwidth
+    bandwidth = ()
+    # Time phases of a run and optionally dump cProfile stats per phase
+    profile = False
+    profile_dir = ''
 
     def __enter__(self):
         self.__writable__ = True
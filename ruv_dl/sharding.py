@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+import json
+import os
+import logging
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+LEASE_FN = '.ruv-dl.lease'
+DEFAULT_LEASE_TTL = 60 * 60
+
+
+def parse_shard(s):
+    '''
+        Parse "I/N" (e.g. "0/3") into (index, count)
+    '''
+    try:
+        index, count = (int(part) for part in s.split('/'))
+    except ValueError:
+        raise ValueError(f'Shard must be given as I/N, got {s}')
+    if not 0 <= index < count:
+        raise ValueError(f'Shard index must be in [0, {count}), got {index}')
+    return index, count
+
+
+def in_shard(program_id, shard):
+    if shard is None:
+        return True
+    index, count = shard
+    # Same answer on every node, unlike hash()
+    return zlib.crc32(str(program_id).encode('utf-8')) % count == index
+
+
+class Lease:
+    '''
+        A lease on a program folder so only one node works on a program at
+        a time. Leases expire after `ttl` seconds unless renewed, so leases
+        left behind by crashed nodes are taken over.
+    '''
+
+    def __init__(self, directory, ttl=DEFAULT_LEASE_TTL, owner=None):
+        self.location = os.path.join(directory, LEASE_FN)
+        self.ttl = ttl
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+        self.token = uuid.uuid4().hex
+        self.held = False
+        self._renew_lock = threading.Lock()
+
+    def _contents(self):
+        return json.dumps(
+            {
+                'owner': self.owner,
+                'token': self.token,
+                'expires_at': time.time() + self.ttl,
+            }
+        )
+
+    def _read(self, location=None):
+        location = location or self.location
+        try:
+            with open(location, 'r') as f:
+                data = f.read()
+            return json.loads(data)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Still being written, or the writer crashed. Give it a full ttl
+            # from when it was created.
+            try:
+                created = os.stat(location).st_mtime
+            except FileNotFoundError:
+                return None
+            return {
+                'owner': None,
+                'token': None,
+                'expires_at': created + self.ttl,
+            }
+
+    def _create(self):
+        try:
+            fd = os.open(self.location, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(self._contents())
+        return True
+
+    def acquire(self):
+        if self._create():
+            self.held = True
+            return True
+        current = self._read()
+        if current is None:
+            # Released between our create and read
+            self.held = self._create()
+            return self.held
+        if current['expires_at'] > time.time():
+            logger.info('Lease %s held by %s', self.location, current['owner'])
+            return False
+        logger.warning(
+            'Lease %s held by %s expired, taking over',
+            self.location,
+            current['owner'],
+        )
+        stale = f'{self.location}.{self.token}'
+        try:
+            os.rename(self.location, stale)
+        except FileNotFoundError:
+            return False
+        taken = self._read(stale)
+        if taken is not None and taken['token'] != current['token']:
+            # Someone else took over before us and we moved their fresh
+            # lease, put it back unless yet another node got in between.
+            try:
+                os.link(stale, self.location)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        self.held = self._create()
+        return self.held
+
+    def renew(self):
+        with self._renew_lock:
+            current = self._read()
+            if current is None or current['token'] != self.token:
+                logger.error('Lost lease %s', self.location)
+                self.held = False
+                return False
+            tmp = f'{self.location}.{self.token}.tmp'
+            with open(tmp, 'w') as f:
+                f.write(self._contents())
+            os.replace(tmp, self.location)
+            return True
+
+    def release(self):
+        if not self.held:
+            return
+        current = self._read()
+        if current is not None and current['token'] == self.token:
+            os.remove(self.location)
+        self.held = False
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
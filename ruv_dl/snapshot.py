@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+import os
+import threading
+
+
+class FolderSnapshot:
+    '''
+        The files in a directory tree as they were when each folder was first
+        looked at. Each folder is read with a single `os.scandir` and
+        existence checks are answered from memory, on network mounts every
+        `os.path.exists` is a round trip. Folders that are known not to
+        exist aren't read at all.
+
+        Only changes made through the snapshot (`makedirs`, `add` and
+        `remove`) are seen after a folder has been read.
+    '''
+
+    def __init__(self):
+        # folder -> ({filename: DirEntry or size}, {subfolder names}) or
+        # None if it doesn't exist
+        self._folders = {}
+        self._lock = threading.RLock()
+
+    def _scan(self, folder):
+        parent, name = os.path.split(folder)
+        if name and parent in self._folders:
+            listing = self._folders[parent]
+            if listing is None or name not in listing[1]:
+                return None
+        files = {}
+        folders = set()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        folders.add(entry.name)
+                    else:
+                        files[entry.name] = entry
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return files, folders
+
+    def listing(self, folder):
+        folder = os.path.normpath(folder)
+        with self._lock:
+            if folder not in self._folders:
+                self._folders[folder] = self._scan(folder)
+            return self._folders[folder]
+
+    def exists(self, path):
+        folder, name = os.path.split(os.path.normpath(path))
+        listing = self.listing(folder)
+        return listing is not None and (
+            name in listing[0] or name in listing[1]
+        )
+
+    def size(self, path):
+        '''
+            Size of the file at `path` in bytes, None if it doesn't exist.
+        '''
+        folder, name = os.path.split(os.path.normpath(path))
+        with self._lock:
+            listing = self.listing(folder)
+            if listing is None or name not in listing[0]:
+                return None
+            size = listing[0][name]
+            if isinstance(size, os.DirEntry):
+                size = listing[0][name] = size.stat().st_size
+            return size
+
+    def makedirs(self, folder):
+        '''
+            Create `folder` and its parents unless they are known to exist.
+        '''
+        folder = os.path.normpath(folder)
+        with self._lock:
+            if self.listing(folder) is not None:
+                return
+            os.makedirs(folder, exist_ok=True)
+            self._folders[folder] = ({}, set())
+            parent, name = os.path.split(folder)
+            while name and parent in self._folders:
+                listing = self._folders[parent]
+                if listing is not None:
+                    listing[1].add(name)
+                    break
+                # Created along with `folder`
+                self._folders[parent] = ({}, {name})
+                parent, name = os.path.split(parent)
+
+    def add(self, path, size):
+        folder, name = os.path.split(os.path.normpath(path))
+        with self._lock:
+            listing = self.listing(folder)
+            if listing is not None:
+                listing[0][name] = size
+
+    def remove(self, path):
+        folder, name = os.path.split(os.path.normpath(path))
+        with self._lock:
+            listing = self.listing(folder)
+            if listing is not None:
+                listing[0].pop(name, None)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+import contextlib
+import logging
+import threading
+import time
+
+from ruv_dl.runtime import settings
+
+logger = logging.getLogger(__name__)
+
+
+def is_throttled(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+class TokenBucket:
+    '''
+        Allows `rate` tokens per second on average with bursts of up to
+        `capacity` tokens. A rate of None means unlimited and 0 means paused
+        until the rate is changed.
+    '''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate or 0, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._condition = threading.Condition()
+
+    def set_rate(self, rate, capacity=None):
+        with self._condition:
+            self._refill()
+            self.rate = rate
+            self.capacity = capacity or max(rate or 0, 1)
+            self.tokens = min(self.tokens, self.capacity)
+            self._condition.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.updated_at) * self.rate,
+            )
+        self.updated_at = now
+
+    def consume(self, tokens=1, timeout=None):
+        '''
+            Wait until `tokens` are available and take them. Returns False
+            without taking any if that takes longer than `timeout` seconds.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self.rate is not None:
+                self._refill()
+                # Requests larger than the bucket are let through when it is
+                # full and leave it in debt.
+                needed = min(tokens, self.capacity)
+                if self.rate and self.tokens >= needed:
+                    self.tokens -= tokens
+                    return True
+                # Paused until the rate is changed
+                wait = (
+                    (needed - self.tokens) / self.rate if self.rate else None
+                )
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._condition.wait(wait)
+            return True
+
+
+class AdaptiveLimiter:
+    '''
+        Limits concurrency with additive increase/multiplicative decrease.
+        The limit grows by one for every `limit` fast, successful calls and
+        is halved (at most once per `cooldown` seconds) when a call is
+        throttled or slower than `target_latency`.
+    '''
+
+    def __init__(
+        self, maximum, minimum=1, target_latency=2.0, cooldown=1.0,
+    ):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._decreased_at = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled or latency > self.target_latency:
+                if now - self._decreased_at > self.cooldown:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._decreased_at = now
+                    logger.info(
+                        'Probe concurrency decreased to %d (throttled: %s, '
+                        'latency: %.2fs)',
+                        self.limit,
+                        throttled,
+                        latency,
+                    )
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class ProbeThrottle:
+    def __init__(self, rate, max_concurrency):
+        self.bucket = TokenBucket(rate or None)
+        self.limiter = AdaptiveLimiter(max_concurrency)
+
+    @contextlib.contextmanager
+    def probe(self):
+        '''
+            Usage:
+                with throttle.probe() as probe:
+                    r = requests.head(url)
+                    probe.status_code = r.status_code
+        '''
+        self.bucket.consume()
+        self.limiter.acquire()
+        probe = Probe()
+        start = time.monotonic()
+        try:
+            yield probe
+        finally:
+            self.limiter.release(
+                time.monotonic() - start,
+                throttled=probe.status_code is None
+                or is_throttled(probe.status_code),
+            )
+
+
+class Probe:
+    status_code = None
+
+
+_probe_throttle = None
+_probe_throttle_lock = threading.Lock()
+
+
+def get_probe_throttle():
+    global _probe_throttle
+    with _probe_throttle_lock:
+        if _probe_throttle is None:
+            _probe_throttle = ProbeThrottle(
+                settings.probe_rate, settings.max_probes
+            )
+        return _probe_throttle
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import difflib
+import json
+import os
+import logging
+import threading
+import time
+
+from ruv_dl.constants import TITLE_INDEX_LOCATION, MATCH_RULES
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, EXACT, FUZZY, FAIL = MATCH_RULES
+
+# Search results are refreshed from the API once a day
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def normalize(title):
+    return ' '.join(title.casefold().split())
+
+
+def choose_program(query, programs, match):
+    '''
+        Choose a program from search results for `query` without asking.
+
+            exact - the title must match the query (ignoring case)
+            fuzzy - an exact match if there is one, else the closest title
+            fail  - an exact match or the only result, else fail
+
+        Raises LookupError if nothing can be chosen.
+    '''
+    if not programs:
+        raise LookupError(f'No programs found matching {query}')
+    exact = [p for p in programs if normalize(p['title']) == normalize(query)]
+    if len(exact) == 1:
+        return exact[0]
+    if match == FUZZY:
+        return max(
+            programs,
+            key=lambda p: difflib.SequenceMatcher(
+                None, normalize(query), normalize(p['title'])
+            ).ratio(),
+        )
+    if match == FAIL and len(programs) == 1:
+        return programs[0]
+    raise LookupError(
+        f'Could not choose between {[p["title"] for p in programs]} for '
+        f'{query}'
+    )
+
+
+class TitleIndex:
+    '''
+        Local index of program titles and search results so known queries
+        can be resolved without the API, even offline.
+    '''
+
+    def __init__(self, location=TITLE_INDEX_LOCATION, ttl=DEFAULT_TTL):
+        self.location = location
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.dirty = False
+        try:
+            with open(location, 'r') as f:
+                data = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            data = {}
+        self._titles = data.get('titles', {})
+        self._queries = data.get('queries', {})
+
+    def add_programs(self, programs):
+        with self._lock:
+            for program in programs:
+                key = normalize(program['title'])
+                value = {'id': program['id'], 'title': program['title']}
+                if self._titles.get(key) != value:
+                    self._titles[key] = value
+                    self.dirty = True
+
+    def add_search(self, query, programs):
+        self.add_programs(programs)
+        with self._lock:
+            self._queries[normalize(query)] = {
+                'ids': [program['id'] for program in programs],
+                'searched_at': time.time(),
+            }
+            self.dirty = True
+
+    def get_id(self, title):
+        with self._lock:
+            program = self._titles.get(normalize(title))
+        return program and program['id']
+
+    def has_search(self, query, fresh=True):
+        with self._lock:
+            result = self._queries.get(normalize(query))
+        if result is None:
+            return False
+        return not fresh or time.time() - result['searched_at'] < self.ttl
+
+    def search(self, query):
+        with self._lock:
+            ids = self._queries[normalize(query)]['ids']
+            by_id = {
+                program['id']: program for program in self._titles.values()
+            }
+        return [by_id[program_id] for program_id in ids if program_id in by_id]
+
+    def write(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            tmp_location = f'{self.location}.{os.getpid()}.tmp'
+            with open(tmp_location, 'w') as f:
+                f.write(
+                    json.dumps(
+                        {'titles': self._titles, 'queries': self._queries}
+                    )
+                )
+            os.replace(tmp_location, self.location)
+            self.dirty = False
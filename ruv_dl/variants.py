@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import bisect
+import threading
+
+# Episodes are either open to everyone or locked to Icelandic IP addresses,
+# and are served from a different path for each.
+OPEN = 'opid'
+CLOSED = 'lokad'
+VARIANTS = (OPEN, CLOSED)
+# Dates between two episodes found in the same variant at most this many
+# days apart are assumed to be in that variant too.
+DEFAULT_WINDOW = 60
+
+
+def variant_of(url):
+    for variant in VARIANTS:
+        if f'/{variant}/' in url:
+            return variant
+    return None
+
+
+class VariantMemory:
+    '''
+        Which variant episodes of a program were found in, by date. Only
+        dates within a run of episodes in one variant are answered, around
+        the first and last episode and where the variant changes it isn't
+        known and both should be probed.
+    '''
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self._dates = []
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._dates)
+
+    def add(self, date, variant):
+        if variant is None:
+            return
+        ordinal = date.toordinal()
+        with self._lock:
+            if ordinal not in self._variants:
+                bisect.insort(self._dates, ordinal)
+            self._variants[ordinal] = variant
+
+    def get(self, date):
+        '''
+            The variant of episodes at `date`, None if unknown.
+        '''
+        ordinal = date.toordinal()
+        with self._lock:
+            if ordinal in self._variants:
+                return self._variants[ordinal]
+            i = bisect.bisect(self._dates, ordinal)
+            if i == 0 or i == len(self._dates):
+                return None
+            before = self._dates[i - 1]
+            after = self._dates[i]
+            if after - before > self.window:
+                return None
+            if self._variants[before] != self._variants[after]:
+                return None
+            return self._variants[before]
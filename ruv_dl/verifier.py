@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import hashlib
+import os
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from ruv_dl.data import Entry
+from ruv_dl.programs import ProgramFetcher
+from ruv_dl.constants import CHECKSUM_ALGORITHM, DOWNLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+OK = 'ok'
+MISSING = 'missing'
+TRUNCATED = 'truncated'
+CORRUPT = 'corrupt'
+
+
+def hash_file(path):
+    checksum = hashlib.new(CHECKSUM_ALGORITHM)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def check_file(job):
+    '''
+        Compare the file at `path` to the recorded size and checksum.
+        Module level so it can be pickled for process pools.
+    '''
+    path, size, checksum = job
+    try:
+        actual_size = os.path.getsize(path)
+    except FileNotFoundError:
+        return path, MISSING
+    if actual_size < size:
+        return path, TRUNCATED
+    if actual_size != size or hash_file(path) != checksum:
+        return path, CORRUPT
+    return path, OK
+
+
+class Verifier:
+    def __init__(self, destination, jobs=4, processes=False):
+        self.destination = destination
+        self.jobs = jobs
+        self.processes = processes
+        self.unverifiable = 0
+
+    def get_jobs(self):
+        fetcher = ProgramFetcher(None, None, self.destination)
+        for program_info in fetcher.get_all_program_infos():
+            program = program_info.program
+            for season, entries in program_info.seasons.items():
+                season_folder = Entry.get_season_folder(
+                    self.destination, program, season
+                )
+                for entry in entries:
+                    path = os.path.join(
+                        season_folder,
+                        entry.get_target_basename(program, season),
+                    )
+                    if entry.checksum is None:
+                        logger.debug('No checksum recorded for %s', path)
+                        self.unverifiable += 1
+                        continue
+                    yield path, entry.size, entry.checksum
+
+    def verify(self):
+        '''
+            Returns a list of (path, status) for every file that failed
+            verification.
+        '''
+        pool_cls = multiprocessing.Pool if self.processes else ThreadPool
+        problems = []
+        checked = 0
+        with pool_cls(self.jobs) as pool:
+            for path, status in pool.imap_unordered(
+                check_file, self.get_jobs()
+            ):
+                checked += 1
+                if status == OK:
+                    logger.info('%s OK', path)
+                else:
+                    logger.warning('%s is %s', path, status)
+                    problems.append((path, status))
+        logger.warning(
+            '%d files verified, %d problems found, %d without checksum',
+            checked,
+            len(problems),
+            self.unverifiable,
+        )
+        return problems
@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def throughput_location(tmp_path, mocker):
+    '''
+        Downloads record the measured throughput, keep it out of the real
+        cache.
+    '''
+    location = str(tmp_path / 'throughput.json')
+    mocker.patch('ruv_dl.bandwidth.THROUGHPUT_LOCATION', location)
+    mocker.patch('ruv_dl.bandwidth._bandwidth_limiter', None)
+    return location
@@ -9,7 +9,19 @@ runner = CliRunner()
 def test_mv(fs, mocker):
     os.makedirs('/a/b/c')
     os.chdir('/a/b')
-    mover_patch = mocker.patch('ruv_dl.Mover')
+    mover_patch = mocker.patch('ruv_dl.mover.Mover')
     runner.invoke(mv, ['c', 'd'])
     mover_patch.assert_called_once_with('/a/b/c', '/a/b/d')
     mover_patch().move.assert_called_once_with()
+
+
+def test_mv_many(fs, mocker):
+    os.makedirs('/a/b/c')
+    os.makedirs('/a/b/e')
+    os.chdir('/a/b')
+    mover_patch = mocker.patch('ruv_dl.mover.BatchMover')
+    runner.invoke(mv, ['c', 'd', 'e', 'f'])
+    mover_patch.assert_called_once_with(
+        [('/a/b/c', '/a/b/d'), ('/a/b/e', '/a/b/f')]
+    )
+    mover_patch().move.assert_called_once_with()
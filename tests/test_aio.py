@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+
+from ruv_dl import aio
+from ruv_dl.data import Entry
+
+PROGRAM = {'id': 1, 'title': 'Program', 'episodes': []}
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_fetch_program(tmp_path, mocker):
+    fetcher = mocker.patch('ruv_dl.aio.ProgramFetcher')
+    fetcher().get_program_by_id.side_effect = lambda program_id: {
+        'id': program_id
+    }
+    fetcher().get_program_id.return_value = 2
+    assert run(aio.fetch_program(1, str(tmp_path))) == {'id': '1'}
+    assert run(aio.fetch_program('Program', str(tmp_path))) == {'id': 2}
+    fetcher().get_program_id.assert_called_once_with('Program')
+    fetcher().title_index.write.assert_called_once_with()
+
+
+def test_crawl_organize_and_download(tmp_path, mocker):
+    entries = [
+        Entry(
+            f'{number}A',
+            f'http://cdn/{number}.mp4',
+            datetime.datetime(2020, 1, number),
+            f'e{number}',
+            episode={'number': number},
+        )
+        for number in (1, 2)
+    ]
+    mocker.patch(
+        'ruv_dl.crawler.Crawler._iter_episodes', return_value=iter(entries)
+    )
+    get = mocker.patch('ruv_dl.downloader.network.get')
+    get.return_value = mocker.Mock(
+        ok=True,
+        headers={'content-length': '6'},
+        iter_content=lambda chunk_size: iter([b'abc', b'def']),
+    )
+    progress = []
+
+    async def sync():
+        crawled = [
+            entry
+            async for entry in aio.crawl_program(PROGRAM, cache=mocker.Mock())
+        ]
+        assert crawled == entries
+        downloader, missing = await aio.organize(
+            str(tmp_path), PROGRAM, crawled
+        )
+        assert sorted(entry.etag for entry in missing) == ['e1', 'e2']
+        results = await asyncio.gather(
+            *(
+                aio.download_entry(
+                    downloader,
+                    entry,
+                    progress=lambda done, total, etag=entry.etag: (
+                        progress.append((etag, done, total))
+                    ),
+                )
+                for entry in missing
+            )
+        )
+        assert results == [True, True]
+
+    run(sync())
+    assert sorted(progress) == [
+        ('e1', 3, 6),
+        ('e1', 6, 6),
+        ('e2', 3, 6),
+        ('e2', 6, 6),
+    ]
+    season = tmp_path / 'Program' / 'Season 1'
+    assert (season / 'Program - S01E02.mp4').read_bytes() == b'abcdef'
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from ruv_dl.api_cache import HTTPCache, CachedResponse
+
+URL = 'https://api.ruv.is/api/programs/program/1/all'
+
+
+class Response:
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.content = content
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+@pytest.fixture
+def network_get(mocker):
+    return mocker.patch('ruv_dl.api_cache.network.get')
+
+
+def test_fresh_responses_are_served_from_cache(fs, network_get):
+    network_get.return_value = Response(200, b'{"id": 1}', {'ETag': 'a'})
+    cache = HTTPCache('/cache', ttl=60)
+    assert cache.get(URL).json() == {'id': 1}
+    r = cache.get(URL)
+    assert isinstance(r, CachedResponse)
+    assert r.json() == {'id': 1}
+    assert network_get.call_count == 1
+    # Survives a restart
+    assert HTTPCache('/cache', ttl=60).get(URL).json() == {'id': 1}
+    assert network_get.call_count == 1
+
+
+def test_stale_responses_are_revalidated(fs, network_get):
+    network_get.return_value = Response(
+        200, b'{"id": 1}', {'ETag': 'a', 'Last-Modified': 'yesterday'}
+    )
+    cache = HTTPCache('/cache', ttl=0)
+    cache.get(URL)
+    network_get.return_value = Response(304)
+    assert cache.get(URL).json() == {'id': 1}
+    network_get.assert_called_with(
+        URL, headers={'If-None-Match': 'a', 'If-Modified-Since': 'yesterday'}
+    )
+
+    network_get.return_value = Response(200, b'{"id": 2}', {'ETag': 'b'})
+    assert cache.get(URL).json() == {'id': 2}
+
+
+def test_errors_are_not_cached(fs, network_get):
+    network_get.return_value = Response(500)
+    cache = HTTPCache('/cache', ttl=60)
+    assert cache.get(URL).status_code == 500
+    assert cache.get(URL).status_code == 500
+    assert network_get.call_count == 2
+
+
+def test_least_recently_used_are_evicted(fs, network_get, mocker):
+    clock = mocker.patch('ruv_dl.api_cache.time.time', return_value=0)
+    network_get.return_value = Response(200, b'{"id": 1}')
+    cache = HTTPCache('/cache', ttl=60, max_size=20)
+    cache.get(f'{URL}/a')
+    clock.return_value = 1
+    cache.get(f'{URL}/b')
+    clock.return_value = 2
+    # Touch a so b is the oldest
+    cache.get(f'{URL}/a')
+    clock.return_value = 3
+    cache.get(f'{URL}/c')
+    assert network_get.call_count == 3
+    cache.get(f'{URL}/a')
+    cache.get(f'{URL}/c')
+    assert network_get.call_count == 3
+    cache.get(f'{URL}/b')
+    assert network_get.call_count == 4
+
+
+def test_access_times_survive_a_restart(fs, network_get, mocker):
+    clock = mocker.patch('ruv_dl.api_cache.time.time', return_value=0)
+    network_get.return_value = Response(200, b'{"id": 1}')
+    cache = HTTPCache('/cache', ttl=60, max_size=20)
+    cache.get(f'{URL}/a')
+    clock.return_value = 1
+    cache.get(f'{URL}/b')
+    clock.return_value = 2
+    cache.get(f'{URL}/a')
+    assert cache.dirty
+    cache.flush()
+    assert not cache.dirty
+
+    cache = HTTPCache('/cache', ttl=60, max_size=20)
+    clock.return_value = 3
+    cache.get(f'{URL}/c')
+    # b was used least recently, not a which was fetched first
+    cache.get(f'{URL}/a')
+    assert network_get.call_count == 3
+    cache.get(f'{URL}/b')
+    assert network_get.call_count == 4
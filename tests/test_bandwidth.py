@@ -0,0 +1,137 @@
+import datetime
+import os
+import threading
+import time
+
+import click
+import pytest
+
+from ruv_dl import validate_bandwidth
+from ruv_dl.bandwidth import (
+    BandwidthLimiter,
+    Window,
+    parse_rate,
+    parse_schedule,
+)
+
+
+def at(hour, minute=0):
+    return datetime.datetime(2020, 1, 1, hour, minute)
+
+
+def test_parse_rate():
+    assert parse_rate('20Mbit') == 2500000
+    assert parse_rate('500kbit/s') == 62500
+    assert parse_rate('2MB') == 2 * 1024 ** 2
+    assert parse_rate('unlimited') is None
+    assert parse_rate('0') == 0
+    assert parse_rate('paused') == 0
+    for invalid in ('20', 'fast', '20Mbps'):
+        with pytest.raises(ValueError):
+            parse_rate(invalid)
+
+
+def test_parse_schedule():
+    windows, default = parse_schedule(
+        ['08:00-18:00=20Mbit', '22:00-06:00=unlimited', '1Mbit']
+    )
+    day, night = windows
+    assert day.rate == 2500000
+    assert night.rate is None
+    assert default == 125000
+    with pytest.raises(ValueError):
+        Window.parse('08:00=20Mbit')
+
+
+def test_rate_follows_windows():
+    limiter = BandwidthLimiter(
+        parse_schedule(['08:00-18:00=20Mbit', '22:00-06:00=0'])[0],
+        default=parse_rate('100Mbit'),
+    )
+    assert limiter.rate_at(at(8)) == 2500000
+    assert limiter.rate_at(at(18)) == 12500000
+    assert limiter.rate_at(at(23)) == 0
+    assert limiter.rate_at(at(2)) == 0
+    assert limiter.seconds_until_change(at(17, 59)) == 60
+    assert limiter.seconds_until_change(at(18)) == 4 * 3600
+    assert BandwidthLimiter().seconds_until_change(at(12)) is None
+
+
+def test_limits_shared_rate():
+    limiter = BandwidthLimiter(default=10000)
+    start = time.monotonic()
+    threads = [
+        threading.Thread(
+            target=lambda: [limiter.consume(1000) for _ in range(10)]
+        )
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # A second is in the bucket to start with, the rest takes another
+    assert time.monotonic() - start >= 0.9
+
+
+def test_paused_downloads_resume_when_window_ends(mocker):
+    limiter = BandwidthLimiter([Window(at(22).time(), at(6).time(), 0)])
+    rate_at = mocker.patch.object(limiter, 'rate_at', return_value=0)
+    mocker.patch.object(limiter, 'seconds_until_change', return_value=0.05)
+    consumed = threading.Event()
+
+    def consume():
+        limiter.consume(1000)
+        consumed.set()
+
+    thread = threading.Thread(target=consume)
+    thread.start()
+    assert not consumed.wait(0.2)
+    rate_at.return_value = None
+    assert consumed.wait(1)
+    thread.join()
+
+
+def test_throughput_is_measured_within_the_cap():
+    limiter = BandwidthLimiter()
+    assert limiter.throughput() is None
+    for second in range(3):
+        limiter._measure(1000, second + 0.5)
+    # Idle seconds don't count
+    limiter._measure(1000, 10.5)
+    assert limiter.measured == 1000
+    assert limiter.throughput() == 1000
+    limiter.default = 500
+    assert limiter.throughput() == 500
+    limiter.default = 0
+    assert limiter.throughput() is None
+
+
+def test_pause_needs_a_window():
+    assert validate_bandwidth(None, None, ['18:00-23:00=0', '1Mbit']) == (
+        '18:00-23:00=0',
+        '1Mbit',
+    )
+    assert validate_bandwidth(None, None, ['18:00-23:00=0'])
+    for paused in (['0'], ['paused', '18:00-23:00=0']):
+        with pytest.raises(click.BadParameter):
+            validate_bandwidth(None, None, paused)
+
+
+def test_throughput_is_kept_for_the_next_run(tmp_path):
+    location = str(tmp_path / 'cache' / 'throughput.json')
+    limiter = BandwidthLimiter(location=location)
+    # Nothing measured, nothing to keep
+    limiter.write()
+    assert not os.path.exists(location)
+    limiter._measure(1000, 0.5)
+    limiter._measure(1000, 1.5)
+    limiter.write()
+    limiter = BandwidthLimiter(default=500, location=location)
+    assert limiter.throughput() == 500
+    limiter.default = None
+    assert limiter.throughput() == 1000
+    # What is measured in this run wins
+    limiter._measure(2000, 0.5)
+    limiter._measure(2000, 1.5)
+    assert limiter.throughput() == 2000
@@ -0,0 +1,37 @@
+import pytest
+
+from ruv_dl.bitrate import BitratePolicy, manifest_bitrates
+
+
+def test_manifest_bitrates():
+    url = (
+        'https://ruv-vod.akamaized.net/opid/manifest.m3u8?streams='
+        '2019/06/14/2400kbps/5010563T0.mp4:2400,'
+        '2019/06/14/500kbps/5010563T0.mp4:500,'
+        '2019/06/14/1200kbps/5010563T0.mp4:1200'
+    )
+    assert manifest_bitrates(url) == [500, 1200, 2400]
+    assert manifest_bitrates('https://ruv.is/manifest.m3u8') == []
+
+
+def test_fixed_bitrate():
+    policy = BitratePolicy('2400')
+    assert policy.fixed == 2400
+    assert policy.choose([]) == 2400
+    assert BitratePolicy().fixed == 2400
+
+
+def test_highest_lowest_and_budget():
+    available = [2400, 500, 1200, 3600]
+    assert BitratePolicy('highest').choose(available) == 3600
+    assert BitratePolicy('lowest').choose(available) == 500
+    assert BitratePolicy('max:2000').choose(available) == 1200
+    # Nothing fits in the budget, cheapest it is
+    assert BitratePolicy('max:100').choose(available) == 500
+    assert BitratePolicy('highest').choose([]) is None
+
+
+def test_invalid_policy():
+    for policy in ('fast', 'max:', 'max:abc'):
+        with pytest.raises(ValueError):
+            BitratePolicy(policy)
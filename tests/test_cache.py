@@ -0,0 +1,147 @@
+import datetime
+import json
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+from ruv_dl.cache import CacheManager, DiskCache, compact_all
+from ruv_dl.constants import CACHE_VERSION_KEY
+
+FOUND = {
+    'success': True,
+    'url': 'http://smooth.ruv.cache.is/opid/2020/01/01/2400kbps/1A.mp4',
+    'etag': '"abc"',
+    'checked_at': '2020-01-02 10:00:00',
+}
+MISSING = {
+    'success': False,
+    'status_code': 404,
+    'checked_at': '2020-01-01 10:00:00',
+}
+
+
+def test_cache_round_trip(tmp_path):
+    cache = DiskCache('p', location=str(tmp_path))
+    cache.set('2020/01/01-1A', FOUND)
+    cache.set('2020/01/08-2A', MISSING)
+    cache.set('2020/01/08-2A-3600', FOUND)
+    assert not os.path.exists(cache.location)
+    cache.write()
+
+    cache = DiskCache('p', location=str(tmp_path))
+    assert not cache.dirty
+    assert cache.get('2020/01/01-1A') == FOUND
+    assert cache.get('2020/01/08-2A') == MISSING
+    assert cache.get('2020/01/08-2A-3600') == FOUND
+
+    # Changes are appended
+    cache.remove('2020/01/01-1A')
+    cache.set('2020/01/08-2A', FOUND)
+    cache.write()
+    cache = DiskCache('p', location=str(tmp_path))
+    assert not cache.has('2020/01/01-1A')
+    assert cache.get('2020/01/08-2A') == FOUND
+    assert cache.records == 5
+    assert len(cache) == 2
+
+
+def test_truncated_record_is_ignored(tmp_path):
+    cache = DiskCache('p', location=str(tmp_path))
+    cache.set('2020/01/01-1A', FOUND)
+    cache.write()
+    cache.set('2020/01/08-2A', FOUND)
+    cache.write()
+    with open(cache.location, 'rb+') as f:
+        f.truncate(os.path.getsize(cache.location) - 1)
+    cache = DiskCache('p', location=str(tmp_path))
+    assert cache.has('2020/01/01-1A')
+    assert not cache.has('2020/01/08-2A')
+
+
+def test_writes_after_a_truncated_record_stay_readable(tmp_path):
+    cache = DiskCache('p', location=str(tmp_path))
+    cache.set('2020/01/01-1A', FOUND)
+    cache.set('2020/01/08-2A', FOUND)
+    cache.write()
+    with open(cache.location, 'rb+') as f:
+        f.truncate(os.path.getsize(cache.location) - 5)
+    cache = DiskCache('p', location=str(tmp_path))
+    assert cache.dirty
+    cache.set('2020/01/15-3A', FOUND)
+    cache.set('2020/01/22-4A', MISSING)
+    cache.write()
+    cache = DiskCache('p', location=str(tmp_path))
+    assert not cache.dirty
+    assert sorted(cache._data) == [
+        '2020/01/01-1A',
+        '2020/01/15-3A',
+        '2020/01/22-4A',
+    ]
+    assert cache.get('2020/01/22-4A') == MISSING
+
+    # Garbage in a record is treated the same way
+    with open(cache.location, 'ab') as f:
+        f.write(b'\xff' * 40)
+    cache = DiskCache('p', location=str(tmp_path))
+    assert len(cache) == 3
+    assert cache.dirty
+
+
+def test_migrates_json_cache(tmp_path):
+    old = tmp_path / 'p.json'
+    old.write_text(
+        json.dumps(
+            {
+                CACHE_VERSION_KEY: '1',
+                '2020/01/01-1A': FOUND,
+                '2020/01/08-2A': MISSING,
+            }
+        )
+    )
+    (tmp_path / 'titles.json').write_text('{}')
+    # The miss was checked before it aired, it will be checked again
+    assert list(compact_all(str(tmp_path))) == [('p', 2, 1)]
+    assert not old.exists()
+    assert (tmp_path / 'titles.json').exists()
+    cache = DiskCache('p', location=str(tmp_path))
+    assert cache.get('2020/01/01-1A') == FOUND
+    assert not cache.has('2020/01/08-2A')
+
+
+def test_compact_keeps_recent_misses(tmp_path):
+    cache = DiskCache('p', location=str(tmp_path))
+    now = datetime.datetime.now()
+    # Not aired yet
+    cache.set(
+        (now + datetime.timedelta(days=7)).strftime('%Y/%m/%d-1A'), MISSING
+    )
+    # Checked after it aired, never looked for again
+    cache.set('2019/12/01-2A', MISSING)
+    cache.write()
+    assert cache.compact() == (2, 2)
+
+
+def test_cache_manager_shares_caches(tmp_path, mocker):
+    manager = CacheManager(location=str(tmp_path))
+    disk_cache = mocker.patch(
+        'ruv_dl.cache.DiskCache', side_effect=lambda *a, **kw: object()
+    )
+    with ThreadPool(4) as pool:
+        caches = pool.map(manager.get, ['p'] * 8)
+    assert all(cache is caches[0] for cache in caches)
+    assert manager.get('q') is not caches[0]
+    assert disk_cache.call_count == 2
+
+
+def test_cache_manager_writes_in_background(tmp_path):
+    manager = CacheManager(location=str(tmp_path), interval=0)
+    cache = manager.get('p')
+    cache.set('2020/01/01-1A', FOUND)
+    manager.schedule_write(cache)
+    for _ in range(100):
+        if not cache.dirty:
+            break
+        time.sleep(0.01)
+    assert DiskCache('p', location=str(tmp_path)).get('2020/01/01-1A') == FOUND
+    # Nothing left to write
+    assert manager.flush() == 0
@@ -0,0 +1,260 @@
+import datetime
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from ruv_dl.cache import DiskCache
+from ruv_dl.constants import DATETIME_FORMAT
+from ruv_dl.crawler import Crawler
+from ruv_dl.data import Entry
+from ruv_dl.singleflight import SingleFlight
+from ruv_dl.variants import CLOSED, OPEN, VARIANTS, VariantMemory
+
+PROGRAM = {'id': 'p', 'title': 'P', 'episodes': []}
+
+
+def entry(etag, episode=None):
+    return Entry('1A', 'url', datetime.datetime(2020, 1, 1), etag, episode)
+
+
+def test_iter_episodes_streams_unique_entries(mocker):
+    cache = mocker.Mock()
+    crawler = Crawler(PROGRAM, 5, 7, cache=cache)
+    found = [
+        entry('a'),
+        entry('b', {'id': 2, 'number': 2}),
+        entry('a'),
+        entry('b'),
+        # Better than the first one, has episode data
+        entry('a', {'id': 1, 'number': 1}),
+        entry('a', {'id': 1, 'number': 1}),
+    ]
+    mocker.patch.object(crawler, '_iter_episodes', return_value=iter(found))
+
+    episodes = crawler.iter_episodes()
+    assert next(episodes) is found[0]
+    cache.write.assert_not_called()
+    assert list(episodes) == [found[1], found[4]]
+    cache.write.assert_called_once_with()
+
+
+def test_search_for_episodes_returns_a_set(mocker):
+    crawler = Crawler(PROGRAM, 5, 7, cache=mocker.Mock())
+    mocker.patch.object(
+        crawler,
+        '_iter_episodes',
+        return_value=iter([entry('a'), entry('b'), entry('a')]),
+    )
+    assert {e.etag for e in crawler.search_for_episodes()} == {'a', 'b'}
+
+
+def test_single_flight_shares_calls():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow(key):
+        calls.append(key)
+        started.set()
+        release.wait()
+        return key.upper()
+
+    flights = SingleFlight()
+    with ThreadPool(4) as pool:
+        leader = pool.apply_async(flights.do, ('a', slow, 'a'))
+        started.wait()
+        followers = [
+            pool.apply_async(flights.do, ('a', slow, 'a')) for _ in range(3)
+        ]
+        while flights.shared < 3:
+            time.sleep(0.01)
+        release.set()
+        assert leader.get() == 'A'
+        assert [f.get() for f in followers] == ['A'] * 3
+    assert calls == ['a']
+    # Nothing in flight, a new call is made
+    assert flights.do('a', slow, 'a') == 'A'
+    assert calls == ['a', 'a']
+
+
+def test_overlapping_crawls_stop_early(tmp_path, mocker):
+    crawler = Crawler(
+        PROGRAM, 2, 7, cache=DiskCache('p', location=str(tmp_path))
+    )
+    found = {'0002A1', '0003A1'}
+    get_entry = mocker.patch.object(
+        crawler,
+        'get_entry',
+        side_effect=lambda date, fn: (
+            Entry(fn, 'url', date, fn) if fn in found else None
+        ),
+    )
+    date = datetime.datetime(2020, 1, 1)
+    assert [e.fn for e in crawler.crawl(date, '0001A1')] == [
+        '0002A1',
+        '0003A1',
+    ]
+    probed = get_entry.call_count
+    # Crawling forward from an episode we already crawled from is free
+    assert list(crawler.crawl(date, '0002A1')) == []
+    assert list(crawler.crawl(date, '0001A1')) == []
+    assert get_entry.call_count == probed
+
+
+def test_crawlers_share_rechecks_of_stale_misses(tmp_path, mocker):
+    cache = DiskCache('p', location=str(tmp_path))
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    dates = [today - datetime.timedelta(days=i * 7) for i in range(1, 4)]
+    crawlers = [Crawler(PROGRAM, 3, 7, cache=cache) for _ in range(4)]
+    for date in dates:
+        # Checked before they aired
+        cache.set(
+            crawlers[0].get_cache_key(date, '0001A1'),
+            {
+                'success': False,
+                'status_code': 404,
+                'checked_at': (date - datetime.timedelta(days=1)).strftime(
+                    DATETIME_FORMAT
+                ),
+            },
+        )
+    probes = []
+
+    def probe(url):
+        probes.append(url)
+        return mocker.Mock(ok=False, status_code=404)
+
+    remove = cache.remove
+
+    def slow_remove(key):
+        # Let the other crawlers find the stale miss too
+        time.sleep(0.05)
+        remove(key)
+
+    mocker.patch.object(cache, 'remove', side_effect=slow_remove)
+    for crawler in crawlers:
+        mocker.patch.object(crawler, 'probe', side_effect=probe)
+    with ThreadPool(4) as pool:
+        results = pool.map(
+            lambda crawler: [
+                crawler.get_entry(date, '0001A1') for date in dates
+            ],
+            crawlers,
+        )
+    assert results == [[None] * len(dates)] * len(crawlers)
+    # Each stale miss is rechecked once, in both variants
+    assert len(probes) == len(dates) * len(VARIANTS)
+
+
+def test_known_gaps_are_not_probed(tmp_path, mocker):
+    cache = DiskCache('p', location=str(tmp_path))
+    crawler = Crawler(PROGRAM, 3, 7, cache=cache)
+    probe = mocker.patch.object(
+        crawler, 'probe', return_value=mocker.Mock(ok=False, status_code=404)
+    )
+    seed = datetime.datetime(2020, 1, 1)
+    assert list(crawler.crawl(seed, '0001A1')) == []
+    # Both variants of each date, nothing is known about the program
+    assert probe.call_count == 3 * len(VARIANTS)
+    cache.write()
+
+    # Another seed a week later crawls an overlapping window
+    cache = DiskCache('p', location=str(tmp_path))
+    assert len(cache.gaps) == 1
+    crawler = Crawler(PROGRAM, 3, 7, cache=cache)
+    probe = mocker.patch.object(
+        crawler, 'probe', return_value=mocker.Mock(ok=False, status_code=404)
+    )
+    later = seed + datetime.timedelta(days=7)
+    assert list(crawler.crawl(later, '0001A1')) == []
+    # Only the date past the known gap is probed, the gaps are merged
+    assert probe.call_count == len(VARIANTS)
+    assert len(cache.gaps) == 1
+    assert cache.gaps.covers(
+        '0002A1', [seed, seed + datetime.timedelta(days=21)], 7
+    )
+
+    # Windows inside a gap are skipped without looking at the cache
+    crawler = Crawler(PROGRAM, 3, 7, cache=cache)
+    mocker.patch.object(crawler, 'get_entry', side_effect=AssertionError)
+    assert list(crawler.crawl(later, '0001A1')) == []
+
+
+def test_gaps_expire_like_missing_entries(tmp_path):
+    cache = DiskCache('p', location=str(tmp_path))
+    aired = datetime.datetime(2020, 1, 1)
+    cache.gaps.add('1A', [aired], 7, aired + datetime.timedelta(days=2))
+    assert cache.gaps.covers('1A', [aired], 7)
+    assert not cache.gaps.covers('1A', [aired], 1)
+    assert not cache.gaps.covers('2A', [aired], 7)
+
+    # Checked before it was supposed to air
+    upcoming = datetime.datetime.now() - datetime.timedelta(days=1)
+    cache.gaps.add('3A', [upcoming], 7, upcoming - datetime.timedelta(1))
+    assert not cache.gaps.covers('3A', [upcoming], 7)
+    cache.compact()
+    assert len(DiskCache('p', location=str(tmp_path)).gaps) == 1
+
+
+def test_gaps_reaching_past_airing_expire_as_dates_air(tmp_path):
+    cache = DiskCache('p', location=str(tmp_path))
+    day = datetime.datetime(2020, 1, 1)
+    dates = [day + datetime.timedelta(days=i * 7) for i in range(5)]
+    checked_at = day + datetime.timedelta(days=1, hours=1)
+    cache.gaps.add('1A', dates, 7, checked_at)
+    cache.gaps.compact(now=checked_at + datetime.timedelta(hours=2))
+    assert len(cache.gaps) == 1
+    # The second date has aired since, look for it again
+    cache.gaps.compact(now=day + datetime.timedelta(days=8))
+    assert len(cache.gaps) == 0
+
+
+def test_variant_memory():
+    memory = VariantMemory(window=30)
+    day = datetime.date(2020, 1, 1)
+    memory.add(day, OPEN)
+    memory.add(day + datetime.timedelta(days=14), OPEN)
+    memory.add(day + datetime.timedelta(days=21), CLOSED)
+    memory.add(day + datetime.timedelta(days=90), CLOSED)
+    assert memory.get(day) == OPEN
+    assert memory.get(day + datetime.timedelta(days=7)) == OPEN
+    # Where the variant changes, before the first and after the last
+    # episode and far from any episode it isn't known
+    assert memory.get(day + datetime.timedelta(days=18)) is None
+    assert memory.get(day - datetime.timedelta(days=7)) is None
+    assert memory.get(day + datetime.timedelta(days=97)) is None
+    assert memory.get(day + datetime.timedelta(days=50)) is None
+
+
+def test_probes_both_variants_until_known(tmp_path, mocker):
+    cache = DiskCache('p', location=str(tmp_path))
+    crawler = Crawler(PROGRAM, 3, 7, cache=cache)
+    urls = []
+
+    def probe(url):
+        urls.append(url)
+        return mocker.Mock(
+            ok=f'/{CLOSED}/' in url,
+            status_code=200,
+            url=url,
+            headers={'ETag': url},
+        )
+
+    mocker.patch.object(crawler, 'probe', side_effect=probe)
+    date = datetime.datetime(2020, 1, 1)
+    found = crawler.get_entry(date, '0001A1')
+    assert f'/{CLOSED}/' in found.url
+    assert len(urls) == 2
+    crawler.get_entry(date + datetime.timedelta(days=14), '0003A1')
+    assert len(urls) == 4
+
+    # Between two episodes in the same variant only that one is probed
+    urls.clear()
+    crawler.get_entry(date + datetime.timedelta(days=7), '0002A1')
+    assert len(urls) == 1
+    assert f'/{CLOSED}/' in urls[0]
+
+    # The variants are remembered with the cache
+    cache.write()
+    cache = DiskCache('p', location=str(tmp_path))
+    assert cache.variants.get(date + datetime.timedelta(days=3)) == CLOSED
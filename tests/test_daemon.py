@@ -0,0 +1,60 @@
+import datetime
+import os
+
+from click.testing import CliRunner
+
+from ruv_dl import serve
+from ruv_dl.daemon import next_run
+from ruv_dl.date_utils import parse_time_of_day
+from ruv_dl.programs import LibraryIndex, ProgramInfo
+
+
+def test_next_run_interval():
+    now = datetime.datetime(2020, 1, 1, 12, 0)
+    assert next_run(
+        now, interval=datetime.timedelta(minutes=30)
+    ) == datetime.datetime(2020, 1, 1, 12, 30)
+
+
+def test_next_run_aligns_to_times_of_day():
+    now = datetime.datetime(2020, 1, 1, 12, 0)
+    times = [parse_time_of_day('08:00'), parse_time_of_day('19:30')]
+    assert next_run(now, times=times) == datetime.datetime(2020, 1, 1, 19, 30)
+    now = datetime.datetime(2020, 1, 1, 20, 0)
+    assert next_run(now, times=times) == datetime.datetime(2020, 1, 2, 8, 0)
+    assert next_run(
+        now, interval=datetime.timedelta(hours=1), times=times
+    ) == datetime.datetime(2020, 1, 1, 21, 0)
+
+
+def test_library_index_only_reloads_changed_files(fs):
+    for title in ('One', 'Two'):
+        os.makedirs(f'/tv/{title}')
+        pi = ProgramInfo(f'/tv/{title}', initialize_empty=True)
+        pi.program = {'id': title, 'title': title}
+        pi.write()
+    library = LibraryIndex('/tv')
+    first = {pi.program['id']: pi for pi in library.program_infos()}
+    assert set(first) == {'One', 'Two'}
+
+    second = {pi.program['id']: pi for pi in library.program_infos()}
+    assert second['One'] is first['One']
+    assert second['Two'] is first['Two']
+
+    # Written by someone else
+    pi = ProgramInfo('/tv/Two')
+    pi.program = {'id': 'Two', 'title': 'Two', 'changed': True}
+    pi.write()
+    os.utime('/tv/Two/program_info.json', ns=(0, 0))
+    third = {pi.program['id']: pi for pi in library.program_infos()}
+    assert third['One'] is first['One']
+    assert third['Two'] is not first['Two']
+    assert third['Two'].program['changed'] is True
+    assert library.get('Two') is third['Two']
+
+
+def test_serve_rejects_zero_interval(mocker):
+    daemon = mocker.patch('ruv_dl.daemon.Daemon')
+    result = CliRunner().invoke(serve, ['--interval', '0'], obj={})
+    assert result.exit_code == 2
+    assert not daemon.called
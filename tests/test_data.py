@@ -79,3 +79,35 @@ def test_choose_best_item():
         s._choose_best_item(item2, item1).episode.to_dict()
         == episode_generated
     )
+
+
+def test_entry_file_info_roundtrip():
+    e = Entry(
+        'some_fn',
+        'some_url',
+        datetime.datetime(2017, 6, 14),
+        'some_etag',
+        checksum='abc',
+        size=3,
+    )
+    data = e.to_dict()
+    assert data['checksum'] == 'abc'
+    assert data['size'] == 3
+    e = Entry.from_dict(data)
+    assert e.checksum == 'abc'
+    assert e.size == 3
+
+
+def test_entry_set_keeps_file_info():
+    downloaded = Entry(
+        'fn', 'url', datetime.datetime.min, 'etag', checksum='abc', size=3
+    )
+    crawled = Entry(
+        'fn', 'url', datetime.datetime.min, 'etag', {'id': 'from_api'}
+    )
+    s = EntrySet([downloaded])
+    s.add(crawled)
+    assert len(s) == 1
+    assert s[0].episode.id == 'from_api'
+    assert s[0].checksum == 'abc'
+    assert s[0].size == 3
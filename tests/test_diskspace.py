@@ -0,0 +1,102 @@
+import datetime
+import errno
+
+import pytest
+
+from ruv_dl.data import Entry
+from ruv_dl.diskspace import DiskSpace, NoSpace, order_for_space
+from ruv_dl.downloader import Downloader
+from ruv_dl.runner import Runner
+
+
+@pytest.fixture
+def free_space(mocker):
+    return mocker.patch('ruv_dl.diskspace.free_space', return_value=100)
+
+
+def test_reservations_count_until_written(free_space):
+    space = DiskSpace('/', headroom=10)
+    assert space.available() == 90
+    with space.reserve(60) as reservation:
+        with pytest.raises(NoSpace):
+            space.reserve(40)
+        # What has been written is already gone from the free space
+        reservation.written = 30
+        free_space.return_value = 70
+        assert space.available() == 30
+    assert space.available() == 60
+
+
+def test_order_for_space():
+    sizes = {'a': 50, 'b': 10, 'c': 30, 'd': None}
+    ordered, deferred = order_for_space(['a', 'b', 'c', 'd'], sizes, 45)
+    assert ordered == ['b', 'c', 'd']
+    assert deferred == ['a']
+
+
+def test_runner_defers_what_does_not_fit(tmp_path, mocker, free_space):
+    sizes = {'1': 40, '2': 20, '3': 80}
+    get = mocker.patch('ruv_dl.downloader.network.get')
+    get.side_effect = lambda url, **kw: mocker.Mock(
+        ok=True,
+        headers={'content-length': str(sizes[url])},
+        iter_content=lambda chunk_size: iter([b'x' * sizes[url]]),
+    )
+    mocker.patch(
+        'ruv_dl.plan.get_size', side_effect=lambda entry: sizes[entry.url]
+    )
+    downloader = Downloader(str(tmp_path), {'id': 'p', 'title': 'P'}, [])
+    entries = []
+    for fn in sizes:
+        entry = Entry(fn, fn, datetime.datetime(2020, 1, 1), fn)
+        entry.set_target_path(str(tmp_path / fn))
+        entries.append(entry)
+    # The downloaded files use up the free space
+    free_space.side_effect = lambda path: 100 - sum(
+        f.stat().st_size for f in tmp_path.iterdir()
+    )
+    space = DiskSpace(str(tmp_path))
+    mocker.patch('ruv_dl.runner.get_disk_space', return_value=space)
+    mocker.patch('ruv_dl.downloader.get_disk_space', return_value=space)
+
+    runner = Runner(str(tmp_path), sequential=True)
+    assert runner.download([(downloader, entries)]) == 2
+    assert [call[0][0] for call in get.call_args_list] == ['2', '1', '3']
+    assert not (tmp_path / '3').exists()
+
+
+def test_deferred_downloads_expiring_soonest_first(tmp_path, mocker):
+    downloader = mocker.Mock(program={'id': 'p', 'title': 'P'})
+    downloader.download_file.return_value = True
+    jobs = [(downloader, fn) for fn in ('small', 'soon', 'later')]
+    sizes = {jobs[0]: 10, jobs[1]: 80, jobs[2]: 40}
+    expiries = {
+        jobs[1]: datetime.datetime(2020, 1, 2),
+        jobs[2]: datetime.datetime(2020, 2, 1),
+    }
+    runner = Runner(str(tmp_path))
+    runner.deferred = list(jobs)
+    assert runner.download_deferred(sizes, expiries) == [True] * 3
+    calls = downloader.download_file.call_args_list
+    assert [call[0][0] for call in calls] == ['soon', 'later', 'small']
+
+
+def test_failed_download_leaves_no_partial_file(tmp_path, mocker):
+    def iter_content(chunk_size):
+        yield b'x' * 10
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    mocker.patch(
+        'ruv_dl.downloader.network.get',
+        return_value=mocker.Mock(
+            ok=True,
+            headers={'content-length': '20'},
+            iter_content=iter_content,
+        ),
+    )
+    downloader = Downloader(str(tmp_path), {'id': 'p', 'title': 'P'}, [])
+    entry = Entry('1', '1', datetime.datetime(2020, 1, 1), '1')
+    entry.set_target_path(str(tmp_path / '1'))
+    with pytest.raises(OSError):
+        downloader.download_file(entry)
+    assert not (tmp_path / '1').exists()
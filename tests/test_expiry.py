@@ -0,0 +1,81 @@
+import datetime
+
+from ruv_dl.data import Entry
+from ruv_dl.expiry import (
+    get_expiries,
+    get_expiry,
+    predict_misses,
+    prioritize,
+)
+
+MANIFEST = (
+    'https://ruv-vod.akamaized.net/opid/manifest.m3u8?streams='
+    '2020/01/08/2400kbps/5000002A1.mp4.m3u8:2400'
+)
+
+
+class Downloader:
+    def __init__(self, program_id):
+        self.program = {'id': program_id, 'title': str(program_id)}
+
+
+def entry(day, etag, episode=None):
+    return Entry(
+        '1A', 'url', datetime.datetime(2020, 1, day), etag, episode=episode
+    )
+
+
+def test_get_expiry():
+    program = {
+        'episodes': [
+            {'id': 1, 'file': MANIFEST, 'file_expires': '2020-02-01'},
+            {'id': 2, 'file': 'broken', 'file_expires': '2020-03-01'},
+            {'id': 3, 'file': MANIFEST},
+        ]
+    }
+    expiries = get_expiries(program)
+    seed = entry(1, 'a', {'id': 9, 'file_expires': '2020-01-20'})
+    assert get_expiry(seed, expiries) == datetime.datetime(2020, 1, 20)
+    assert get_expiry(entry(1, 'b', {'id': 2}), expiries) == (
+        datetime.datetime(2020, 3, 1)
+    )
+    # Crawled entries are matched by date
+    assert get_expiry(entry(8, 'c'), expiries) == datetime.datetime(2020, 2, 1)
+    assert get_expiry(entry(15, 'd'), expiries) is None
+
+
+def test_prioritize_by_expiry_then_program_turns():
+    a, b = Downloader('a'), Downloader('b')
+    soon = datetime.datetime(2020, 1, 2)
+    later = datetime.datetime(2020, 2, 1)
+    jobs = [(a, entry(day, f'a{day}')) for day in range(1, 5)] + [
+        (b, entry(day, f'b{day}')) for day in range(1, 3)
+    ]
+    expiries = {jobs[3]: soon, jobs[2]: later}
+    sizes = {job: 10 for job in jobs}
+    sizes[jobs[1]] = 5
+    ordered = prioritize(jobs, expiries, sizes)
+    assert [e.etag for _, e in ordered] == [
+        'a4',
+        'a3',
+        # Unknown expiry, programs take turns, smaller first
+        'a2',
+        'b1',
+        'a1',
+        'b2',
+    ]
+
+
+def test_predict_misses():
+    a = Downloader('a')
+    now = datetime.datetime(2020, 1, 1, 23)
+    jobs = [(a, entry(day, f'a{day}')) for day in range(1, 4)]
+    sizes = {job: 1800 for job in jobs}
+    expiries = {
+        jobs[0]: datetime.datetime(2020, 1, 2),
+        jobs[1]: datetime.datetime(2020, 1, 2),
+        jobs[2]: None,
+    }
+    # An hour each
+    misses = predict_misses(jobs, sizes, expiries, 0.5, now=now)
+    assert misses == [(jobs[1], datetime.datetime(2020, 1, 2, 1))]
@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+
+from ruv_dl.data import Entry, EntrySet
+from ruv_dl.migrations import move_program_old_locations
+from ruv_dl.migrations.planner import plan_renames
+from ruv_dl.programs import ProgramInfo
+
+
+def temp_path(path):
+    return f'{path}.tmp'
+
+
+def apply(files, planned):
+    files = dict(files)
+    for src, dst in planned:
+        assert dst not in files, f'{src} would overwrite {dst}'
+        files[dst] = files.pop(src)
+    return files
+
+
+def test_plan_chain_moves_back_to_front():
+    moves = {'e1': 'e2', 'e2': 'e3', 'e3': 'e4'}
+    planned, blocked = plan_renames(moves, temp_path=temp_path)
+    assert planned == [('e3', 'e4'), ('e2', 'e3'), ('e1', 'e2')]
+    assert blocked == []
+    assert apply({'e1': 1, 'e2': 2, 'e3': 3}, planned) == {
+        'e2': 1,
+        'e3': 2,
+        'e4': 3,
+    }
+
+
+def test_plan_breaks_cycle_with_one_temp_move():
+    moves = {'e1': 'e2', 'e2': 'e3', 'e3': 'e1', 'e4': 'e5', 'e5': 'e4'}
+    planned, blocked = plan_renames(moves, temp_path=temp_path)
+    # One extra move for each cycle
+    assert len(planned) == len(moves) + 2
+    assert apply({'e1': 1, 'e2': 2, 'e3': 3, 'e4': 4, 'e5': 5}, planned) == {
+        'e2': 1,
+        'e3': 2,
+        'e1': 3,
+        'e5': 4,
+        'e4': 5,
+    }
+
+
+def test_plan_blocks_chains_into_occupied_destinations():
+    moves = {'e1': 'e2', 'e2': 'e3', 'e4': 'e5'}
+    planned, blocked = plan_renames(
+        moves, occupied=['e3'], temp_path=temp_path
+    )
+    assert planned == [('e4', 'e5')]
+    assert blocked == [('e2', 'e3'), ('e1', 'e2')]
+
+
+def test_plan_ignores_noop_and_rejects_duplicate_destinations():
+    assert plan_renames({'e1': 'e1'}) == ([], [])
+    with pytest.raises(ValueError):
+        plan_renames({'e1': 'e3', 'e2': 'e3'})
+
+
+def test_blocked_moves_keep_the_version(tmp_path):
+    fn = str(tmp_path / 'program_info.json')
+    program_info = ProgramInfo(fn, initialize_empty=True)
+    program_info.version = 0
+    program_info.program = {'id': 'p', 'title': 'Program'}
+    program_info.seasons = {
+        1: EntrySet(
+            [
+                Entry(
+                    '1A',
+                    'url',
+                    datetime.datetime(2020, 1, 1),
+                    'e1',
+                    episode={'number': 2},
+                )
+            ]
+        )
+    }
+    program_info.write()
+    program_info = ProgramInfo(fn)
+    season = tmp_path / 'Program' / 'Season 1'
+    season.mkdir(parents=True)
+    for number in (1, 2):
+        (season / f'Program - S01E0{number}.mp4').write_text(str(number))
+    assert move_program_old_locations(str(tmp_path), program_info) == 0
+    assert ProgramInfo(fn).version == 0
+    assert (season / 'Program - S01E01.mp4').read_text() == '1'
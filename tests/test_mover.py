@@ -1,10 +1,12 @@
 import pytest
 import os
 import datetime
+import json
 
 from ruv_dl.data import EntrySet, Entry
 from ruv_dl.programs import ProgramInfo
-from ruv_dl.mover import Mover
+from ruv_dl.mover import Mover, BatchMover, MoveJournal, JOURNAL_FN
+from ruv_dl.runtime import settings
 from ruv_dl.exceptions import NamingSchemaError, ProgramInfoError
 
 
@@ -220,3 +222,122 @@ def test_move_episode(fs):
     assert len(season) == 1
     entry = season[0]
     assert entry.episode.number == 2
+
+
+def test_batch_move_writes_program_info_once(fs, mocker):
+    os.makedirs('/tv/Program/Season 1/')
+    create_program_info(seasons={1: [1, 2]})
+    for number in (1, 2):
+        with open(f'/tv/Program/Season 1/Program - S01E0{number}.mp4', 'w'):
+            pass
+    write = mocker.spy(ProgramInfo, 'write')
+    BatchMover(
+        [
+            (
+                '/tv/Program/Season 1/Program - S01E01.mp4',
+                '/tv/Program/Season 1/Program - S01E03.mp4',
+            ),
+            (
+                '/tv/Program/Season 1/Program - S01E02.mp4',
+                '/tv/Program/Season 1/Program - S01E04.mp4',
+            ),
+        ]
+    ).move()
+    assert write.call_count == 1
+    assert sorted(os.listdir('/tv/Program/Season 1')) == [
+        'Program - S01E03.mp4',
+        'Program - S01E04.mp4',
+    ]
+    pi = ProgramInfo('/tv/Program')
+    assert sorted(e.episode.number for e in pi.seasons[1]) == [3, 4]
+    assert not os.path.exists(f'/tv/Program/{JOURNAL_FN}')
+
+
+def test_batch_move_rejects_same_destination(fs):
+    os.makedirs('/tv/Program/Season 1/')
+    create_program_info(seasons={1: [1, 2]})
+    with pytest.raises(FileExistsError):
+        BatchMover(
+            [
+                (
+                    '/tv/Program/Season 1/Program - S01E01.mp4',
+                    '/tv/Program/Season 1/Program - S01E03.mp4',
+                ),
+                (
+                    '/tv/Program/Season 1/Program - S01E02.mp4',
+                    '/tv/Program/Season 1/Program - S01E03.mp4',
+                ),
+            ]
+        )
+
+
+def test_interrupted_move_is_rolled_forward(fs, mocker):
+    os.makedirs('/tv/Program/Season 1')
+    create_program_info(seasons={1: [1, 2]})
+    for number in (1, 2):
+        with open(f'/tv/Program/Season 1/Program - S01E0{number}.mp4', 'w'):
+            pass
+    mocker.patch.object(
+        ProgramInfo, 'write', side_effect=RuntimeError('crash')
+    )
+    with pytest.raises(RuntimeError):
+        Mover('/tv/Program/Season 1', '/tv/Program/Season 2').move()
+    mocker.stopall()
+    # Files were moved but the program info was not written
+    assert os.path.exists('/tv/Program/Season 2/Program - S02E02.mp4')
+    assert 1 in ProgramInfo('/tv/Program').seasons
+    assert os.path.exists(f'/tv/Program/{JOURNAL_FN}')
+
+    # Any following move finishes the interrupted one first
+    Mover(
+        '/tv/Program/Season 2/Program - S02E02.mp4',
+        '/tv/Program/Season 2/Program - S02E03.mp4',
+    ).move()
+    assert not os.path.exists(f'/tv/Program/{JOURNAL_FN}')
+    pi = ProgramInfo('/tv/Program')
+    assert 1 not in pi.seasons
+    assert sorted(e.episode.number for e in pi.seasons[2]) == [1, 3]
+
+
+def write_journal():
+    os.makedirs('/tv/Program/Season 1')
+    pi = create_program_info(seasons={1: [1]})
+    with open('/tv/Program/Season 1/Program - S01E01.mp4', 'w'):
+        pass
+    with open(f'/tv/Program/{JOURNAL_FN}', 'w') as f:
+        f.write(
+            json.dumps(
+                {
+                    'renames': [
+                        [
+                            '/tv/Program/Season 1/Program - S01E01.mp4',
+                            '/tv/Program/Season 1/Program - S01E02.mp4',
+                        ]
+                    ],
+                    'program_info_fn': pi.fn,
+                    'program_info': pi.to_dict(),
+                }
+            )
+        )
+        f.write('\n')
+
+
+def test_recover_finishes_remaining_renames(fs):
+    write_journal()
+    MoveJournal('/tv/Program').recover()
+    assert os.path.exists('/tv/Program/Season 1/Program - S01E02.mp4')
+    assert not os.path.exists(f'/tv/Program/{JOURNAL_FN}')
+
+
+def test_recover_changes_nothing_in_dryrun(fs):
+    write_journal()
+    with settings:
+        settings.dryrun = True
+    try:
+        MoveJournal('/tv/Program').recover()
+    finally:
+        with settings:
+            settings.dryrun = False
+    assert os.path.exists('/tv/Program/Season 1/Program - S01E01.mp4')
+    assert not os.path.exists('/tv/Program/Season 1/Program - S01E02.mp4')
+    assert os.path.exists(f'/tv/Program/{JOURNAL_FN}')
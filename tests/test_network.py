@@ -0,0 +1,126 @@
+import datetime
+import email.utils
+
+import pytest
+import requests
+
+from ruv_dl import network
+from ruv_dl.network import CircuitBreaker
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(mocker):
+    mocker.patch('ruv_dl.network.time.sleep')
+    network._breakers.clear()
+
+
+def test_request_retries_connection_errors(mocker):
+    request = mocker.patch(
+        'ruv_dl.network.requests.request',
+        side_effect=[
+            requests.exceptions.ConnectionError('dns'),
+            requests.exceptions.ReadTimeout('slow'),
+            Response(200),
+        ],
+    )
+    assert network.get('http://host/path').status_code == 200
+    assert request.call_count == 3
+
+
+def test_request_gives_up(mocker):
+    mocker.patch(
+        'ruv_dl.network.requests.request',
+        side_effect=requests.exceptions.ConnectionError('down'),
+    )
+    with pytest.raises(requests.exceptions.ConnectionError):
+        network.get('http://host/path', retries=2)
+
+
+def test_request_retries_statuses(mocker):
+    request = mocker.patch(
+        'ruv_dl.network.requests.request',
+        side_effect=[Response(503), Response(404)],
+    )
+    assert network.get('http://host/path').status_code == 404
+    assert request.call_count == 2
+
+    request = mocker.patch(
+        'ruv_dl.network.requests.request', side_effect=[Response(503)],
+    )
+    r = network.head('http://host/path', retry_statuses=())
+    assert r.status_code == 503
+
+
+def test_circuit_breaker(mocker):
+    monotonic = mocker.patch('ruv_dl.network.time.monotonic', return_value=0)
+    breaker = CircuitBreaker('host', threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # First caller after the timeout gets to test the host
+    monotonic.return_value = 11
+    breaker.wait()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    monotonic.return_value = 22
+    breaker.wait()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.wait()
+
+
+def test_half_open_breaker_is_not_left_waiting(mocker):
+    monotonic = mocker.patch('ruv_dl.network.time.monotonic', return_value=0)
+    breaker = network.get_breaker('http://broken-host/')
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    monotonic.return_value = breaker.reset_timeout + 1
+    mocker.patch(
+        'ruv_dl.network.requests.request',
+        side_effect=requests.exceptions.TooManyRedirects(),
+    )
+    # The test request failed in an unexpected way, it still counts
+    with pytest.raises(requests.exceptions.TooManyRedirects):
+        network.get('http://broken-host/')
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # A tester that never reports back is replaced after the timeout
+    monotonic.return_value = 2 * breaker.reset_timeout + 2
+    breaker.wait()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    monotonic.return_value = 3 * breaker.reset_timeout + 3
+    breaker.wait()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retry_after(mocker):
+    def response(value=None):
+        headers = {} if value is None else {'Retry-After': value}
+        return mocker.Mock(headers=headers)
+
+    assert network.retry_after(response('5'), 0) == 5
+    assert network.retry_after(response('86400'), 0) == network.BACKOFF_CAP
+    assert network.retry_after(response('-3'), 0) == 0
+    assert network.retry_after(response(), 2) == 4
+    assert network.retry_after(response('soon'), 1) == 2
+    future = email.utils.format_datetime(
+        datetime.datetime.now(datetime.timezone.utc)
+        + datetime.timedelta(seconds=30),
+        usegmt=True,
+    )
+    assert 20 < network.retry_after(response(future), 0) <= 30
+    past = 'Wed, 21 Oct 2015 07:28:00 GMT'
+    assert network.retry_after(response(past), 0) == 0
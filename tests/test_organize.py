@@ -0,0 +1,89 @@
+import datetime
+
+from ruv_dl.data import Entry
+from ruv_dl.downloader import Downloader
+from ruv_dl.programs import ProgramInfo
+
+PROGRAM = {'id': 1, 'title': 'Program', 'episodes': []}
+
+
+def entry(day, etag, episode=None):
+    return Entry(
+        f'{etag}A',
+        f'http://cdn/{etag}.mp4',
+        datetime.datetime(2020, 1, day),
+        etag,
+        episode=episode,
+    )
+
+
+def first():
+    return entry(1, 'e1', episode={'id': 'a', 'number': 1})
+
+
+def organize(tmp_path, entries):
+    downloader = Downloader(str(tmp_path), PROGRAM, entries)
+    return downloader, downloader.organize()
+
+
+def test_unchanged_program_info_is_not_written(tmp_path, mocker):
+    organize(tmp_path, [first(), entry(8, 'e2')])
+    write = mocker.spy(ProgramInfo, 'write')
+    downloader, missing = organize(tmp_path, [entry(8, 'e2')])
+    assert not write.called
+    assert sorted(e.etag for e in missing) == ['e1', 'e2']
+    assert {e.target_path for e in missing} == {
+        str(tmp_path / 'Program' / 'Season 1' / f'Program - S01E0{n}.mp4')
+        for n in (1, 2)
+    }
+
+
+def test_refreshed_program_is_written(tmp_path, mocker):
+    organize(tmp_path, [first()])
+    program_info = ProgramInfo(str(tmp_path / 'Program'))
+    # The library refreshes the program in place before organizing
+    program_info.program = dict(PROGRAM, last_updated='2020-02-01')
+    downloader = Downloader(
+        str(tmp_path),
+        program_info.program,
+        [first()],
+        program_info=program_info,
+    )
+    downloader.organize()
+    assert not program_info.dirty
+    program = ProgramInfo(str(tmp_path / 'Program')).program
+    assert program['last_updated'] == '2020-02-01'
+
+
+def test_new_entries_are_placed_and_numbered(tmp_path, mocker):
+    organize(tmp_path, [first(), entry(8, 'e2')])
+    write = mocker.spy(ProgramInfo, 'write')
+    downloader, missing = organize(tmp_path, [entry(15, 'e3')])
+    assert write.call_count == 1
+    ((season, entries),) = downloader.seasons.items()
+    assert season == 1
+    assert [e.episode.number for e in entries.sorted()] == [1, 2, 3]
+
+
+def test_episode_ids_replace_crawled_entries(tmp_path, mocker):
+    organize(tmp_path, [entry(1, 'e1')])
+    write = mocker.spy(ProgramInfo, 'write')
+    downloader, _ = organize(
+        tmp_path, [entry(1, 'e1', episode={'id': 'x', 'number': 4})]
+    )
+    assert write.call_count == 1
+    (found,) = downloader.seasons[1]
+    assert found.episode.id == 'x'
+    assert found.target_path.endswith('Program - S01E04.mp4')
+
+
+def test_other_bitrates_are_not_new_episodes(tmp_path, mocker):
+    organize(tmp_path, [first(), entry(8, 'e2')])
+    write = mocker.spy(ProgramInfo, 'write')
+    # Same episodes at another bitrate have other etags
+    rendition = entry(8, 'e2-3600')
+    rendition.fn = 'e2A'
+    rendition.bitrate = 3600
+    downloader, missing = organize(tmp_path, [rendition])
+    assert not write.called
+    assert sorted(e.etag for e in missing) == ['e1', 'e2']
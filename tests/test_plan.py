@@ -0,0 +1,85 @@
+import datetime
+import json
+import os
+
+import pytest
+
+from ruv_dl.data import Entry
+from ruv_dl.downloader import Downloader
+from ruv_dl.plan import build_plan, load_downloaders, read_plan, write_plan
+from ruv_dl.programs import ProgramInfo
+from ruv_dl.runner import Runner
+
+PROGRAM = {'id': 'some-id', 'title': 'Program'}
+
+
+def organize(destination):
+    entries = [
+        Entry(
+            f'fn{number}',
+            f'http://cdn/{number}.mp4',
+            datetime.datetime(2020, 1, number),
+            f'e{number}',
+            episode={'number': number},
+        )
+        for number in (1, 2)
+    ]
+    downloader = Downloader(destination, PROGRAM, entries)
+    return [(downloader, downloader.organize())]
+
+
+def test_plan_and_execute(tmp_path, mocker):
+    destination = str(tmp_path)
+    head = mocker.patch('ruv_dl.plan.network.head')
+    head.side_effect = lambda url: mocker.Mock(
+        ok=True,
+        status_code=200,
+        headers={'content-length': '3'} if '1.mp4' in url else {},
+    )
+    plan_fn = str(tmp_path / 'plan.json')
+    runner = Runner(destination, plan_fn=plan_fn)
+    assert runner.download(organize(destination)) == 0
+
+    plan = read_plan(plan_fn)
+    assert plan['files'] == 2
+    assert plan['size'] == 3
+    assert plan['unknown_sizes'] == 1
+    assert [f['size'] for f in plan['programs'][0]['files']] == [3, None]
+
+    get = mocker.patch('ruv_dl.downloader.network.get')
+    get.return_value = mocker.Mock(
+        ok=True,
+        headers={'content-length': '3'},
+        iter_content=lambda chunk_size: iter([b'abc']),
+    )
+    assert Runner(destination).execute_plan(plan) == 2
+    assert [call[0][0] for call in get.call_args_list] == [
+        'http://cdn/1.mp4',
+        'http://cdn/2.mp4',
+    ]
+    # Checksums end up in the program info
+    program_info = ProgramInfo(os.path.join(destination, 'Program'))
+    (entries,) = program_info.seasons.values()
+    assert all(entry.size == 3 for entry in entries)
+
+
+def test_load_downloaders_without_program_info(tmp_path, mocker):
+    mocker.patch('ruv_dl.plan.get_size', return_value=None)
+    destination = str(tmp_path)
+    plan = build_plan(destination, organize(destination))
+    write_plan(str(tmp_path / 'plan.json'), plan)
+    os.remove(os.path.join(destination, 'Program', 'program_info.json'))
+
+    plan = read_plan(str(tmp_path / 'plan.json'))
+    ((downloader, entries),) = load_downloaders(plan)
+    assert downloader.program_info is None
+    assert [entry.etag for entry in entries] == ['e1', 'e2']
+    assert entries[0].target_path.endswith('Program - S01E01.mp4')
+
+
+def test_read_plan_checks_version(tmp_path):
+    plan_fn = str(tmp_path / 'plan.json')
+    with open(plan_fn, 'w') as f:
+        f.write(json.dumps({'version': 0}))
+    with pytest.raises(ValueError):
+        read_plan(plan_fn)
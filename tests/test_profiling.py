@@ -0,0 +1,91 @@
+import os
+import pstats
+import time
+
+from ruv_dl.profiling import Profiler
+
+
+def work(seconds=0.01):
+    time.sleep(seconds)
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler()
+    with profiler.span('organize', 'P') as span:
+        work(0)
+    assert span is None
+    assert list(profiler.iterate('crawl', [1, 2])) == [1, 2]
+    assert profiler.spans == []
+
+
+def test_spans_exclude_nested_time():
+    profiler = Profiler(enabled=True)
+
+    def entries():
+        work()
+        yield 1
+        work()
+        yield 2
+
+    with profiler.span('organize', 'P'):
+        crawled = profiler.iterate('crawl', entries(), program='P')
+        assert sorted(crawled) == [1, 2]
+    crawl, organize = profiler.spans
+    assert (crawl.name, organize.name) == ('crawl', 'organize')
+    assert crawl.duration >= 0.02
+    assert organize.child_time == crawl.duration
+    assert organize.self_time < crawl.duration
+    report = profiler.report()
+    assert 'crawl' in report
+    assert 'P: crawl' in report
+
+
+def test_iterate_per_item():
+    profiler = Profiler(enabled=True)
+    programs = [{'title': 'A'}, {'title': 'B'}]
+    fetched = list(
+        profiler.iterate(
+            'fetch', programs, program=lambda program: program['title']
+        )
+    )
+    assert fetched == programs
+    assert [(s.name, s.program) for s in profiler.spans] == [
+        ('fetch', 'A'),
+        ('fetch', 'B'),
+    ]
+
+
+def test_hooks_get_spans_without_recording():
+    profiler = Profiler()
+    seen = []
+    profiler.add_hook(seen.append)
+    profiler.add_hook(lambda span: 1 / 0)
+    with profiler.span('download', 'P'):
+        work(0)
+    assert [(s.name, s.program) for s in seen] == [('download', 'P')]
+    assert profiler.spans == []
+
+
+def test_dumps_stats_per_phase(tmp_path):
+    profiler = Profiler(enabled=True, profile_dir=str(tmp_path))
+    for _ in range(2):
+        with profiler.span('organize', 'P'):
+            # Nested spans are timed but not profiled separately
+            with profiler.span('download', 'P'):
+                work()
+    (fn,) = profiler.dump_stats()
+    assert fn == os.path.join(str(tmp_path), 'organize.pstats')
+    stats = pstats.Stats(fn)
+    assert any(func[2] == 'work' for func in stats.stats)
+
+
+def test_iterate_is_profiled_on_its_own(tmp_path):
+    profiler = Profiler(enabled=True, profile_dir=str(tmp_path))
+
+    def programs():
+        work()
+        yield {'title': 'A'}
+
+    list(profiler.iterate('fetch', programs(), program=lambda p: p['title']))
+    (fn,) = profiler.dump_stats()
+    assert fn.endswith('fetch.pstats')
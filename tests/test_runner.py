@@ -0,0 +1,57 @@
+import datetime
+import threading
+
+from ruv_dl.runner import DownloadQueue, Runner
+
+
+def test_downloads_start_while_other_programs_crawl(tmp_path, mocker):
+    mocker.patch('ruv_dl.runner.get_cache_manager')
+    space = mocker.patch('ruv_dl.runner.get_disk_space').return_value
+    space.available.return_value = 1000
+    downloaded = threading.Event()
+    downloaders = {}
+    for program_id in ('fast', 'slow'):
+        downloaders[program_id] = mocker.Mock(
+            program={'id': program_id, 'title': program_id}
+        )
+    downloaders['fast'].download_file.side_effect = lambda entry: (
+        downloaded.set() or True
+    )
+    downloaders['slow'].download_file.return_value = True
+
+    def crawl_and_organize(program):
+        if program['id'] == 'slow':
+            # Only done crawling once the other program is downloaded
+            assert downloaded.wait(5)
+        return downloaders[program['id']], [f'{program["id"]}1']
+
+    runner = Runner(str(tmp_path))
+    mocker.patch.object(
+        runner, 'crawl_and_organize', side_effect=crawl_and_organize
+    )
+    mocker.patch.object(
+        runner, 'get_sizes', side_effect=lambda jobs: {j: 10 for j in jobs}
+    )
+    mocker.patch.object(runner, 'get_expiries', return_value={})
+    programs = [downloaders['slow'].program, downloaders['fast'].program]
+    assert runner.run(programs) == 2
+    downloaders['slow'].download_file.assert_called_once_with('slow1')
+
+
+def test_queue_takes_most_urgent_first():
+    queue = DownloadQueue()
+    never = datetime.datetime.max
+    queue.put('a1', (never, 0, 10), 10)
+    queue.put('a2', (never, 1, 10), 10)
+    # Queued later but expires soon
+    queue.put('b1', (datetime.datetime(2020, 1, 1), 0, 50), 50)
+    queue.put('c1', (never, 0, 20), None)
+    assert queue.size == 70
+    assert queue.jobs() == ['b1', 'a1', 'c1', 'a2']
+    assert [queue.get() for _ in range(len(queue))] == [
+        'b1',
+        'a1',
+        'c1',
+        'a2',
+    ]
+    assert queue.size == 0
@@ -0,0 +1,100 @@
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from ruv_dl.runner import Runner
+from ruv_dl.sharding import Lease, LEASE_FN, in_shard, parse_shard
+
+
+def test_parse_shard():
+    assert parse_shard('0/3') == (0, 3)
+    assert parse_shard('2/3') == (2, 3)
+    for invalid in ('3/3', '-1/3', 'a/3', '1'):
+        with pytest.raises(ValueError):
+            parse_shard(invalid)
+
+
+def test_every_program_is_in_exactly_one_shard():
+    for program_id in list(range(100)) + ['abc', 'def']:
+        shards = [i for i in range(3) if in_shard(program_id, (i, 3))]
+        assert len(shards) == 1
+        # Deterministic
+        assert in_shard(program_id, (shards[0], 3))
+    assert in_shard(1, None)
+
+
+def test_lease_is_exclusive(tmp_path):
+    first = Lease(str(tmp_path), owner='first')
+    second = Lease(str(tmp_path), owner='second')
+    assert first.acquire()
+    assert not second.acquire()
+    assert first.renew()
+    first.release()
+    assert not os.path.exists(os.path.join(str(tmp_path), LEASE_FN))
+    assert second.acquire()
+    second.release()
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    crashed = Lease(str(tmp_path), ttl=-1, owner='crashed')
+    assert crashed.acquire()
+    lease = Lease(str(tmp_path), owner='new')
+    assert lease.acquire()
+    with open(os.path.join(str(tmp_path), LEASE_FN)) as f:
+        assert json.loads(f.read())['owner'] == 'new'
+    # The crashed node must not be able to renew or remove our lease
+    assert not crashed.renew()
+    crashed.release()
+    assert os.path.exists(os.path.join(str(tmp_path), LEASE_FN))
+    lease.release()
+
+
+def try_acquire(args):
+    directory, hold_for = args
+    lease = Lease(directory)
+    if lease.acquire():
+        time.sleep(hold_for)
+        lease.release()
+        return 1
+    return 0
+
+
+def test_one_process_wins_lease(tmp_path):
+    with multiprocessing.Pool(4) as pool:
+        results = pool.map(try_acquire, [(str(tmp_path), 0.5)] * 8)
+    assert sum(results) == 1
+
+
+def test_runner_stops_downloading_after_losing_lease(tmp_path, mocker):
+    program = {'id': 'p', 'title': 'Program'}
+    runner = Runner(str(tmp_path), lease_ttl=-1)
+    assert runner.acquire_lease(program)
+    downloader = mocker.Mock(program=program)
+    downloader.download_file.return_value = True
+    assert runner.download_file(downloader, 'e1')
+    # Another node takes over the expired lease
+    assert Lease(str(tmp_path / 'Program'), owner='other').acquire()
+    assert not runner.download_file(downloader, 'e2')
+    runner.deferred = [(downloader, 'e3')]
+    assert runner.download_deferred({}, {}) == []
+    downloader.download_file.assert_called_once_with('e1')
+
+
+def test_lease_is_taken_when_the_program_is_crawled(tmp_path, mocker):
+    crawler = mocker.patch('ruv_dl.runner.Crawler')
+    downloader = mocker.patch('ruv_dl.runner.Downloader').return_value
+    downloader.organize.return_value = []
+    program = {'id': 'p', 'title': 'Program'}
+    runner = Runner(str(tmp_path), lease_ttl=60)
+    other = Lease(str(tmp_path / 'Program'), owner='other')
+    (tmp_path / 'Program').mkdir()
+    assert other.acquire()
+    assert runner.crawl_and_organize(program) is None
+    assert not crawler.called
+    other.release()
+    assert runner.crawl_and_organize(program) == (downloader, [])
+    assert 'p' in runner.leases
+    runner.release_leases()
@@ -0,0 +1,69 @@
+import datetime
+import os
+
+from ruv_dl.data import Entry
+from ruv_dl.downloader import Downloader
+from ruv_dl.snapshot import FolderSnapshot
+
+PROGRAM = {'id': 1, 'title': 'Program', 'episodes': []}
+
+
+def test_reads_each_folder_once(tmp_path, mocker):
+    season = tmp_path / 'Program' / 'Season 1'
+    season.mkdir(parents=True)
+    (season / 'a.mp4').write_bytes(b'abc')
+    scandir = mocker.spy(os, 'scandir')
+    snapshot = FolderSnapshot()
+    assert snapshot.exists(str(season / 'a.mp4'))
+    assert not snapshot.exists(str(season / 'b.mp4'))
+    assert snapshot.size(str(season / 'a.mp4')) == 3
+    assert snapshot.size(str(season / 'b.mp4')) is None
+    assert scandir.call_count == 1
+    # Folders missing from a folder that has been read aren't read
+    assert not snapshot.exists(str(tmp_path / 'Program' / 'Season 2'))
+    assert not snapshot.exists(str(tmp_path / 'Program' / 'Season 2' / 'a'))
+    assert scandir.call_count == 2
+
+
+def test_makedirs_only_when_missing(tmp_path, mocker):
+    snapshot = FolderSnapshot()
+    folder = str(tmp_path / 'Program' / 'Season 1')
+    assert not snapshot.exists(folder)
+    makedirs = mocker.spy(os, 'makedirs')
+    snapshot.makedirs(folder)
+    assert makedirs.called
+    makedirs.reset_mock()
+    snapshot.makedirs(folder)
+    assert not makedirs.called
+    assert os.path.isdir(folder)
+    assert snapshot.exists(folder)
+    snapshot.add(os.path.join(folder, 'a.mp4'), 3)
+    assert snapshot.size(os.path.join(folder, 'a.mp4')) == 3
+    snapshot.remove(os.path.join(folder, 'a.mp4'))
+    assert not snapshot.exists(os.path.join(folder, 'a.mp4'))
+
+
+def test_organize_creates_folders_lazily(tmp_path):
+    season = tmp_path / 'Program' / 'Season 1'
+    season.mkdir(parents=True)
+    (season / 'Program - S01E01.mp4').write_bytes(b'abc')
+    entries = [
+        Entry(
+            f'{number}A',
+            f'http://cdn/{number}.mp4',
+            datetime.datetime(2020, 1, number),
+            f'e{number}',
+            episode={'number': number},
+        )
+        for number in (1, 2)
+    ]
+    downloader = Downloader(str(tmp_path), PROGRAM, entries)
+    (missing,) = downloader.organize()
+    assert missing.etag == 'e2'
+    assert (tmp_path / 'Program' / 'program_info.json').exists()
+
+    entries[0].date = datetime.datetime(2021, 1, 1)
+    downloader = Downloader(str(tmp_path), PROGRAM, entries[:1])
+    downloader.organize()
+    # Nothing has been downloaded into the new season
+    assert not (tmp_path / 'Program' / 'Season 2').exists()
@@ -0,0 +1,54 @@
+import subprocess
+import sys
+
+# Modules only needed when talking to the network or running pools. These
+# must not be imported for local commands such as `mv`.
+HEAVY_MODULES = (
+    'requests',
+    'urllib3',
+    'multiprocessing',
+    'ruv_dl.crawler',
+    'ruv_dl.downloader',
+    'ruv_dl.runner',
+    'ruv_dl.migrations',
+)
+# Generous, this is to catch regressions like importing requests again
+IMPORT_TIME_BUDGET_US = 500000
+
+
+def import_times(statement):
+    '''
+        Parse `python -X importtime` output into
+        {module: cumulative microseconds}
+    '''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:') :].split('|')
+        if not cumulative.strip().isdigit():
+            # Header line
+            continue
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_import_is_light():
+    times = import_times('import ruv_dl')
+    assert 'ruv_dl' in times
+    for module in HEAVY_MODULES:
+        assert module not in times, f'{module} imported at startup'
+    assert times['ruv_dl'] < IMPORT_TIME_BUDGET_US
+
+
+def test_mover_import_is_light():
+    times = import_times('import ruv_dl, ruv_dl.mover')
+    for module in HEAVY_MODULES:
+        assert module not in times, f'{module} imported by mover'
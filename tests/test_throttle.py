@@ -0,0 +1,59 @@
+import threading
+import time
+
+from ruv_dl.throttle import AdaptiveLimiter, TokenBucket, is_throttled
+
+
+def test_is_throttled():
+    assert is_throttled(429)
+    assert is_throttled(503)
+    assert not is_throttled(200)
+    assert not is_throttled(404)
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(100, capacity=1)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.consume()
+    # First token is free, then 10 at 100/s
+    assert time.monotonic() - start >= 0.09
+
+
+def test_token_bucket_unlimited_and_paused():
+    bucket = TokenBucket(None)
+    for _ in range(1000):
+        bucket.consume()
+
+    bucket = TokenBucket(0)
+    consumed = threading.Event()
+
+    def consume():
+        bucket.consume()
+        consumed.set()
+
+    thread = threading.Thread(target=consume)
+    thread.start()
+    assert not consumed.wait(0.1)
+    bucket.set_rate(1000)
+    assert consumed.wait(1)
+    thread.join()
+
+
+def test_adaptive_limiter_aimd():
+    limiter = AdaptiveLimiter(8, cooldown=0)
+    assert limiter.limit == 8
+    limiter.acquire()
+    limiter.release(0.1, throttled=True)
+    assert limiter.limit == 4
+    limiter.acquire()
+    limiter.release(10)
+    assert limiter.limit == 2
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(0.1)
+    assert 2 < limiter.limit <= 8
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(0.1, throttled=True)
+    assert limiter.limit == 1
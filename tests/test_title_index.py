@@ -0,0 +1,84 @@
+import pytest
+import requests
+
+from ruv_dl.programs import ProgramFetcher
+from ruv_dl.title_index import (
+    EXACT,
+    FAIL,
+    FUZZY,
+    TitleIndex,
+    choose_program,
+)
+
+PROGRAMS = [
+    {'id': 1, 'title': 'Krakkafréttir'},
+    {'id': 2, 'title': 'Fréttir'},
+    {'id': 3, 'title': 'Íþróttafréttir'},
+]
+
+
+def test_choose_program():
+    assert choose_program('fréttir', PROGRAMS, EXACT)['id'] == 2
+    assert choose_program('krakkafrettir', PROGRAMS, FUZZY)['id'] == 1
+    assert choose_program('Spaugstofan', PROGRAMS[:1], FAIL)['id'] == 1
+    with pytest.raises(LookupError):
+        choose_program('krakkafrettir', PROGRAMS, EXACT)
+    with pytest.raises(LookupError):
+        choose_program('krakkafrettir', PROGRAMS, FAIL)
+    with pytest.raises(LookupError):
+        choose_program('fréttir', [], FUZZY)
+
+
+def test_title_index_survives_restart(tmp_path):
+    location = str(tmp_path / 'titles.json')
+    index = TitleIndex(location)
+    index.add_search('fréttir', PROGRAMS)
+    index.write()
+
+    index = TitleIndex(location)
+    assert index.get_id('  FRÉTTIR ') == 2
+    assert index.has_search('Fréttir')
+    assert index.search('fréttir') == PROGRAMS
+    assert not TitleIndex(location, ttl=0).has_search('fréttir')
+    assert TitleIndex(location, ttl=0).has_search('fréttir', fresh=False)
+
+
+@pytest.fixture
+def api_get(mocker):
+    api_cache = mocker.patch('ruv_dl.api_cache.get_api_cache')
+    return api_cache.return_value.get
+
+
+def test_queries_resolve_without_asking(tmp_path, mocker, api_get):
+    search = mocker.Mock(json=lambda: {'programs': PROGRAMS})
+    api_get.side_effect = lambda url: (
+        search
+        if '/search/' in url
+        else mocker.Mock(ok=True, json=lambda: {'id': int(url.split('/')[-2])})
+    )
+    mocker.patch('builtins.input', side_effect=AssertionError)
+    fetcher = ProgramFetcher(
+        ['fréttir', 'krakkafrettir', 'spaugstofan'],
+        destination=str(tmp_path),
+        match=EXACT,
+        title_index=TitleIndex(str(tmp_path / 'titles.json')),
+    )
+    # Unresolvable queries are skipped
+    assert list(fetcher.get_programs()) == [{'id': 2}]
+
+
+def test_known_queries_resolve_offline(tmp_path, mocker, api_get):
+    location = str(tmp_path / 'titles.json')
+    index = TitleIndex(location, ttl=0)
+    index.add_search('krakka', PROGRAMS[:1])
+    index.write()
+    api_get.side_effect = requests.exceptions.ConnectionError
+    fetcher = ProgramFetcher(
+        destination=str(tmp_path),
+        match=FAIL,
+        title_index=TitleIndex(location, ttl=0),
+    )
+    assert fetcher.get_program_id('krakka') == 1
+    assert fetcher.get_program_id('Krakkafréttir') == 1
+    with pytest.raises(requests.exceptions.ConnectionError):
+        fetcher.get_program_id('spaugstofan')
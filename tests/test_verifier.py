@@ -0,0 +1,61 @@
+import datetime
+import hashlib
+import os
+
+from ruv_dl.data import EntrySet, Entry
+from ruv_dl.programs import ProgramInfo
+from ruv_dl.verifier import Verifier, MISSING, TRUNCATED, CORRUPT
+
+
+def episode_path(root, number):
+    return os.path.join(
+        root, 'Program', 'Season 1', f'Program - S01E0{number}.mp4'
+    )
+
+
+def create_library(root, files):
+    os.makedirs(os.path.join(root, 'Program', 'Season 1'))
+    pi = ProgramInfo(os.path.join(root, 'Program'), initialize_empty=True)
+    pi.program = {'id': 'some-id', 'title': 'Program'}
+    entries = []
+    for number, (recorded, actual) in enumerate(files, start=1):
+        entries.append(
+            Entry(
+                '',
+                '',
+                datetime.datetime(2020, 1, number),
+                f'e{number}',
+                episode={'number': number},
+                checksum=recorded and hashlib.sha256(recorded).hexdigest(),
+                size=recorded and len(recorded),
+            )
+        )
+        if actual is not None:
+            path = episode_path(root, number)
+            with open(path, 'wb') as f:
+                f.write(actual)
+    pi.seasons = {1: EntrySet(entries)}
+    pi.write()
+
+
+def test_verify_reports_problems(tmp_path):
+    # Pools don't work with pyfakefs, so use a real temporary directory
+    root = str(tmp_path)
+    create_library(
+        root,
+        [
+            (b'intact', b'intact'),
+            (b'missing', None),
+            (b'truncated', b'trunc'),
+            (b'corrupt', b'corrupX'),
+            (None, b'no checksum'),
+        ],
+    )
+    verifier = Verifier(root, jobs=2)
+    problems = sorted(verifier.verify())
+    assert problems == [
+        (episode_path(root, 2), MISSING),
+        (episode_path(root, 3), TRUNCATED),
+        (episode_path(root, 4), CORRUPT),
+    ]
+    assert verifier.unverifiable == 1